@@ -1,5 +1,8 @@
 from aamp.aamp import *
 from aamp.parameters import *
+from aamp.patching import *
+from aamp.diffing import *
+from aamp.merging import *
 
 from . import _version
 __version__ = _version.get_versions()['version']
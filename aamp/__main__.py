@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import glob
 import io
+import mmap
 import os
 import sys
 import typing
@@ -8,24 +11,272 @@ import yaml
 
 import aamp
 import aamp.converters
+import aamp.json_util
+import aamp.yaml_loader
+import aamp.yaml_util as yu
+import aamp.yaz0
+from aamp.diffing import diff
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.botw_numbered_names import get_numbered_name_list
+from aamp.name_cache import get_name_cache, set_name_cache
+from aamp.stats import Stats, disable_stats, enable_stats, get_stats
 
-def do_aamp_to_yml(input_data: bytes, output: typing.BinaryIO) -> None:
-    output.write(aamp.converters.aamp_to_yml(input_data))
+_YAML_EXTENSIONS = ('.yml', '.yaml')
+# Unlike the library, the command line tool uses the persistent name cache unless --no-name-cache is passed.
+_aamp_to_yaml = aamp.converters.AampToYaml(use_name_cache=True)
+_aamp_to_json = aamp.converters.AampToJson(use_name_cache=True)
+_JSON_EXTENSION = '.json'
 
-def do_yml_to_aamp(input_data: bytes, output: typing.BinaryIO) -> None:
-    output.write(aamp.converters.yml_to_aamp(input_data))
+def do_aamp_to_yml(input_data: typing.Union[bytes, mmap.mmap], output: typing.BinaryIO) -> None:
+    output.write(_aamp_to_yaml.convert(input_data))
+
+def do_yml_to_aamp(input_data: typing.Union[bytes, mmap.mmap], output: typing.BinaryIO, yaz0_level: typing.Optional[int] = None) -> None:
+    output.write(_compress(aamp.converters.yml_to_aamp(input_data), yaz0_level))
+
+def do_aamp_to_json(input_data: typing.Union[bytes, mmap.mmap], output: typing.BinaryIO) -> None:
+    output.write(_aamp_to_json.convert(input_data))
+
+def do_json_to_aamp(input_data: typing.Union[bytes, mmap.mmap], output: typing.BinaryIO, yaz0_level: typing.Optional[int] = None) -> None:
+    output.write(_compress(aamp.converters.json_to_aamp(input_data), yaz0_level))
+
+def is_aamp(data: typing.Union[bytes, mmap.mmap]) -> bool:
+    """Returns whether data is a binary archive, which may be Yaz0-compressed."""
+    if aamp.yaz0.is_yaz0(data):
+        # The first chunks of Yaz0 data are always literals, so the magic can be checked without decompressing.
+        return len(data) > 0x14 and data[0x10] & 0xf0 == 0xf0 and data[0x11:0x15] == b'AAMP'
+    return len(data) > 0x30 and data[0:8] == b'AAMP\x02\x00\x00\x00'
+
+def is_json(data: typing.Union[bytes, mmap.mmap]) -> bool:
+    # YAML documents start with the !io tag, JSON documents with an object.
+    return data[0:64].lstrip(b'\xef\xbb\xbf \t\r\n')[0:1] == b'{'
+
+def _is_compressed_path(path: str) -> bool:
+    # The extensions of Yaz0-compressed files start with "s" (e.g. .sbaiprog).
+    return os.path.splitext(path)[1].startswith('.s')
+
+def _compress(data: bytes, yaz0_level: typing.Optional[int]) -> bytes:
+    return aamp.yaz0.compress(data, yaz0_level) if yaz0_level is not None else data
+
+def _map_file(path: str) -> typing.Union[bytes, mmap.mmap]:
+    """Maps a file into memory instead of reading it, so that large inputs do not increase RSS."""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _is_batch_source(src: str) -> bool:
+    return os.path.isdir(src) or glob.has_magic(src)
+
+def _find_batch_sources(src: str) -> typing.Tuple[str, typing.List[str]]:
+    """Returns the base directory and the list of files to convert for a directory or glob."""
+    if os.path.isdir(src):
+        base = src
+        paths = (os.path.join(root, name) for root, _, names in os.walk(src) for name in names)
+    else:
+        base = os.path.dirname(src[:min(src.find(c) for c in '*?[' if c in src)])
+        paths = (p for p in glob.iglob(src, recursive=True) if os.path.isfile(p))
+    return (base, sorted(paths))
+
+def _init_batch_worker(use_name_cache: bool) -> None:
+    if not use_name_cache:
+        set_name_cache(None)
+    # Load the name tables once per worker rather than once per file.
+    get_hash_to_name_map()
+    get_numbered_name_list()
+
+def _convert_batch_file(src: str, dst_base: str, to_json: bool = False, yaz0: bool = False,
+                        yaz0_level: int = aamp.yaz0.DEFAULT_LEVEL) -> typing.Optional[str]:
+    """Converts src and writes the result next to dst_base.
+    Binary archives are Yaz0-compressed if yaz0 is True or if their extension starts with "s".
+    Returns the destination path, or None if the file was skipped."""
+    input_data = _map_file(src)
+    try:
+        if is_aamp(input_data):
+            if to_json:
+                dst = dst_base + _JSON_EXTENSION
+                output_data = _aamp_to_json.convert(input_data)
+            else:
+                dst = dst_base + '.yml'
+                output_data = _aamp_to_yaml.convert(input_data)
+        elif dst_base.endswith(_JSON_EXTENSION) or dst_base.endswith(_YAML_EXTENSIONS):
+            dst = os.path.splitext(dst_base)[0]
+            if dst_base.endswith(_JSON_EXTENSION):
+                output_data = aamp.converters.json_to_aamp(input_data)
+            else:
+                output_data = aamp.converters.yml_to_aamp(input_data)
+            if yaz0 or _is_compressed_path(dst):
+                output_data = aamp.yaz0.compress(output_data, yaz0_level)
+        else:
+            return None
+    finally:
+        if isinstance(input_data, mmap.mmap):
+            input_data.close()
+
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    with open(dst, 'wb') as output:
+        output.write(output_data)
+    return dst
+
+def _convert_batch_file_with_stats(src: str, dst_base: str, to_json: bool, yaz0: bool,
+                                   yaz0_level: int) -> typing.Tuple[typing.Optional[str], dict]:
+    """Same as _convert_batch_file, but also returns the statistics for the file (for worker processes)."""
+    stats = enable_stats()
+    try:
+        return (_convert_batch_file(src, dst_base, to_json, yaz0, yaz0_level), stats.to_dict())
+    finally:
+        disable_stats()
+
+def _merge_batch_stats(stats: Stats, result: typing.Optional[str], file_stats: dict) -> typing.Optional[str]:
+    stats.merge(file_stats)
+    return result
+
+def _convert_batch(src: str, dst: str, jobs: typing.Optional[int], use_name_cache: bool, to_json: bool = False,
+                   yaz0: bool = False, yaz0_level: int = aamp.yaz0.DEFAULT_LEVEL) -> int:
+    base, paths = _find_batch_sources(src)
+    if dst == '-':
+        sys.stderr.write('error: a destination directory is required when converting multiple files\n')
+        return 1
+
+    failures: typing.List[typing.Tuple[str, str]] = []
+    num_converted = 0
+    jobs_args = [(path, os.path.join(dst, os.path.relpath(path, base))) for path in paths]
+
+    def handle_result(path: str, get_result: typing.Callable[[], typing.Optional[str]]) -> None:
+        nonlocal num_converted
+        try:
+            if get_result() is not None:
+                num_converted += 1
+        except Exception as e:
+            failures.append((path, f'{type(e).__name__}: {e}'))
+
+    if jobs == 1:
+        for path, dst_base in jobs_args:
+            handle_result(path, lambda: _convert_batch_file(path, dst_base, to_json, yaz0, yaz0_level))
+    else:
+        stats = get_stats()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(use_name_cache,)) as executor:
+            if stats is None:
+                futures = [(path, executor.submit(_convert_batch_file, path, dst_base, to_json, yaz0, yaz0_level)) for path, dst_base in jobs_args]
+                for path, future in futures:
+                    handle_result(path, future.result)
+            else:
+                # Statistics are collected in the worker processes and added up here.
+                futures = [(path, executor.submit(_convert_batch_file_with_stats, path, dst_base, to_json, yaz0, yaz0_level)) for path, dst_base in jobs_args]
+                for path, future in futures:
+                    handle_result(path, lambda: _merge_batch_stats(stats, *future.result()))
+
+    sys.stderr.write(f'converted {num_converted} file(s), {len(failures)} failure(s)\n')
+    for path, error in failures:
+        sys.stderr.write(f'  {path}: {error}\n')
+    return 1 if failures else 0
+
+def _load_for_diff(path: str, strings: typing.Dict[int, str]) -> aamp.ParameterIO:
+    data = _map_file(path)
+    if not is_aamp(data):
+        if is_json(data):
+            return aamp.json_util.load(bytes(data))
+        return aamp.yaml_loader.load(data)
+    file_reader = aamp.Reader(data, track_strings=True)
+    pio = file_reader.parse(compact=True)
+    strings.update(file_reader._crc32_to_string_map)
+    return pio
+
+def _format_change_path(a: aamp.ParameterIO, b: aamp.ParameterIO, path: tuple, strings: typing.Dict[int, str]) -> str:
+    """Resolves the names of the components of a change path."""
+    if isinstance(path[0], str):
+        return path[0]
+    names = [get_hash_to_name_map().get(path[0], path[0])]
+    name_cache = get_name_cache()
+    nodes: typing.List[typing.Any] = [a.lists.get(path[0]), b.lists.get(path[0])]
+    parent_crc32 = path[0]
+    for k in path[1:]:
+        items = None
+        for node in nodes:
+            if isinstance(node, aamp.ParameterList):
+                items = node.lists if k in node.lists else node.objects if k in node.objects else None
+            elif isinstance(node, aamp.ParameterObject):
+                items = node.params if k in node.params else None
+            if items is not None:
+                break
+        idx = list(items).index(k) if items is not None else 0
+        names.append(yu.get_pstruct_name(strings, idx, k, parent_crc32, name_cache))
+        nodes = [node.lists.get(k) or node.objects.get(k) if isinstance(node, aamp.ParameterList) else None for node in nodes]
+        parent_crc32 = k
+    return '/'.join(str(name) for name in names)
+
+def _format_diff_value(value: typing.Any) -> str:
+    if isinstance(value, aamp.ParameterList):
+        return '(list)'
+    if isinstance(value, aamp.ParameterObject):
+        return '(object)'
+    if isinstance(value, float):
+        return yu.format_float(value)
+    return repr(value)
+
+def _diff_main(a_path: str, b_path: str) -> int:
+    # Strings from both archives are used to resolve names.
+    strings: typing.Dict[int, str] = dict()
+    a = _load_for_diff(a_path, strings)
+    b = _load_for_diff(b_path, strings)
+    changes = diff(a, b)
+    # Names are only resolved for the changed paths.
+    for change in changes:
+        path = _format_change_path(a, b, change.path, strings)
+        if change.kind == 'added':
+            sys.stdout.write(f'+ {path}: {_format_diff_value(change.new)}\n')
+        elif change.kind == 'removed':
+            sys.stdout.write(f'- {path}: {_format_diff_value(change.old)}\n')
+        else:
+            sys.stdout.write(f'~ {path}: {_format_diff_value(change.old)} -> {_format_diff_value(change.new)}\n')
+    name_cache = get_name_cache()
+    if name_cache is not None:
+        name_cache.flush()
+    return 1 if changes else 0
+
+def _write_stats(path: typing.Optional[str]) -> None:
+    stats = get_stats()
+    if path is None or stats is None:
+        return
+    if path == '-':
+        sys.stderr.write(stats.to_json() + '\n')
+    else:
+        with open(path, 'w') as f:
+            f.write(stats.to_json() + '\n')
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description='Converts Nintendo parameter archives (AAMP) to a binary or YAML form')
-    parser.add_argument('source', help='Path to a YAML or AAMP file')
-    parser.add_argument('destination', help='Path to destination (if source file was YAML, it will be converted to AAMP and vice versa)', nargs='?', default='-')
+    parser = argparse.ArgumentParser(description='Converts Nintendo parameter archives (AAMP) to a binary, YAML or JSON form')
+    parser.add_argument('source', nargs='?', help='Path to a YAML, JSON or AAMP (optionally Yaz0-compressed) file, or a directory or glob pattern to convert every AAMP, YAML or JSON file it contains')
+    parser.add_argument('destination', help='Path to destination (if source file was YAML or JSON, it will be converted to AAMP and vice versa). Must be a directory if source is a directory or glob pattern', nargs='?', default='-')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes for directory or glob sources (default: number of CPUs)')
+    parser.add_argument('--no-name-cache', action='store_true', help='Do not use or update the persistent cache of resolved names')
+    parser.add_argument('--json', action='store_true', help='Convert binary archives to JSON instead of YAML (default if the destination ends with .json)')
+    parser.add_argument('--yaz0', action='store_true', help='Yaz0-compress binary archives (default if the extension of the destination starts with s, e.g. .sbaiprog)')
+    parser.add_argument('--yaz0-level', type=int, choices=range(10), default=aamp.yaz0.DEFAULT_LEVEL, metavar='0-9',
+                        help=f'Yaz0 compression level, from 0 (fastest) to 9 (smallest) (default: {aamp.yaz0.DEFAULT_LEVEL})')
+    parser.add_argument('--stats', metavar='PATH', help='Write statistics (node counts, deduplication, name resolution, time per phase) as JSON to PATH (- for stderr)')
+    parser.add_argument('--diff', nargs=2, metavar=('A', 'B'), help='Show the parameters, objects and lists that were added, removed or changed between two archives (AAMP, YAML or JSON) instead of converting. Exits with status 1 if there are differences')
     args = parser.parse_args()
 
+    if args.no_name_cache:
+        set_name_cache(None)
+    if args.diff:
+        if args.source is not None:
+            parser.error('cannot convert a source and use --diff at the same time')
+        sys.exit(_diff_main(*args.diff))
+    if args.source is None:
+        parser.error('the following arguments are required: source')
+    if args.stats:
+        enable_stats()
+
     src: str = args.source
     dst: str = args.destination
 
-    with sys.stdin.buffer if src == '-' else open(src, 'rb') as file:
-        input_data = file.read()
+    if src != '-' and _is_batch_source(src):
+        status = _convert_batch(src, dst, args.jobs, not args.no_name_cache, args.json, args.yaz0, args.yaz0_level)
+        _write_stats(args.stats)
+        sys.exit(status)
+
+    input_data = sys.stdin.buffer.read() if src == '-' else _map_file(src)
 
     if src != '-':
         dst = dst.replace('!!', os.path.splitext(src)[0])
@@ -33,11 +284,30 @@ def main() -> None:
         sys.stderr.write('error: cannot use !! (for input filename) when reading from stdin\n')
         sys.exit(1)
 
-    output = sys.stdout.buffer if dst == '-' else open(dst, 'wb')
-    if len(input_data) <= 0x30 or input_data[0:8] != b'AAMP\x02\x00\x00\x00':
-        do_yml_to_aamp(input_data, output)
+    output = io.BytesIO()
+    try:
+        if is_aamp(input_data):
+            if args.json or dst.endswith(_JSON_EXTENSION):
+                do_aamp_to_json(input_data, output)
+            else:
+                do_aamp_to_yml(input_data, output)
+        else:
+            yaz0_level = args.yaz0_level if args.yaz0 or (dst != '-' and _is_compressed_path(dst)) else None
+            if is_json(input_data):
+                do_json_to_aamp(input_data, output, yaz0_level)
+            else:
+                do_yml_to_aamp(input_data, output, yaz0_level)
+    finally:
+        if isinstance(input_data, mmap.mmap):
+            input_data.close()
+
+    # The destination is only opened after the conversion because it may be the (memory-mapped) source file.
+    if dst == '-':
+        sys.stdout.buffer.write(output.getvalue())
     else:
-        do_aamp_to_yml(input_data, output)
+        with open(dst, 'wb') as f:
+            f.write(output.getvalue())
+    _write_stats(args.stats)
 
 if __name__ == '__main__':
     main()
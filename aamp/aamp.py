@@ -1,25 +1,73 @@
 # Copyright 2018 leoetlino <leo@leolam.fr>
 # Licensed under GPLv2+
-from collections import deque, defaultdict
+import array
+from collections import defaultdict
 from enum import IntFlag
+import heapq
 import io
+import mmap
+import os
+import struct
 import typing
 import zlib
 
 from aamp.parameters import *
+from aamp.parameters import _BUFFER_PARAMETER_TYPES, _CURVE_STRUCTS, _STRING_PARAMETER_TYPES
+from aamp.stats import get_stats as _get_stats, timer as _timer
+import aamp.yaz0 as yaz0
 from aamp.util import *
 
 class HeaderFlags(IntFlag):
     LittleEndian = 1 << 0
     UTF8 = 1 << 1
 
+# Binary layouts of the file, list, object and parameter headers.
+_LIST_HEADER = struct.Struct('<IHHHH') # crc32, lists offset, list count, objects offset, object count
+_OBJ_HEADER = struct.Struct('<IHH') # crc32, params offset, param count
+_FILE_HEADER = struct.Struct('<4s11I')
+_PARAM_HEADER = struct.Struct('<II') # crc32, data offset (24 bits) | type (8 bits)
+# (relative offset, count) pair that references child headers.
+_CHILD_REF = struct.Struct('<HH')
+_VEC2 = struct.Struct('<2f')
+_VEC3 = struct.Struct('<3f')
+_VEC4 = struct.Struct('<4f')
+
+# Sizes of the encoded values that have a fixed size.
+_VALUE_SIZES = {
+    ParameterType.Bool: 4, ParameterType.F32: 4, ParameterType.Int: 4, ParameterType.U32: 4,
+    ParameterType.Vec2: 8, ParameterType.Vec3: 12, ParameterType.Vec4: 16, ParameterType.Color: 16, ParameterType.Quat: 16,
+    ParameterType.Curve1: 0x80, ParameterType.Curve2: 0x100, ParameterType.Curve3: 0x180, ParameterType.Curve4: 0x200,
+}
+# Maximum string lengths (-1 if unlimited).
+_STRING_MAX_LENGTHS = {
+    ParameterType.String32: 32, ParameterType.String64: 64, ParameterType.String256: 256, ParameterType.StringRef: -1,
+}
+_BUFFER_ITEM_SIZES = {
+    ParameterType.BufferInt: 4, ParameterType.BufferF32: 4, ParameterType.BufferU32: 4, ParameterType.BufferBinary: 1,
+}
+
+_Buffer = typing.Union[bytes, bytearray, memoryview, mmap.mmap]
+
 class Reader:
-    def __init__(self, data: bytes, track_strings: bool = False) -> None:
+    """Reads a binary parameter archive.
+
+    data can be any object that supports the buffer protocol (bytes, bytearray, mmap, memoryview...).
+    If offset is non-zero, the archive starts at that offset in data. Archive data is never copied
+    as a whole, so an archive can be read straight out of a larger file or container.
+    Yaz0-compressed archives are decompressed into memory first.
+    """
+    def __init__(self, data: _Buffer, track_strings: bool = False, offset: int = 0) -> None:
+        if offset != 0 or not isinstance(data, (bytes, bytearray, mmap.mmap)):
+            data = memoryview(data).cast('B')[offset:]
+        if yaz0.is_yaz0(data):
+            data = yaz0.decompress(data)
         self._data = data
+        # Slices of memoryviews and bytearrays are not bytes and need to be copied before they are returned.
+        self._is_view = type(data) is memoryview or type(data) is bytearray
         self._crc32_to_string_map: typing.Dict[int, str] = dict()
         self._track_strings = track_strings
 
-        magic = self._data[0:4]
+        magic = self._get_bytes(0, 4)
         if magic != b'AAMP':
             raise ValueError("Invalid magic: %s (expected 'AAMP')" % magic)
 
@@ -29,62 +77,172 @@ class Reader:
         if (flags & HeaderFlags.UTF8) == 0:
             raise ValueError('Only UTF-8 parameter archives are supported')
 
-    def parse(self) -> ParameterIO:
+    @classmethod
+    def from_file(cls, path: str, track_strings: bool = False, offset: int = 0) -> 'Reader':
+        """Creates a Reader for the archive at offset in the file at path.
+
+        The file is memory-mapped rather than read into memory.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(b'', track_strings, offset)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, track_strings, offset)
+
+    def _get_bytes(self, start: int, end: int) -> bytes:
+        if self._is_view:
+            return bytes(self._data[start:end])
+        return self._data[start:end]
+
+    def _find_nul(self, offset: int) -> int:
+        """Returns the offset of the first null byte at or after offset, or -1."""
+        if type(self._data) is not memoryview:
+            return self._data.find(b'\0', offset)
+        # memoryview has no find(); search in small copied chunks.
+        chunk_size = 64
+        while offset < len(self._data):
+            i = bytes(self._data[offset:offset + chunk_size]).find(b'\0')
+            if i != -1:
+                return offset + i
+            offset += chunk_size
+            chunk_size *= 4
+        return -1
+
+    def parse(self, lazy: bool = False, compact: bool = False) -> ParameterIO:
+        """Parse the archive.
+
+        If lazy is True, lists, objects and parameters are only decoded when they are
+        first accessed (see LazyParameterList and LazyParameterObject).
+        If compact is True, objects keep their parameters in encoded form (see CompactParameterObject).
+        """
+        if lazy and compact:
+            raise ValueError('Lazy and compact parsing cannot be combined')
+        stats = _get_stats()
+        if stats is None:
+            return self._parse_archive(lazy, compact)
+        with stats.timer('reader.parse'):
+            param_io = self._parse_archive(lazy, compact)
+        stats.add_counts(self._count_nodes())
+        return param_io
+
+    def _parse_archive(self, lazy: bool, compact: bool) -> ParameterIO:
         param_io = ParameterIO()
-        param_io.type = get_string(self._data, 0x30)
+        param_io.type = self._get_bytes(0x30, self._find_nul(0x30)).decode('utf-8')
         param_io.version = get_u32(self._data, 0x10)
         format_len = get_u32(self._data, 0x14)
-        root_crc32, root_list = self._parse_list(0x30 + format_len)
+        if lazy:
+            root_list = LazyParameterList(self, 0x30 + format_len)
+            param_io.lists[root_list._crc32] = root_list
+            return param_io
+        root_crc32, root_list = self._parse_list(0x30 + format_len, compact)
         param_io.lists[root_crc32] = root_list
         return param_io
 
-    def _parse_list(self, offset: int) -> typing.Tuple[int, ParameterList]:
+    def _count_nodes(self) -> typing.Dict[str, int]:
+        """Returns statistics about the archive (size and number of lists, objects and parameters of each type)."""
+        header = _FILE_HEADER.unpack_from(self._data, 0)
+        format_len, num_lists, num_objs, num_params = header[5], header[6], header[7], header[8]
+        params_start = 0x30 + format_len + _LIST_HEADER.size*num_lists + _OBJ_HEADER.size*num_objs
+        counts = {'reader.archives': 1, 'reader.bytes': header[3], 'reader.lists': num_lists,
+                  'reader.objects': num_objs, 'reader.params': num_params}
+        param_headers = self._get_bytes(params_start, params_start + _PARAM_HEADER.size*num_params)
+        for _, field_4 in _PARAM_HEADER.iter_unpack(param_headers):
+            key = 'reader.params.' + ParameterType(field_4 >> 24).name
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _get_child_offsets(self, offset: int, field_offset: int, entry_size: int) -> range:
+        """Returns the offsets of the child headers that are referenced by the
+        (relative offset, count) pair at offset + field_offset."""
+        rel_offset, count = _CHILD_REF.unpack_from(self._data, offset + field_offset)
+        start = offset + 4*rel_offset
+        return range(start, start + entry_size*count, entry_size)
+
+    def _index_children(self, offset: int, field_offset: int, entry_size: int) -> typing.Dict[int, int]:
+        return {get_u32(self._data, o): o for o in self._get_child_offsets(offset, field_offset, entry_size)}
+
+    def _parse_list(self, offset: int, compact: bool = False) -> typing.Tuple[int, ParameterList]:
         param_list = ParameterList()
-        crc32 = get_u32(self._data, offset + 0)
+        crc32, list_rel_offset, list_count, obj_rel_offset, obj_count = _LIST_HEADER.unpack_from(self._data, offset)
         param_list._crc32 = crc32
 
-        obj_offset = offset + 4*get_u16(self._data, offset + 8)
-        obj_count = get_u16(self._data, offset + 0xa)
+        parse_obj = self._parse_compact_obj if compact else self._parse_obj
+        obj_offset = offset + 4*obj_rel_offset
         for i in range(obj_count):
-            obj_crc32, obj = self._parse_obj(obj_offset)
+            obj_crc32, obj = parse_obj(obj_offset)
             param_list.objects[obj_crc32] = obj
-            obj_offset += 8
+            obj_offset += _OBJ_HEADER.size
 
-        list_offset = offset + 4*get_u16(self._data, offset + 4)
-        list_count = get_u16(self._data, offset + 6)
+        list_offset = offset + 4*list_rel_offset
         for i in range(list_count):
-            list_crc32, plist = self._parse_list(list_offset)
+            list_crc32, plist = self._parse_list(list_offset, compact)
             param_list.lists[list_crc32] = plist
-            list_offset += 0xc
+            list_offset += _LIST_HEADER.size
 
         return (crc32, param_list)
 
     def _parse_obj(self, offset: int) -> typing.Tuple[int, ParameterObject]:
         param_obj = ParameterObject()
-        crc32 = get_u32(self._data, offset + 0)
+        crc32, param_rel_offset, param_count = _OBJ_HEADER.unpack_from(self._data, offset)
         param_obj._crc32 = crc32
 
-        param_offset = offset + 4*get_u16(self._data, offset + 4)
-        param_count = get_u16(self._data, offset + 6)
+        param_offset = offset + 4*param_rel_offset
         for i in range(param_count):
             param_crc32, param = self._parse_param(param_offset)
             param_obj.params[param_crc32] = param
-            param_offset += 8
+            param_offset += _PARAM_HEADER.size
 
         return (crc32, param_obj)
 
+    def _parse_compact_obj(self, offset: int) -> typing.Tuple[int, ParameterObject]:
+        crc32 = get_u32(self._data, offset)
+        keys = array.array('I')
+        types = bytearray()
+        values: typing.List[bytes] = []
+        for param_offset in self._get_child_offsets(offset, 4, _PARAM_HEADER.size):
+            param_crc32, field_4 = _PARAM_HEADER.unpack_from(self._data, param_offset)
+            param_type = field_4 >> 24
+            keys.append(param_crc32)
+            types.append(param_type)
+            values.append(self._get_encoded_value(param_type, param_offset + 4 * (field_4 & 0xffffff)))
+        param_obj = CompactParameterObject.from_encoded(keys, bytes(types), values)
+        param_obj._crc32 = crc32
+        return (crc32, param_obj)
+
+    def _get_encoded_value(self, param_type: int, data_offset: int) -> bytes:
+        """Returns a parameter value in the form that is used by CompactParameterObject."""
+        size = _VALUE_SIZES.get(param_type)
+        if size is not None:
+            return self._get_bytes(data_offset, data_offset + size)
+
+        max_length = _STRING_MAX_LENGTHS.get(param_type)
+        if max_length is not None:
+            string_len = self._find_nul(data_offset) - data_offset
+            if max_length != -1:
+                string_len = min(string_len, max_length)
+            b = self._get_bytes(data_offset, data_offset + string_len)
+            if self._track_strings:
+                self._register_string(b, b.decode())
+            return b + b'\0'
+
+        item_size = _BUFFER_ITEM_SIZES.get(param_type)
+        if item_size is not None:
+            count = get_u32(self._data, data_offset - 4)
+            return self._get_bytes(data_offset - 4, data_offset + item_size*count)
+
+        raise ValueError('Unknown parameter type: %u' % param_type)
+
     def _parse_param_str(self, offset: int, data_offset: int, str_class, max_size: int) -> typing.Any:
-        data_size = self._data.find(0, data_offset) - data_offset
+        data_size = self._find_nul(data_offset) - data_offset
         string_len = data_size if max_size == -1 else min(data_size, max_size)
-        b = self._data[data_offset:data_offset + string_len]
+        b = self._get_bytes(data_offset, data_offset + string_len)
         s = b.decode()
         if self._track_strings:
             self._register_string(b, s)
         return str_class(s)
 
     def _parse_param(self, offset: int) -> typing.Tuple[int, typing.Any]:
-        crc32 = get_u32(self._data, offset)
-        field_4 = get_u32(self._data, offset + 4)
+        crc32, field_4 = _PARAM_HEADER.unpack_from(self._data, offset)
         data_offset = offset + 4 * (field_4 & 0xffffff)
         param_type = field_4 >> 24
         value: typing.Any = None
@@ -93,13 +251,13 @@ class Reader:
             value = get_u32(self._data, data_offset) != 0
 
         elif param_type == ParameterType.Vec2:
-            value = Vec2(get_f32(self._data, data_offset), get_f32(self._data, data_offset + 4))
+            value = Vec2(*_VEC2.unpack_from(self._data, data_offset))
         elif param_type == ParameterType.Vec3:
-            value = Vec3(get_f32(self._data, data_offset), get_f32(self._data, data_offset + 4), get_f32(self._data, data_offset + 8))
+            value = Vec3(*_VEC3.unpack_from(self._data, data_offset))
         elif param_type == ParameterType.Vec4:
-            value = Vec4(get_f32(self._data, data_offset), get_f32(self._data, data_offset + 4), get_f32(self._data, data_offset + 8), get_f32(self._data, data_offset + 0xc))
+            value = Vec4(*_VEC4.unpack_from(self._data, data_offset))
         elif param_type == ParameterType.Color:
-            value = Color(get_f32(self._data, data_offset), get_f32(self._data, data_offset + 4), get_f32(self._data, data_offset + 8), get_f32(self._data, data_offset + 0xc))
+            value = Color(*_VEC4.unpack_from(self._data, data_offset))
 
         elif param_type == ParameterType.String32:
             value = self._parse_param_str(offset, data_offset, String32, 32)
@@ -115,31 +273,26 @@ class Reader:
         or param_type == ParameterType.Curve3 \
         or param_type == ParameterType.Curve4:
             num_curves = param_type - ParameterType.Curve1 + 1
-            value = Curve()
-            for i in range(num_curves):
-                value.v.extend(get_u32(self._data, data_offset + 0x80*i + 4*x) for x in range(2))
-                value.v.extend(get_f32(self._data, data_offset + 0x80*i + 8 + 4*x) for x in range(30))
+            value = Curve(list(_CURVE_STRUCTS[num_curves - 1].unpack_from(self._data, data_offset)))
 
         elif param_type == ParameterType.Quat:
             # Quat parameters receive additional processing after being loaded:
             # depending on what parameters are passed to the apply function,
             # there may be linear interpolation going on.
             # We currently ignore all of that stuff.
-            value = Quat(*[get_f32(self._data, data_offset + 4*i) for i in range(4)])
+            value = Quat(*_VEC4.unpack_from(self._data, data_offset))
 
         elif param_type == ParameterType.Int:
             value = get_s32(self._data, data_offset)
         elif param_type == ParameterType.BufferInt:
-            value = [None] * get_u32(self._data, data_offset - 4)
-            for i in range(len(value)):
-                value[i] = get_s32(self._data, data_offset + 4*i)
+            count = get_u32(self._data, data_offset - 4)
+            value = list(struct.unpack_from('<%di' % count, self._data, data_offset))
 
         elif param_type == ParameterType.U32:
             value = U32(get_u32(self._data, data_offset))
         elif param_type == ParameterType.BufferU32:
-            value = [None] * get_u32(self._data, data_offset - 4)
-            for i in range(len(value)):
-                value[i] = U32(get_u32(self._data, data_offset + 4*i))
+            count = get_u32(self._data, data_offset - 4)
+            value = list(map(U32, struct.unpack_from('<%dI' % count, self._data, data_offset)))
 
         elif param_type == ParameterType.F32:
             # There's some trickery going on in the parse function -- floats can
@@ -147,13 +300,12 @@ class Reader:
             # Though this shouldn't really matter since we target BotW parameter archives.
             value = get_f32(self._data, data_offset)
         elif param_type == ParameterType.BufferF32:
-            value = [None] * get_u32(self._data, data_offset - 4)
-            for i in range(len(value)):
-                value[i] = get_f32(self._data, data_offset + 4*i)
+            count = get_u32(self._data, data_offset - 4)
+            value = list(struct.unpack_from('<%df' % count, self._data, data_offset))
 
         elif param_type == ParameterType.BufferBinary:
             buffer_size = get_u32(self._data, data_offset - 4)
-            value = self._data[data_offset:data_offset + buffer_size]
+            value = self._get_bytes(data_offset, data_offset + buffer_size)
 
         else:
             raise ValueError('Unknown parameter type: %u' % param_type)
@@ -163,151 +315,289 @@ class Reader:
     def _register_string(self, b: bytes, s: str) -> None:
         self._crc32_to_string_map[zlib.crc32(b)] = s
 
-class _ListWriteContext(typing.NamedTuple):
-    list_offset_writer: PlaceholderOffsetWriter
-    obj_offset_writer: PlaceholderOffsetWriter
-    plist: ParameterList
-
-class _ObjWriteContext(typing.NamedTuple):
-    param_offset_writer: PlaceholderOffsetWriter
-    pobj: ParameterObject
+class LazyParameterObject(ParameterObject):
+    """A ParameterObject that decodes its parameters from the archive on first access."""
+    __slots__ = ('_reader', '_offset', '_params', '_param_index', '_decoded_params')
+    def __init__(self, reader: Reader, offset: int) -> None:
+        self._reader = reader
+        self._offset = offset
+        self._crc32 = get_u32(reader._data, offset)
+        self._params: typing.Optional[typing.Dict[int, typing.Any]] = None
+        self._param_index: typing.Optional[typing.Dict[int, int]] = None
+        self._decoded_params: typing.Dict[int, typing.Any] = dict()
+
+    @property
+    def params(self) -> typing.Dict[int, typing.Any]: # type: ignore
+        if self._params is None:
+            params: typing.Dict[int, typing.Any] = dict()
+            for o in self._reader._get_child_offsets(self._offset, 4, 8):
+                crc32 = get_u32(self._reader._data, o)
+                if crc32 in self._decoded_params:
+                    params[crc32] = self._decoded_params[crc32]
+                else:
+                    params[crc32] = self._reader._parse_param(o)[1]
+            self._params = params
+            self._decoded_params.clear()
+        return self._params
+
+    @params.setter
+    def params(self, params: typing.Dict[int, typing.Any]) -> None:
+        self._params = params
+
+    def param(self, name: str):
+        if self._params is not None:
+            return super().param(name)
+        crc32 = zlib.crc32(name.encode())
+        value = self._decoded_params.get(crc32, self._decoded_params)
+        if value is self._decoded_params:
+            if self._param_index is None:
+                self._param_index = self._reader._index_children(self._offset, 4, 8)
+            value = self._reader._parse_param(self._param_index[crc32])[1]
+            self._decoded_params[crc32] = value
+        return value
+
+class LazyParameterList(ParameterList):
+    """A ParameterList that decodes its child lists and objects from the archive on first access.
+
+    Children are themselves lazy, so looking up a single value only reads the headers
+    that are on the path to it.
+    """
+    __slots__ = ('_reader', '_offset', '_lists', '_objects')
+    def __init__(self, reader: Reader, offset: int) -> None:
+        self._reader = reader
+        self._offset = offset
+        self._crc32 = get_u32(reader._data, offset)
+        self._lists: typing.Optional[typing.Dict[int, ParameterList]] = None
+        self._objects: typing.Optional[typing.Dict[int, ParameterObject]] = None
+
+    @property
+    def lists(self) -> typing.Dict[int, ParameterList]: # type: ignore
+        if self._lists is None:
+            self._lists = dict()
+            for o in self._reader._get_child_offsets(self._offset, 4, 0xc):
+                plist = LazyParameterList(self._reader, o)
+                self._lists[plist._crc32] = plist
+        return self._lists
+
+    @lists.setter
+    def lists(self, lists: typing.Dict[int, ParameterList]) -> None:
+        self._lists = lists
+
+    @property
+    def objects(self) -> typing.Dict[int, ParameterObject]: # type: ignore
+        if self._objects is None:
+            self._objects = dict()
+            for o in self._reader._get_child_offsets(self._offset, 8, 8):
+                pobj = LazyParameterObject(self._reader, o)
+                self._objects[pobj._crc32] = pobj
+        return self._objects
+
+    @objects.setter
+    def objects(self, objects: typing.Dict[int, ParameterObject]) -> None:
+        self._objects = objects
+
+class _ValuePool:
+    """Deduplicated parameter values for the data section.
+
+    A value is stored at the first pooled value (in insertion order) in which the first
+    occurrence of its bytes is at a 4-byte aligned sub-offset, or appended to the pool if
+    there is no such value. Aligned substrings of pooled values are indexed so that lookups
+    only need to check the pooled values that may contain the value. Values that are larger
+    than _MAX_INDEXED_VALUE_SIZE (typically buffers) only have their distinct aligned 32-bit words
+    indexed, so that writing large buffers takes time linear in their size.
+    """
+    # Aligned substrings of 4, 8, ... up to this many bytes are indexed...
+    _MAX_INDEXED_SUBSTRING_SIZE = 16
+    # ...for pooled values that are not larger than this.
+    _MAX_INDEXED_VALUE_SIZE = 0x40
+    _WORD = struct.Struct('=I')
+
+    def __init__(self) -> None:
+        # Pooled values and the (sub-offset, parameter index) pairs that refer to them.
+        self.values: typing.List[typing.Tuple[bytes, typing.List[typing.Tuple[int, int]]]] = list()
+        # Aligned substring -> indices of the indexed values that contain it, in insertion order.
+        self._index: typing.DefaultDict[bytes, typing.List[int]] = defaultdict(list)
+        # Aligned word -> index of the first value that is larger than _MAX_INDEXED_VALUE_SIZE and contains it...
+        self._large_index: typing.Dict[int, int] = dict()
+        # ...and indices of the following ones, in insertion order.
+        self._large_index_more: typing.DefaultDict[int, typing.List[int]] = defaultdict(list)
+        # Final locations (value index, sub-offset) of values that have already been added.
+        self._locations: typing.Dict[bytes, typing.Tuple[int, int]] = dict()
+
+    def add(self, data: bytes, param_idx: int) -> None:
+        location = self._locations.get(data)
+        if location is None:
+            location = self._find(data)
+            if location is None:
+                location = (len(self.values), 0)
+                self.values.append((data, []))
+                self._register(location[0], data)
+            self._locations[data] = location
+        idx, offset = location
+        self.values[idx][1].append((offset, param_idx))
+
+    def _find(self, data: bytes) -> typing.Optional[typing.Tuple[int, int]]:
+        candidates: typing.Iterable[int]
+        if len(data) < 4:
+            candidates = range(len(self.values))
+        else:
+            key = data[:min(len(data) & ~3, self._MAX_INDEXED_SUBSTRING_SIZE)]
+            candidates = self._index.get(key, ())
+            if self._large_index:
+                word = self._WORD.unpack_from(data)[0]
+                first = self._large_index.get(word)
+                if first is not None:
+                    candidates = heapq.merge(candidates, [first], self._large_index_more.get(word, ()))
+        for idx in candidates:
+            offset = self.values[idx][0].find(data)
+            # Sub-offset must be divisible by 4 in order to be representable.
+            if offset != -1 and offset % 4 == 0:
+                return (idx, offset)
+        return None
+
+    def _register(self, idx: int, data: bytes) -> None:
+        if len(data) > self._MAX_INDEXED_VALUE_SIZE:
+            # Set operations keep the per-word work in C for the words that are not shared with other values.
+            words = set(array.array('I', data[:len(data) & ~3]))
+            shared_words = words & self._large_index.keys()
+            self._large_index.update(dict.fromkeys(words - shared_words, idx))
+            for word in shared_words:
+                self._large_index_more[word].append(idx)
+            return
+        for start in range(0, len(data), 4):
+            for end in range(start + 4, min(start + self._MAX_INDEXED_SUBSTRING_SIZE, len(data)) + 1, 4):
+                indices = self._index[data[start:end]]
+                if not indices or indices[-1] != idx:
+                    indices.append(idx)
+
+def _encode_params(pobj: ParameterObject) -> typing.Iterable[typing.Tuple[int, int, bytes]]:
+    """Returns (CRC32, parameter type, encoded value) for every parameter of pobj."""
+    if type(pobj) is CompactParameterObject:
+        return pobj.iter_encoded()
+    return encode_params(pobj.params)
 
 class Writer:
+    """Writes a ParameterIO as a binary parameter archive.
+
+    The layout of the whole archive (offsets of every list, object, parameter, value and string)
+    is computed first, then the archive is built in a single preallocated buffer, so the output
+    stream does not need to be seekable.
+    """
     def __init__(self, param_io: ParameterIO) -> None:
         self._pio = param_io
 
     def get_bytes(self) -> bytes:
-        stream = io.BytesIO()
-        self.write(stream)
-        return stream.getvalue()
+        with _timer('writer.write'):
+            return bytes(self._build())
 
     def write(self, stream: typing.BinaryIO) -> None:
-        self._num_lists = 0
-        self._num_objs = 0
-        self._num_params = 0
-        self._lists: typing.Deque[_ListWriteContext] = deque()
-        self._objs: typing.Deque[_ObjWriteContext] = deque()
-        self._values: typing.List[typing.Tuple[bytes, typing.List[typing.Tuple[int, PlaceholderOffsetWriter]]]] = list()
-        self._strings: typing.DefaultDict[bytes, typing.List[PlaceholderOffsetWriter]] = defaultdict(list)
-
-        # Header
-        stream.write(b'AAMP')
-        stream.write(u32(2)) # Version
-        stream.write(u32(HeaderFlags.LittleEndian | HeaderFlags.UTF8))
-        size_writer = self._write_placeholder_u32(stream)
-        stream.write(u32(0)) # Padding?
-        stream.write(u32(align_up(len(self._pio.type) + 1, 4)))
-        num_lists_writer = self._write_placeholder_u32(stream) # including root ParameterIO
-        num_objs_writer = self._write_placeholder_u32(stream)
-        num_params_writer = self._write_placeholder_u32(stream)
-        data_section_size_writer = self._write_placeholder_u32(stream)
-        string_section_size_writer = self._write_placeholder_u32(stream)
-        stream.write(u32(0)) # Unknown: number of uint32s after the string section
-
-        stream.write(string(self._pio.type))
-        stream.seek(align_up(stream.tell(), 4))
-
-        # Write parameter lists recursively, starting from the root list.
-        self._write_list(stream, *next(iter(self._pio.lists.items())))
-        # Actually write list data now.
-        list_contexts = []
-        while self._lists:
-            list_contexts.append(self._lists.popleft())
-            self._write_list_data(stream, list_contexts[-1])
-        # While not strictly necessary, write all lists before writing objects
-        # to match Nintendo's official binary parameter archive tool and
-        # to prevent aamptool from choking on generated AAMPs.
-        for ctx in list_contexts:
-            ctx.obj_offset_writer.write_offset_16(stream.tell())
-            for cobj_crc32, cobj in ctx.plist.objects.items():
-                self._write_object(stream, cobj_crc32, cobj)
-
-        while self._objs:
-            self._write_object_data(stream, self._objs.popleft())
-
-        data_section_start = stream.tell()
-        for v, offsets in self._values:
-            for offset, w in offsets:
-                w.write_offset_24(stream.tell() + offset)
-            stream.write(v)
-            stream.seek(align_up(stream.tell(), 4))
-        data_section_size_writer.write_offset_32(stream.tell() - data_section_start)
-
-        string_section_start = stream.tell()
-        for v, offset_writers in self._strings.items():
-            stream.seek(align_up(stream.tell(), 4))
-            for w in offset_writers:
-                w.write_offset_24(stream.tell())
-            stream.write(v)
-        stream.write(b'\x00' * (align_up(stream.tell(), 4) - stream.tell()))
-        string_section_size_writer.write_offset_32(stream.tell() - string_section_start)
-
-        num_lists_writer.write_offset_32(self._num_lists)
-        num_objs_writer.write_offset_32(self._num_objs)
-        num_params_writer.write_offset_32(self._num_params)
-        size_writer.write_offset_32(stream.tell())
-
-    def _write_list(self, stream: typing.BinaryIO, crc32: int, plist: ParameterList) -> None:
-        self._num_lists += 1
-        start_offset = stream.tell()
-        stream.write(u32(crc32))
-        list_offset_writer = self._write_placeholder_u16(stream, base=start_offset)
-        stream.write(u16(len(plist.lists)))
-        obj_offset_writer = self._write_placeholder_u16(stream, base=start_offset)
-        stream.write(u16(len(plist.objects)))
-        self._lists.append(_ListWriteContext(list_offset_writer, obj_offset_writer, plist))
-
-    def _write_list_data(self, stream: typing.BinaryIO, ctx: _ListWriteContext) -> None:
-        ctx.list_offset_writer.write_offset_16(stream.tell())
-        for clist_crc32, clist in ctx.plist.lists.items():
-            self._write_list(stream, clist_crc32, clist)
-
-    def _write_object(self, stream: typing.BinaryIO, crc32: int, pobj: ParameterObject) -> None:
-        self._num_objs += 1
-        start_offset = stream.tell()
-        stream.write(u32(crc32))
-        param_offset_writer = self._write_placeholder_u16(stream, base=start_offset)
-        stream.write(u16(len(pobj.params)))
-        self._objs.append(_ObjWriteContext(param_offset_writer, pobj))
-
-    def _write_object_data(self, stream: typing.BinaryIO, ctx: _ObjWriteContext) -> None:
-        ctx.param_offset_writer.write_offset_16(stream.tell())
-        for param_crc32, param in ctx.pobj.params.items():
-            start_offset = stream.tell()
-            self._num_params += 1
-            param_type, param_bytes = value_to_bytes(param)
-            stream.write(u32(param_crc32))
-            p = self._write_placeholder_u24(stream, base=start_offset)
-            stream.write(u8(param_type))
-            if isinstance(param, str):
-                self._strings[param_bytes].append(p)
-            else:
-                found = False
-                for v, writers in self._values:
-                    try:
-                        offset = v.index(param_bytes)
-                        # Sub-offset must be divisible by 4 in order to be representable.
-                        if offset % 4 != 0:
-                            continue
-                        writers.append((offset, p))
-                        found = True
-                        break
-                    except ValueError:
-                        continue
-                if not found:
-                    self._values.append((param_bytes, [(0, p)]))
-
-    def _write_placeholder_u32(self, stream: typing.BinaryIO, base: int = 0) -> PlaceholderOffsetWriter:
-        p = PlaceholderOffsetWriter(stream, base)
-        p.write_placeholder_32()
-        return p
-
-    def _write_placeholder_u24(self, stream: typing.BinaryIO, base: int = 0) -> PlaceholderOffsetWriter:
-        p = PlaceholderOffsetWriter(stream, base)
-        p.write_placeholder_24()
-        return p
-
-    def _write_placeholder_u16(self, stream: typing.BinaryIO, base: int = 0) -> PlaceholderOffsetWriter:
-        p = PlaceholderOffsetWriter(stream, base)
-        p.write_placeholder_16()
-        return p
+        with _timer('writer.write'):
+            stream.write(self._build())
+
+    def _build(self) -> bytearray:
+        type_bytes = string(self._pio.type)
+        lists_start = align_up(_FILE_HEADER.size + len(type_bytes), 4)
+
+        # Lists are laid out breadth-first starting from the root list, followed by
+        # the objects of every list in the same order. While not strictly necessary,
+        # writing all lists before objects matches Nintendo's official binary parameter
+        # archive tool and prevents aamptool from choking on generated AAMPs.
+        lists: typing.List[typing.Tuple[int, ParameterList]] = [next(iter(self._pio.lists.items()))]
+        first_child_list: typing.List[int] = []
+        i = 0
+        while i < len(lists):
+            first_child_list.append(len(lists))
+            lists.extend(lists[i][1].lists.items())
+            i += 1
+
+        objs_start = lists_start + _LIST_HEADER.size*len(lists)
+        objs: typing.List[typing.Tuple[int, ParameterObject]] = []
+        first_obj: typing.List[int] = []
+        for _, plist in lists:
+            first_obj.append(len(objs))
+            objs.extend(plist.objects.items())
+
+        params_start = objs_start + _OBJ_HEADER.size*len(objs)
+        param_crc32s: typing.List[int] = []
+        param_types: typing.List[int] = []
+        first_param: typing.List[int] = []
+        values = _ValuePool()
+        strings: typing.DefaultDict[bytes, typing.List[int]] = defaultdict(list)
+        for _, pobj in objs:
+            first_param.append(len(param_crc32s))
+            for param_crc32, param_type, param_bytes in _encode_params(pobj):
+                if param_type in _STRING_PARAMETER_TYPES:
+                    strings[param_bytes].append(len(param_crc32s))
+                else:
+                    values.add(param_bytes, len(param_crc32s))
+                param_crc32s.append(param_crc32)
+                param_types.append(param_type)
+
+        # Offset of the data (value or string) of each parameter.
+        param_data_offsets = [0] * len(param_crc32s)
+        data_section_start = params_start + _PARAM_HEADER.size*len(param_crc32s)
+        offset = data_section_start
+        value_offsets: typing.List[int] = []
+        for v, refs in values.values:
+            value_offsets.append(offset)
+            for sub_offset, param_idx in refs:
+                param_data_offsets[param_idx] = offset + sub_offset
+            offset = align_up(offset + len(v), 4)
+        for param_idx, param_type in enumerate(param_types):
+            if param_type in _BUFFER_PARAMETER_TYPES:
+                param_data_offsets[param_idx] += 4
+        string_section_start = offset
+        string_offsets: typing.List[int] = []
+        for v, param_indices in strings.items():
+            offset = align_up(offset, 4)
+            string_offsets.append(offset)
+            for param_idx in param_indices:
+                param_data_offsets[param_idx] = offset
+            offset += len(v)
+        size = align_up(offset, 4)
+
+        buf = bytearray(size)
+        _FILE_HEADER.pack_into(buf, 0, b'AAMP', 2, HeaderFlags.LittleEndian | HeaderFlags.UTF8, size,
+            0, # Padding?
+            align_up(len(self._pio.type) + 1, 4),
+            len(lists), # including root ParameterIO
+            len(objs), len(param_crc32s),
+            string_section_start - data_section_start, size - string_section_start,
+            0) # Unknown: number of uint32s after the string section
+        buf[_FILE_HEADER.size:_FILE_HEADER.size + len(type_bytes)] = type_bytes
+
+        for i, (crc32, plist) in enumerate(lists):
+            header_offset = lists_start + _LIST_HEADER.size*i
+            _LIST_HEADER.pack_into(buf, header_offset, crc32,
+                (lists_start + _LIST_HEADER.size*first_child_list[i] - header_offset) >> 2, len(plist.lists),
+                (objs_start + _OBJ_HEADER.size*first_obj[i] - header_offset) >> 2, len(plist.objects))
+
+        for i, (crc32, pobj) in enumerate(objs):
+            header_offset = objs_start + _OBJ_HEADER.size*i
+            _OBJ_HEADER.pack_into(buf, header_offset, crc32,
+                (params_start + _PARAM_HEADER.size*first_param[i] - header_offset) >> 2, len(pobj.params))
+
+        for i, crc32 in enumerate(param_crc32s):
+            header_offset = params_start + _PARAM_HEADER.size*i
+            rel_offset = (param_data_offsets[i] - header_offset) >> 2
+            if rel_offset > 0xffffff:
+                raise ValueError('Cannot represent offset; it must fit in 24 bits')
+            _PARAM_HEADER.pack_into(buf, header_offset, crc32, (param_types[i] << 24) | rel_offset)
+
+        for (v, _), value_offset in zip(values.values, value_offsets):
+            buf[value_offset:value_offset + len(v)] = v
+        for v, string_offset in zip(strings, string_offsets):
+            buf[string_offset:string_offset + len(v)] = v
+
+        stats = _get_stats()
+        if stats is not None:
+            num_strings = sum(len(param_indices) for param_indices in strings.values())
+            counts = {'writer.archives': 1, 'writer.bytes': size, 'writer.lists': len(lists), 'writer.objects': len(objs),
+                      'writer.params': len(param_types), 'writer.values': len(param_types) - num_strings,
+                      'writer.unique_values': len(values.values), 'writer.strings': num_strings,
+                      'writer.unique_strings': len(strings)}
+            for param_type in param_types:
+                key = 'writer.params.' + ParameterType(param_type).name
+                counts[key] = counts.get(key, 0) + 1
+            stats.add_counts(counts)
+        return buf
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# Benchmarks for the Reader, the Writer, the YAML and JSON converters, name resolution and Yaz0.
+#
+# Usage: python -m aamp.bench [--save baseline.json] [--compare baseline.json]
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+import typing
+import zlib
+
+import aamp
+import aamp.converters
+import aamp.yaml_util as yu
+import aamp.yaz0
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.botw_numbered_names import get_numbered_name_list
+from aamp.generator import generate_sized
+from aamp.name_cache import set_name_cache
+
+_DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'test_data')
+
+class BenchInput(typing.NamedTuple):
+    name: str
+    aamp_data: bytes
+    yml_data: bytes
+    json_data: bytes
+
+class BenchResult(typing.NamedTuple):
+    seconds: float # median time per operation
+    best_seconds: float
+    runs: int
+    size: int # input size in bytes
+    peak_memory: int # peak memory allocated by one operation, in bytes
+
+    @property
+    def ops_per_sec(self) -> float:
+        return 1 / self.seconds
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.size / self.seconds / 1e6
+
+def scale_archive(data: bytes, factor: int) -> bytes:
+    """Returns an archive whose root list contains factor copies of the lists and objects of data."""
+    pio = aamp.Reader(data).parse()
+    scaled = aamp.ParameterIO(type_=pio.type, version=pio.version)
+    for root_crc32, root_list in pio.lists.items():
+        root = aamp.ParameterList()
+        for i in range(factor):
+            root.lists[zlib.crc32(f'Copy{i}'.encode())] = root_list
+        scaled.lists[root_crc32] = root
+    return aamp.Writer(scaled).get_bytes()
+
+def _resolve_names(data: bytes) -> None:
+    reader = aamp.Reader(data, track_strings=True)
+    pio = reader.parse()
+    strings = reader._crc32_to_string_map
+
+    def resolve(plist: aamp.ParameterList, parent_crc32: int) -> None:
+        for items in (plist.lists, plist.objects):
+            for idx, k in enumerate(items):
+                yu.get_pstruct_name(strings, idx, k, parent_crc32, None)
+        for k, child in plist.lists.items():
+            resolve(child, k)
+        for k, pobj in plist.objects.items():
+            for idx, param_crc32 in enumerate(pobj.params):
+                yu.get_pstruct_name(strings, idx, param_crc32, k, None)
+
+    for k, root in pio.lists.items():
+        resolve(root, k)
+
+def _write(pio: aamp.ParameterIO) -> None:
+    aamp.Writer(pio).get_bytes()
+
+def _with_large_buffers(data: bytes) -> aamp.ParameterIO:
+    """Returns the archive in data with 64 large buffer parameters (4 times the size of data in total) added.
+    Every fourth buffer is an aligned slice of the previous one, so that it is deduplicated."""
+    pio = aamp.Reader(data).parse()
+    rng = random.Random(0)
+    size = max(len(data) // 16, 0x100) & ~3
+    buffers = aamp.ParameterObject()
+    value = b''
+    for i in range(64):
+        if i % 4 == 3:
+            value = value[size // 4:size // 2]
+        else:
+            value = rng.getrandbits(8 * size).to_bytes(size, 'little')
+        buffers.params[zlib.crc32(f'Buffer{i}'.encode())] = value
+    next(iter(pio.lists.values())).objects[zlib.crc32(b'LargeBuffers')] = buffers
+    return pio
+
+# name -> (function that returns the argument and the input size, function to benchmark)
+BENCHMARKS: typing.Dict[str, typing.Tuple[typing.Callable[[BenchInput], typing.Tuple[typing.Any, int]], typing.Callable[[typing.Any], typing.Any]]] = {
+    'reader_parse': (lambda i: (i.aamp_data, len(i.aamp_data)), lambda data: aamp.Reader(data).parse()),
+    'writer_write': (lambda i: (aamp.Reader(i.aamp_data).parse(), len(i.aamp_data)), _write),
+    # Sizes are the sizes of the original archives.
+    'writer_large_buffers': (lambda i: (_with_large_buffers(i.aamp_data), len(i.aamp_data)), _write),
+    'aamp_to_yml': (lambda i: (i.aamp_data, len(i.aamp_data)), aamp.converters.AampToYaml(use_name_cache=False).convert),
+    'yml_to_aamp': (lambda i: (i.yml_data, len(i.yml_data)), aamp.converters.YamlToAamp().convert),
+    'aamp_to_json': (lambda i: (i.aamp_data, len(i.aamp_data)), aamp.converters.AampToJson(use_name_cache=False).convert),
+    'json_to_aamp': (lambda i: (i.json_data, len(i.json_data)), aamp.converters.JsonToAamp().convert),
+    'name_resolution': (lambda i: (i.aamp_data, len(i.aamp_data)), _resolve_names),
+    # Sizes are the decompressed sizes.
+    'yaz0_decompress': (lambda i: (aamp.yaz0.compress(i.aamp_data), len(i.aamp_data)), aamp.yaz0.decompress),
+    'yaz0_compress': (lambda i: (i.aamp_data, len(i.aamp_data)), aamp.yaz0.compress),
+    'yaz0_compress_fast': (lambda i: (i.aamp_data, len(i.aamp_data)), lambda data: aamp.yaz0.compress(data, level=1)),
+}
+
+def load_inputs(data_dir: str, scales: typing.Sequence[int], synthetic_sizes: typing.Sequence[int] = ()) -> typing.List[BenchInput]:
+    """Loads the archives in data_dir and builds scaled synthetic archives from the largest one,
+    as well as generated archives of the given sizes (see aamp.generator)."""
+    to_yaml = aamp.converters.AampToYaml(use_name_cache=False)
+    to_json = aamp.converters.AampToJson(use_name_cache=False)
+
+    def make_input(name: str, data: bytes) -> BenchInput:
+        return BenchInput(name, data, to_yaml.convert(data), to_json.convert(data))
+
+    inputs: typing.List[BenchInput] = []
+    if os.path.isdir(data_dir):
+        for name in sorted(os.listdir(data_dir)):
+            with open(os.path.join(data_dir, name), 'rb') as f:
+                data = f.read()
+            if aamp.yaz0.is_yaz0(data):
+                data = bytes(aamp.yaz0.decompress(data))
+            if data[0:4] == b'AAMP':
+                inputs.append(make_input(name, data))
+    if inputs:
+        largest = max(inputs, key=lambda i: len(i.aamp_data))
+        for factor in scales:
+            try:
+                data = scale_archive(largest.aamp_data, factor)
+            except struct.error:
+                # Offsets in the list and object headers are 16-bit, which limits the size of an archive.
+                sys.stderr.write(f'warning: {largest.name}x{factor} is too large for the AAMP format, skipping\n')
+                continue
+            inputs.append(make_input(f'{largest.name}x{factor}', data))
+    for size in synthetic_sizes:
+        data = generate_sized(size)
+        inputs.append(make_input(f'synthetic_{size}', data))
+    return inputs
+
+def measure(fn: typing.Callable[[typing.Any], typing.Any], arg: typing.Any, size: int, min_time: float, max_runs: int) -> BenchResult:
+    times: typing.List[float] = []
+    total = 0.0
+    while total < min_time and len(times) < max_runs:
+        start = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+
+    # Memory is measured separately since tracing allocations slows everything down.
+    tracemalloc.start()
+    try:
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return BenchResult(statistics.median(times), min(times), len(times), size, peak)
+
+def run(inputs: typing.Sequence[BenchInput], name_filter: str = '', min_time: float = 0.5, max_runs: int = 1000,
+        progress: typing.Optional[typing.Callable[[str, BenchResult], None]] = None) -> typing.Dict[str, BenchResult]:
+    """Runs every benchmark on every input. Returns results keyed by 'benchmark/input'."""
+    # Load the name tables before measuring anything.
+    get_hash_to_name_map()
+    get_numbered_name_list()
+    results: typing.Dict[str, BenchResult] = dict()
+    for bench_name, (prepare, fn) in BENCHMARKS.items():
+        for bench_input in inputs:
+            key = f'{bench_name}/{bench_input.name}'
+            if name_filter not in key:
+                continue
+            arg, size = prepare(bench_input)
+            result = measure(fn, arg, size, min_time, max_runs)
+            results[key] = result
+            if progress is not None:
+                progress(key, result)
+    return results
+
+def results_to_json(results: typing.Dict[str, BenchResult]) -> dict:
+    return {
+        'aamp_version': aamp.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': {key: dict(r._asdict(), ops_per_sec=r.ops_per_sec, mb_per_sec=r.mb_per_sec) for key, r in results.items()},
+    }
+
+def _format_result(key: str, result: BenchResult) -> str:
+    return (f'{key:<48} {result.seconds * 1000:10.3f} ms {result.ops_per_sec:10.1f} ops/s '
+            f'{result.mb_per_sec:8.2f} MB/s {result.peak_memory / 1e6:9.2f} MB peak')
+
+def compare(results: typing.Dict[str, BenchResult], baseline: dict, threshold: float) -> typing.List[str]:
+    """Prints the change from the baseline for every benchmark and returns the ones that regressed
+    by more than threshold (a fraction of the baseline time)."""
+    regressions: typing.List[str] = []
+    for key, result in results.items():
+        base = baseline['results'].get(key)
+        if base is None:
+            print(f'{key:<48} (not in baseline)')
+            continue
+        ratio = result.seconds / base['seconds']
+        memory_ratio = result.peak_memory / base['peak_memory'] if base['peak_memory'] else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f'{key:<48} {ratio:6.2f}x time {memory_ratio:6.2f}x memory{flag}')
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m aamp.bench', description='Benchmarks the AAMP reader, writer and converters')
+    parser.add_argument('--data', default=_DEFAULT_DATA_DIR, help='Directory with the archives to benchmark (default: test_data)')
+    parser.add_argument('--scale', type=int, nargs='*', default=[4, 16], help='Factors for the scaled synthetic archives (default: 4 16)')
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[], metavar='SIZE', help='Also benchmark generated archives of these sizes in bytes')
+    parser.add_argument('-k', '--filter', default='', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Minimum time to spend on each benchmark, in seconds')
+    parser.add_argument('--max-runs', type=int, default=1000, help='Maximum number of runs for each benchmark')
+    parser.add_argument('--save', metavar='JSON', help='Save the results to a JSON file')
+    parser.add_argument('--compare', metavar='JSON', help='Compare the results with a baseline saved with --save')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown that counts as a regression when comparing (default: 0.1 = 10%%)')
+    args = parser.parse_args()
+
+    set_name_cache(None)
+    inputs = load_inputs(args.data, args.scale, args.synthetic)
+    if not inputs:
+        sys.stderr.write(f'error: no archives found in {args.data}\n')
+        sys.exit(1)
+
+    results = run(inputs, args.filter, args.min_time, args.max_runs, lambda key, result: print(_format_result(key, result)))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results_to_json(results), f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.stderr.write(f'{len(regressions)} regression(s) over {args.threshold:.0%}\n')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,144 @@
+import array
+import bisect
+import collections.abc
+import mmap
 import os
+import struct
+import sys
+import threading
+import types
 import typing
 import zlib
 
-hash_to_name_map: typing.Dict[int, str] = dict()
-with open(os.path.dirname(os.path.realpath(__file__)) + '/botw_hashed_names.txt', 'r', encoding='utf-8') as f:
-    hash_to_name_map = {zlib.crc32(l[:-1].encode()): l[:-1] for l in f}
+from aamp.util import get_cache_dir
+
+_NAMES_PATH = os.path.dirname(os.path.realpath(__file__)) + '/botw_hashed_names.txt'
+
+# Precompiled name table: header, sorted u32 hashes, u32 offsets into the name blob
+# (one per hash plus the end offset), then the UTF-8 name blob.
+_TABLE_MAGIC = b'AAMPNAM1'
+_TABLE_HEADER = struct.Struct('<8sIqq') # magic, name count, source size, source mtime (ns)
+
+class NameTable(collections.abc.Mapping):
+    """CRC32 -> name mapping backed by a precompiled name table.
+
+    Names that are added with table[crc32] = name are stored separately
+    and take precedence over the names in the table.
+    """
+    def __init__(self, buf) -> None:
+        # Keep a reference to the underlying buffer (possibly a mmap).
+        self._buf = buf
+        _, count, _, _ = _TABLE_HEADER.unpack_from(buf, 0)
+        hashes_start = _TABLE_HEADER.size
+        offsets_start = hashes_start + 4*count
+        blob_start = offsets_start + 4*(count + 1)
+        view = memoryview(buf)
+        self._hashes = view[hashes_start:offsets_start].cast('I')
+        self._offsets = view[offsets_start:blob_start].cast('I')
+        self._blob = view[blob_start:]
+        self._extra_names: typing.Dict[int, str] = dict()
+
+    def get(self, crc32: int, default=None):
+        name = self._extra_names.get(crc32)
+        if name is not None:
+            return name
+        i = self._find(crc32)
+        if i == -1:
+            return default
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def _find(self, crc32: int) -> int:
+        i = bisect.bisect_left(self._hashes, crc32)
+        if i == len(self._hashes) or self._hashes[i] != crc32:
+            return -1
+        return i
+
+    def __getitem__(self, crc32: int) -> str:
+        name = self.get(crc32)
+        if name is None:
+            raise KeyError(crc32)
+        return name
+
+    def __setitem__(self, crc32: int, name: str) -> None:
+        self._extra_names[crc32] = name
+
+    def __contains__(self, crc32) -> bool:
+        return self.get(crc32) is not None
+
+    def __iter__(self) -> typing.Iterator[int]:
+        yield from self._extra_names
+        for crc32 in self._hashes:
+            if crc32 not in self._extra_names:
+                yield crc32
+
+    def __len__(self) -> int:
+        return len(self._hashes) + sum(1 for crc32 in self._extra_names if self._find(crc32) == -1)
+
+def _build_table(names_path: str, stat: os.stat_result) -> bytes:
+    with open(names_path, 'r', encoding='utf-8') as f:
+        names = {zlib.crc32(l[:-1].encode()): l[:-1] for l in f}
+    hashes = array.array('I', sorted(names))
+    offsets = array.array('I')
+    blob = bytearray()
+    for crc32 in hashes:
+        offsets.append(len(blob))
+        blob += names[crc32].encode()
+    offsets.append(len(blob))
+    header = _TABLE_HEADER.pack(_TABLE_MAGIC, len(hashes), stat.st_size, stat.st_mtime_ns)
+    return header + hashes.tobytes() + offsets.tobytes() + bytes(blob)
+
+def _is_table_valid(buf, stat: os.stat_result) -> bool:
+    if len(buf) < _TABLE_HEADER.size:
+        return False
+    magic, _, size, mtime = _TABLE_HEADER.unpack_from(buf, 0)
+    return magic == _TABLE_MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns
+
+def load_name_table(names_path: str = _NAMES_PATH) -> NameTable:
+    """Loads the name table for the given list of names (one per line).
+
+    The table is built on first use and cached in the user cache directory;
+    later loads only need to map the cached file into memory.
+    """
+    stat = os.stat(names_path)
+    table_name = os.path.splitext(os.path.basename(names_path))[0] + '.bin'
+    table_path = os.path.join(get_cache_dir(), table_name)
+    try:
+        with open(table_path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if _is_table_valid(buf, stat):
+            return NameTable(buf)
+        buf.close()
+    except (OSError, ValueError):
+        pass
+
+    data = _build_table(names_path, stat)
+    try:
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+        tmp_path = f'{table_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, table_path)
+    except OSError:
+        pass
+    return NameTable(data)
+
+_hash_to_name_map: typing.Optional[NameTable] = None
+_hash_to_name_map_lock = threading.Lock()
+
+def get_hash_to_name_map() -> NameTable:
+    """Returns the BotW name table, loading it on first use."""
+    global _hash_to_name_map
+    if _hash_to_name_map is None:
+        with _hash_to_name_map_lock:
+            if _hash_to_name_map is None:
+                _hash_to_name_map = load_name_table()
+    return _hash_to_name_map
+
+class _Module(types.ModuleType):
+    # Backwards compatibility: hash_to_name_map used to be loaded at import time.
+    # This is a property of the module's class because module __getattr__ requires Python 3.7.
+    @property
+    def hash_to_name_map(self) -> NameTable:
+        return get_hash_to_name_map()
+
+sys.modules[__name__].__class__ = _Module
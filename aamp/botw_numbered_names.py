@@ -1,6 +1,27 @@
 import os
+import sys
+import threading
+import types
 import typing
 
-numbered_name_list: typing.List[str] = []
-with open(os.path.dirname(os.path.realpath(__file__)) + '/botw_numbered_names.txt', 'r', encoding='utf-8') as f:
-    numbered_name_list = [l[:-1] for l in f]
+_numbered_name_list: typing.Optional[typing.List[str]] = None
+_numbered_name_list_lock = threading.Lock()
+
+def get_numbered_name_list() -> typing.List[str]:
+    """Returns the list of numbered name templates (e.g. 'Child%02d'), loading it on first use."""
+    global _numbered_name_list
+    if _numbered_name_list is None:
+        with _numbered_name_list_lock:
+            if _numbered_name_list is None:
+                with open(os.path.dirname(os.path.realpath(__file__)) + '/botw_numbered_names.txt', 'r', encoding='utf-8') as f:
+                    _numbered_name_list = [l[:-1] for l in f]
+    return _numbered_name_list
+
+class _Module(types.ModuleType):
+    # Backwards compatibility: numbered_name_list used to be loaded at import time.
+    # This is a property of the module's class because module __getattr__ requires Python 3.7.
+    @property
+    def numbered_name_list(self) -> typing.List[str]:
+        return get_numbered_name_list()
+
+sys.modules[__name__].__class__ = _Module
@@ -2,23 +2,157 @@
 import aamp
 import io
 import typing
-import yaml
-import aamp.yaml_util as yu
+import aamp.json_util
+import aamp.yaml_emitter
+import aamp.yaml_loader
+from aamp.name_cache import NameCache, get_name_cache
+from aamp.stats import get_stats
+
+def _add_key_names(name_cache: NameCache, reader: aamp.Reader, pio: aamp.ParameterIO) -> None:
+    """Adds the strings of an archive that are names of its lists, objects or parameters to the name cache."""
+    strings = reader._crc32_to_string_map
+    if not strings:
+        return
+    stack = list(pio.lists.items())
+    while stack:
+        crc32, plist = stack.pop()
+        keys = [crc32]
+        for obj_crc32, pobj in plist.objects.items():
+            keys.append(obj_crc32)
+            keys.extend(pobj.params)
+        for key in keys:
+            name = strings.get(key)
+            if name is not None:
+                name_cache.add(name)
+        stack.extend(plist.lists.items())
+
+class AampToYaml:
+    """Converts binary parameter archives to YAML.
+
+    If use_name_cache is True, names are also resolved with the persistent name cache
+    (see aamp.name_cache), and guessed names and strings of the archive that are names
+    of its lists, objects or parameters are added to it.
+
+    All conversion state is local to a convert() call, so a single converter
+    can be used from several threads at the same time.
+    """
+    def __init__(self, use_name_cache: bool = False) -> None:
+        self.use_name_cache = use_name_cache
+
+    def convert(self, input_data: bytes) -> bytes:
+        stats = get_stats()
+        if stats is None:
+            return self._convert(input_data)
+        with stats.timer('convert.aamp_to_yml'):
+            output = self._convert(input_data)
+        stats.add_counts({'convert.aamp_to_yml.files': 1, 'convert.aamp_to_yml.bytes_in': len(input_data),
+                          'convert.aamp_to_yml.bytes_out': len(output)})
+        return output
+
+    def _convert(self, input_data: bytes) -> bytes:
+        # input_data may be any buffer, e.g. a memory-mapped file.
+        reader = aamp.Reader(input_data, track_strings=True)
+        root = reader.parse()
+        name_cache = get_name_cache() if self.use_name_cache else None
+        if name_cache is not None:
+            _add_key_names(name_cache, reader, root)
+        output = aamp.yaml_emitter.dumps(root, reader, name_cache)
+        if name_cache is not None:
+            name_cache.flush()
+        return output
+
+class YamlToAamp:
+    """Converts YAML documents to binary parameter archives.
+
+    All conversion state is local to a convert() call, so a single converter
+    can be used from several threads at the same time.
+    """
+    def convert(self, input_data: bytes) -> bytes:
+        stats = get_stats()
+        if stats is None:
+            return self._convert(input_data)
+        with stats.timer('convert.yml_to_aamp'):
+            output = self._convert(input_data)
+        stats.add_counts({'convert.yml_to_aamp.files': 1, 'convert.yml_to_aamp.bytes_in': len(input_data),
+                          'convert.yml_to_aamp.bytes_out': len(output)})
+        return output
+
+    def _convert(self, input_data: bytes) -> bytes:
+        root = aamp.yaml_loader.load(input_data)
+        buf = io.BytesIO()
+        aamp.Writer(root).write(buf)
+        buf.seek(0)
+        return buf.getvalue()
+
+class AampToJson:
+    """Converts binary parameter archives to JSON (see aamp.json_util for the representation).
+
+    If use_name_cache is True, names are also resolved with the persistent name cache
+    (see aamp.name_cache), and guessed names and strings of the archive that are names
+    of its lists, objects or parameters are added to it.
+
+    All conversion state is local to a convert() call, so a single converter
+    can be used from several threads at the same time.
+    """
+    def __init__(self, use_name_cache: bool = False) -> None:
+        self.use_name_cache = use_name_cache
+
+    def convert(self, input_data: bytes) -> bytes:
+        stats = get_stats()
+        if stats is None:
+            return self._convert(input_data)
+        with stats.timer('convert.aamp_to_json'):
+            output = self._convert(input_data)
+        stats.add_counts({'convert.aamp_to_json.files': 1, 'convert.aamp_to_json.bytes_in': len(input_data),
+                          'convert.aamp_to_json.bytes_out': len(output)})
+        return output
+
+    def _convert(self, input_data: bytes) -> bytes:
+        reader = aamp.Reader(input_data, track_strings=True)
+        root = reader.parse()
+        name_cache = get_name_cache() if self.use_name_cache else None
+        if name_cache is not None:
+            _add_key_names(name_cache, reader, root)
+        output = aamp.json_util.dumps(root, reader, name_cache)
+        if name_cache is not None:
+            name_cache.flush()
+        return output
+
+class JsonToAamp:
+    """Converts JSON documents to binary parameter archives.
+
+    All conversion state is local to a convert() call, so a single converter
+    can be used from several threads at the same time.
+    """
+    def convert(self, input_data: bytes) -> bytes:
+        stats = get_stats()
+        if stats is None:
+            return self._convert(input_data)
+        with stats.timer('convert.json_to_aamp'):
+            output = self._convert(input_data)
+        stats.add_counts({'convert.json_to_aamp.files': 1, 'convert.json_to_aamp.bytes_in': len(input_data),
+                          'convert.json_to_aamp.bytes_out': len(output)})
+        return output
+
+    def _convert(self, input_data: bytes) -> bytes:
+        # The json module only accepts bytes and str (not mmaps or other buffers).
+        if not isinstance(input_data, (bytes, str)):
+            input_data = bytes(input_data)
+        return aamp.Writer(aamp.json_util.load(input_data)).get_bytes()
+
+_aamp_to_yaml = AampToYaml()
+_yaml_to_aamp = YamlToAamp()
+_aamp_to_json = AampToJson()
+_json_to_aamp = JsonToAamp()
 
 def aamp_to_yml(input_data: bytes) -> bytes:
-    dumper = yaml.CDumper
-    yu.register_representers(dumper)
-    reader = aamp.Reader(input_data, track_strings=True)
-    root = reader.parse()
-    dumper.__aamp_reader = reader
-    return yaml.dump(root, Dumper=dumper, allow_unicode=True, encoding='utf-8', default_flow_style=None)
+    return _aamp_to_yaml.convert(input_data)
 
 def yml_to_aamp(input_data: bytes) -> bytes:
-    loader = yaml.CSafeLoader
-    yu.register_constructors(loader)
-
-    root = yaml.load(input_data, Loader=loader)
-    buf = io.BytesIO()
-    aamp.Writer(root).write(buf)
-    buf.seek(0)
-    return buf.getvalue()
+    return _yaml_to_aamp.convert(input_data)
+
+def aamp_to_json(input_data: bytes) -> bytes:
+    return _aamp_to_json.convert(input_data)
+
+def json_to_aamp(input_data: bytes) -> bytes:
+    return _json_to_aamp.convert(input_data)
@@ -0,0 +1,125 @@
+# Structural comparison of parameter archives.
+import hashlib
+import typing
+
+from aamp.aamp import Reader, _Buffer
+from aamp.parameters import *
+
+ChangePath = typing.Tuple[typing.Union[int, str], ...]
+
+class Change(typing.NamedTuple):
+    """A difference between two parameter archives.
+
+    path contains the CRC32s of the root list, lists, object and parameter that lead to the change;
+    it is ('type',) or ('version',) for changes to the ParameterIO attributes. old is None for additions
+    and new is None for removals. Added or removed lists and objects are reported as a single change.
+    """
+    path: ChangePath
+    old: typing.Any
+    new: typing.Any
+
+    @property
+    def kind(self) -> str:
+        if self.old is None:
+            return 'added'
+        if self.new is None:
+            return 'removed'
+        return 'changed'
+
+class TreeDigests:
+    """Computes structural digests of lists and objects, which are equal for identical subtrees.
+
+    Objects are encoded (as CompactParameterObjects) and hashed once; results are memoized per node,
+    so trees must not be modified while a TreeDigests is in use.
+    """
+    def __init__(self) -> None:
+        # id(node) -> (node, result). Nodes are kept alive so that ids cannot be reused.
+        self._compact: typing.Dict[int, typing.Tuple[ParameterObject, CompactParameterObject]] = dict()
+        self._digests: typing.Dict[int, typing.Tuple[typing.Any, bytes]] = dict()
+
+    def compact(self, pobj: ParameterObject) -> CompactParameterObject:
+        """Returns pobj with its parameters in encoded form."""
+        if type(pobj) is CompactParameterObject:
+            return pobj
+        entry = self._compact.get(id(pobj))
+        if entry is None:
+            entry = (pobj, CompactParameterObject(pobj.params))
+            self._compact[id(pobj)] = entry
+        return entry[1]
+
+    def digest(self, node: typing.Union[ParameterList, ParameterObject]) -> bytes:
+        entry = self._digests.get(id(node))
+        if entry is not None:
+            return entry[1]
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(node, ParameterList):
+            for tag, children in ((b'L', node.lists), (b'O', node.objects)):
+                h.update(tag)
+                for crc32, child in children.items():
+                    h.update(crc32.to_bytes(4, 'little'))
+                    h.update(self.digest(child))
+        else:
+            encoded = self.compact(node)
+            h.update(encoded._keys.tobytes())
+            h.update(encoded._types)
+            h.update(encoded._offsets.tobytes())
+            h.update(encoded._data)
+        digest = h.digest()
+        self._digests[id(node)] = (node, digest)
+        return digest
+
+    def encoded_params(self, pobj: ParameterObject) -> typing.Dict[int, typing.Tuple[int, bytes]]:
+        """Returns CRC32 -> (parameter type, encoded value) for every parameter of pobj."""
+        return {crc32: (param_type, data) for crc32, param_type, data in self.compact(pobj).iter_encoded()}
+
+def _diff_children(digests: TreeDigests, a: typing.Mapping[int, typing.Any], b: typing.Mapping[int, typing.Any],
+                   path: ChangePath, changes: typing.List[Change], diff_child) -> None:
+    for crc32, child_a in a.items():
+        child_b = b.get(crc32)
+        if child_b is None:
+            changes.append(Change(path + (crc32,), child_a, None))
+        elif digests.digest(child_a) != digests.digest(child_b):
+            diff_child(digests, child_a, child_b, path + (crc32,), changes)
+    for crc32, child_b in b.items():
+        if crc32 not in a:
+            changes.append(Change(path + (crc32,), None, child_b))
+
+def _diff_lists(digests: TreeDigests, a: ParameterList, b: ParameterList, path: ChangePath, changes: typing.List[Change]) -> None:
+    _diff_children(digests, a.lists, b.lists, path, changes, _diff_lists)
+    _diff_children(digests, a.objects, b.objects, path, changes, _diff_objects)
+
+def _diff_objects(digests: TreeDigests, a: ParameterObject, b: ParameterObject, path: ChangePath, changes: typing.List[Change]) -> None:
+    # Values are compared in encoded form, so that e.g. 1 and 1.0 or int and U32 values are different.
+    encoded_a = digests.encoded_params(a)
+    encoded_b = digests.encoded_params(b)
+    for crc32, value_a in encoded_a.items():
+        value_b = encoded_b.get(crc32)
+        if value_b is None:
+            changes.append(Change(path + (crc32,), a.params[crc32], None))
+        elif value_a != value_b:
+            changes.append(Change(path + (crc32,), a.params[crc32], b.params[crc32]))
+    for crc32 in encoded_b:
+        if crc32 not in encoded_a:
+            changes.append(Change(path + (crc32,), None, b.params[crc32]))
+
+def diff(a: typing.Union[ParameterIO, _Buffer], b: typing.Union[ParameterIO, _Buffer]) -> typing.List[Change]:
+    """Compares two parameter archives by CRC32 keys and typed values.
+
+    a and b are ParameterIOs or binary archives. Binary archives that are identical are not parsed;
+    otherwise they are parsed in compact form, so values are only decoded for changed parameters.
+    Identical subtrees are skipped by comparing structural digests.
+    """
+    if not isinstance(a, ParameterIO) and not isinstance(b, ParameterIO) and memoryview(a) == memoryview(b):
+        return []
+    if not isinstance(a, ParameterIO):
+        a = Reader(a).parse(compact=True)
+    if not isinstance(b, ParameterIO):
+        b = Reader(b).parse(compact=True)
+
+    changes: typing.List[Change] = []
+    if a.type != b.type:
+        changes.append(Change(('type',), a.type, b.type))
+    if a.version != b.version:
+        changes.append(Change(('version',), a.version, b.version))
+    _diff_lists(TreeDigests(), a, b, (), changes)
+    return changes
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Deterministic generator of synthetic parameter archives for scaling and stress tests.
+#
+# Usage: python -m aamp.generator --size 1000000 --count 4 --seed 1 out/
+import argparse
+import array
+import math
+import os
+import random
+import typing
+import zlib
+
+from aamp.aamp import Writer
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.parameters import *
+
+# Relative frequency of each parameter type. The defaults roughly follow the mix found in game files.
+DEFAULT_TYPE_WEIGHTS: typing.Dict[ParameterType, float] = {
+    ParameterType.Bool: 12,
+    ParameterType.F32: 25,
+    ParameterType.Int: 20,
+    ParameterType.Vec2: 2,
+    ParameterType.Vec3: 8,
+    ParameterType.Vec4: 1,
+    ParameterType.Color: 2,
+    ParameterType.String32: 3,
+    ParameterType.String64: 8,
+    ParameterType.Curve1: 1,
+    ParameterType.Curve2: 0.5,
+    ParameterType.Curve3: 0.25,
+    ParameterType.Curve4: 0.25,
+    ParameterType.BufferInt: 0.5,
+    ParameterType.BufferF32: 0.5,
+    ParameterType.String256: 2,
+    ParameterType.Quat: 1,
+    ParameterType.U32: 5,
+    ParameterType.BufferU32: 0.5,
+    ParameterType.BufferBinary: 0.5,
+    ParameterType.StringRef: 6,
+}
+
+# Offsets to lists, objects and parameters are 16-bit word offsets relative to the header
+# of the parent, so the headers of an archive must fit in about 256 KiB.
+_MAX_HEADERS_SIZE = 0x3c000
+
+_names: typing.Optional[typing.List[str]] = None
+
+def _get_names() -> typing.List[str]:
+    global _names
+    if _names is None:
+        _names = sorted(get_hash_to_name_map().values())
+    return _names
+
+class ArchiveGenerator:
+    """Builds random ParameterIOs with a configurable shape. The output only depends on the seed and options.
+
+    depth: number of list levels below the root list.
+    root_lists: number of lists in the root list.
+    lists_per_list, objects_per_list, params_per_object: fan-out of every list and object.
+    type_weights: relative frequency of each parameter type.
+    duplication: probability that a value (or string) is a copy of an earlier value of the same type,
+    which exercises value and string deduplication in the Writer.
+    buffer_size: average number of items in buffer parameters.
+    real_names: whether to use names from the BotW name table (otherwise names are unknown CRC32s).
+    """
+    def __init__(self, seed: int = 0, depth: int = 3, root_lists: int = 4, lists_per_list: int = 3,
+                 objects_per_list: int = 4, params_per_object: int = 8,
+                 type_weights: typing.Optional[typing.Mapping[ParameterType, float]] = None,
+                 duplication: float = 0.25, buffer_size: int = 16, real_names: bool = True) -> None:
+        if not 0 <= duplication <= 1:
+            raise ValueError('duplication must be between 0 and 1')
+        self.seed = seed
+        self.depth = depth
+        self.root_lists = root_lists
+        self.lists_per_list = lists_per_list
+        self.objects_per_list = objects_per_list
+        self.params_per_object = params_per_object
+        self.type_weights = dict(type_weights if type_weights is not None else DEFAULT_TYPE_WEIGHTS)
+        self.duplication = duplication
+        self.buffer_size = buffer_size
+        self.real_names = real_names
+
+    def generate(self) -> ParameterIO:
+        self._rng = random.Random(self.seed)
+        self._types = list(self.type_weights)
+        self._cum_weights = list(_accumulate(self.type_weights[t] for t in self._types))
+        self._previous_values: typing.Dict[ParameterType, typing.List[typing.Any]] = {t: [] for t in self._types}
+        self._names = _get_names() if self.real_names else []
+
+        pio = ParameterIO(type_='xml', version=0)
+        root = ParameterList()
+        self._fill_list(root, self.root_lists, self.depth)
+        pio.lists[zlib.crc32(b'param_root')] = root
+        return pio
+
+    def _key(self, siblings: typing.Mapping[int, typing.Any]) -> int:
+        while True:
+            if self._names:
+                crc32 = zlib.crc32(self._rng.choice(self._names).encode())
+            else:
+                crc32 = self._rng.getrandbits(32)
+            if crc32 not in siblings:
+                return crc32
+
+    def _fill_list(self, plist: ParameterList, num_lists: int, depth: int) -> None:
+        for _ in range(self.objects_per_list):
+            pobj = ParameterObject()
+            for _ in range(self.params_per_object):
+                pobj.params[self._key(pobj.params)] = self._value()
+            plist.objects[self._key(plist.objects)] = pobj
+        if depth == 0:
+            return
+        for _ in range(num_lists):
+            child = ParameterList()
+            self._fill_list(child, self.lists_per_list, depth - 1)
+            plist.lists[self._key(plist.lists)] = child
+
+    def _string(self, max_size: int) -> str:
+        if self._names:
+            s = self._rng.choice(self._names)
+        else:
+            s = f'str_{self._rng.getrandbits(32):08x}'
+        # Fixed-size strings are limited in bytes, and names may contain multi-byte characters.
+        return s.encode()[:max_size].decode(errors='ignore')
+
+    def _float(self) -> float:
+        # Multiples of 1/4 that are exactly representable as f32, so that values roundtrip.
+        return self._rng.randrange(-40000, 40000) / 4
+
+    def _buffer_length(self) -> int:
+        # Buffers must not be empty.
+        return self._rng.randint(1, max(1, 2*self.buffer_size - 1))
+
+    def _random_bytes(self, n: int) -> bytes:
+        return self._rng.getrandbits(8*n).to_bytes(n, 'little') if n else b''
+
+    def _value(self) -> typing.Any:
+        rng = self._rng
+        param_type = rng.choices(self._types, cum_weights=self._cum_weights)[0]
+        previous_values = self._previous_values[param_type]
+        if previous_values and rng.random() < self.duplication:
+            return rng.choice(previous_values)
+
+        f = self._float
+        value: typing.Any
+        if param_type == ParameterType.Bool:
+            value = rng.random() < 0.5
+        elif param_type == ParameterType.F32:
+            value = f()
+        elif param_type == ParameterType.Int:
+            value = rng.randrange(-0x80000000, 0x80000000) if rng.random() < 0.1 else rng.randrange(-100, 1000)
+        elif param_type == ParameterType.U32:
+            value = U32(rng.getrandbits(32))
+        elif param_type == ParameterType.Vec2:
+            value = Vec2(f(), f())
+        elif param_type == ParameterType.Vec3:
+            value = Vec3(f(), f(), f())
+        elif param_type == ParameterType.Vec4:
+            value = Vec4(f(), f(), f(), f())
+        elif param_type == ParameterType.Color:
+            value = Color(f(), f(), f(), f())
+        elif param_type == ParameterType.Quat:
+            value = Quat(f(), f(), f(), f())
+        elif param_type == ParameterType.String32:
+            value = String32(self._string(31))
+        elif param_type == ParameterType.String64:
+            value = String64(self._string(63))
+        elif param_type == ParameterType.String256:
+            value = String256(self._string(255))
+        elif param_type == ParameterType.StringRef:
+            value = self._string(1024)
+        elif param_type in (ParameterType.Curve1, ParameterType.Curve2, ParameterType.Curve3, ParameterType.Curve4):
+            num_curves = param_type - ParameterType.Curve1 + 1
+            v: typing.List[typing.Any] = []
+            for _ in range(num_curves):
+                v += [rng.randrange(0, 4), rng.randrange(0, 30)]
+                v += [f() for _ in range(30)]
+            value = Curve(v)
+        elif param_type == ParameterType.BufferInt:
+            value = array.array('i', self._random_bytes(4*self._buffer_length())).tolist()
+        elif param_type == ParameterType.BufferF32:
+            value = [x / 4 for x in array.array('h', self._random_bytes(2*self._buffer_length()))]
+        elif param_type == ParameterType.BufferU32:
+            value = [U32(x) for x in array.array('I', self._random_bytes(4*self._buffer_length()))]
+        elif param_type == ParameterType.BufferBinary:
+            value = self._random_bytes(self._buffer_length())
+        else:
+            raise ValueError(f'Unsupported parameter type: {param_type!r}')
+        previous_values.append(value)
+        return value
+
+def _accumulate(weights: typing.Iterable[float]) -> typing.Iterator[float]:
+    total = 0.0
+    for weight in weights:
+        if weight < 0:
+            raise ValueError('Type weights must not be negative')
+        total += weight
+        yield total
+
+def generate(seed: int = 0, **options) -> ParameterIO:
+    """Returns a random ParameterIO. See ArchiveGenerator for the options."""
+    return ArchiveGenerator(seed, **options).generate()
+
+def _count_headers(pio: ParameterIO) -> typing.Tuple[int, int, int]:
+    num_lists = num_objs = num_params = 0
+    stack: typing.List[ParameterList] = list(pio.lists.values())
+    while stack:
+        plist = stack.pop()
+        num_lists += 1
+        num_objs += len(plist.objects)
+        num_params += sum(len(pobj.params) for pobj in plist.objects.values())
+        stack.extend(plist.lists.values())
+    return (num_lists, num_objs, num_params)
+
+def generate_sized(size: int, seed: int = 0, **options) -> bytes:
+    """Returns a random binary archive of at least size bytes (or the archive that the tree shape
+    in options produces with a single root list, if that is larger).
+
+    The number of lists in the root list is increased until the headers reach the limits of the format,
+    then buffers are made larger. Values must be within 64 MiB of their parameter header,
+    which limits archives to about that size.
+    """
+    options.setdefault('root_lists', 1)
+    pio = generate(seed, **options)
+    data = Writer(pio).get_bytes()
+    if len(data) >= size:
+        return data
+
+    num_lists, num_objs, num_params = _count_headers(pio)
+    headers_size = 12*num_lists + 8*num_objs + 8*num_params
+    root_lists = options['root_lists']
+    factor = min(math.ceil(size / len(data)), max(1, _MAX_HEADERS_SIZE // headers_size))
+    options['root_lists'] = root_lists * factor
+    pio = generate(seed, **options)
+    data = Writer(pio).get_bytes()
+
+    # Grow the buffers until the archive is large enough. The size of the archive is roughly
+    # an affine function of the buffer size, which is estimated from the last two archives.
+    buffer_size = options.get('buffer_size', 16)
+    previous: typing.Optional[typing.Tuple[int, int]] = None
+    while len(data) < size:
+        if previous is None or previous[1] >= len(data):
+            new_buffer_size = math.ceil(buffer_size * size / len(data))
+        else:
+            bytes_per_item = (len(data) - previous[1]) / (buffer_size - previous[0])
+            new_buffer_size = math.ceil(buffer_size + 1.05 * (size - len(data)) / bytes_per_item)
+        previous = (buffer_size, len(data))
+        buffer_size = max(buffer_size + 1, new_buffer_size)
+        options['buffer_size'] = buffer_size
+        data = Writer(generate(seed, **options)).get_bytes()
+    return data
+
+def _parse_size(value: str) -> int:
+    units = {'k': 1 << 10, 'm': 1 << 20}
+    multiplier = units.get(value[-1:].lower())
+    return int(float(value[:-1]) * multiplier) if multiplier is not None else int(value)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m aamp.generator', description='Generates synthetic parameter archives')
+    parser.add_argument('destination', help='Directory to write the archives to')
+    parser.add_argument('--size', type=_parse_size, nargs='+', default=[64 << 10], help='Minimum size of the archives, e.g. 100k or 8m (default: 64k)')
+    parser.add_argument('--count', type=int, default=1, help='Number of archives to generate for each size')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first archive; the following archives use the next seeds')
+    parser.add_argument('--depth', type=int, default=3, help='Number of list levels below the root list')
+    parser.add_argument('--duplication', type=float, default=0.25, help='Probability that a value is a copy of an earlier value')
+    parser.add_argument('--no-real-names', action='store_true', help='Use unknown CRC32s instead of BotW names')
+    args = parser.parse_args()
+
+    os.makedirs(args.destination, exist_ok=True)
+    for size in args.size:
+        for i in range(args.count):
+            seed = args.seed + i
+            data = generate_sized(size, seed, depth=args.depth, duplication=args.duplication, real_names=not args.no_real_names)
+            path = os.path.join(args.destination, f'synthetic_{size}_{seed}.bxml')
+            with open(path, 'wb') as f:
+                f.write(data)
+            print(f'{path}: {len(data)} bytes')
+
+if __name__ == '__main__':
+    main()
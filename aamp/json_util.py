@@ -0,0 +1,224 @@
+# Lossless JSON representation of parameter archives.
+#
+# The document mirrors the YAML representation:
+#   {"version": 0, "type": "xml", "param_root": {"objects": {...}, "lists": {...}}}
+# Objects map names to values. Bools, ints (Int), floats (F32), strings (StringRef) and
+# lists of ints or floats (BufferInt, BufferF32) are plain JSON values; other values are
+# single-key objects whose key is the type: {"vec3": [x, y, z]}, {"u32": 1}, {"str64": "s"},
+# {"buffer_u32": [...]}, {"binary": "<base64>"}, ...
+#
+# NaN and infinities are not valid JSON, so they are written as the strings "nan", "inf" and "-inf":
+# non-finite F32 values as {"f32": "nan"}, and vectors, curves and float buffers that contain such
+# values as tagged values whose items may be strings, e.g. {"buffer_f32": [1.0, "inf"]}.
+#
+# Keys are names. CRC32s that could not be resolved are written as "$<decimal CRC32>",
+# and names that start with "$" are escaped as "$$name".
+import base64
+import json
+import math
+import typing
+
+from aamp.aamp import Reader
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.name_cache import NameCache
+from aamp.parameters import *
+from aamp.stats import timer
+from aamp.yaml_loader import hash_name
+import aamp.yaml_util as yu
+
+_VECTOR_TAGS = {Vec2: 'vec2', Vec3: 'vec3', Vec4: 'vec4', Color: 'color', Quat: 'quat'}
+_STRING_TAGS = {String32: 'str32', String64: 'str64', String256: 'str256'}
+_VECTOR_TYPES = {tag: t for t, tag in _VECTOR_TAGS.items()}
+_STRING_TYPES = {tag: t for t, tag in _STRING_TAGS.items()}
+_PLAIN_TYPES = (bool, int, float, str)
+# Floats are checked separately because they may not be finite.
+_PLAIN_NON_FLOAT_TYPES = (bool, int, str)
+_NON_FINITE_FLOATS = {'nan': math.nan, 'inf': math.inf, '-inf': -math.inf}
+
+def _key_to_json(name: typing.Union[int, str]) -> str:
+    if isinstance(name, int):
+        return f'${name}'
+    if name.startswith('$'):
+        return '$' + name
+    return name
+
+def _key_from_json(key: str) -> int:
+    if key.startswith('$'):
+        if key.startswith('$$'):
+            return hash_name(key[1:])
+        try:
+            return int(key[1:])
+        except ValueError:
+            raise ValueError(f'Invalid key: {key!r} (expected $ followed by a CRC32, or $$ followed by a name)') from None
+    return hash_name(key)
+
+def _float_to_json(v: float) -> typing.Union[float, str]:
+    if math.isfinite(v):
+        return v
+    return 'nan' if v != v else 'inf' if v > 0 else '-inf'
+
+def _floats_to_json(values: list) -> list:
+    if all(map(math.isfinite, values)):
+        return values
+    return [_float_to_json(x) if type(x) is float else x for x in values]
+
+def _float_from_json(v: typing.Any) -> typing.Any:
+    if type(v) is not str:
+        return v
+    try:
+        return _NON_FINITE_FLOATS[v]
+    except KeyError:
+        raise ValueError(f'Invalid float: {v!r} (expected a number, "nan", "inf" or "-inf")') from None
+
+def _floats_from_json(values: list) -> list:
+    if str not in map(type, values):
+        return values
+    return [_float_from_json(x) for x in values]
+
+def _value_to_json(v: typing.Any) -> typing.Any:
+    t = type(v)
+    if t is float:
+        return v if math.isfinite(v) else {'f32': _float_to_json(v)}
+    if t in _PLAIN_TYPES:
+        return v
+    tag = _VECTOR_TAGS.get(t)
+    if tag is not None:
+        return {tag: _floats_to_json(yu._fields(v))}
+    tag = _STRING_TAGS.get(t)
+    if tag is not None:
+        return {tag: str(v)}
+    if t is U32:
+        return {'u32': int(v)}
+    if t is Curve:
+        return {'curve': _floats_to_json(v.v)}
+    if t is list:
+        if v and type(v[0]) is U32:
+            return {'buffer_u32': [int(x) for x in v]}
+        if v and type(v[0]) is float and not all(map(math.isfinite, v)):
+            return {'buffer_f32': _floats_to_json(v)}
+        return v
+    if t is bytes:
+        return {'binary': base64.b64encode(v).decode('ascii')}
+    raise ValueError(f'Cannot represent {t.__name__} values in JSON')
+
+def _value_from_json(v: typing.Any) -> typing.Any:
+    t = type(v)
+    if t in _PLAIN_TYPES or t is list:
+        return v
+    if t is not dict or len(v) != 1:
+        raise ValueError(f'Invalid value: {v!r}')
+    (tag, data), = v.items()
+    vector_type = _VECTOR_TYPES.get(tag)
+    if vector_type is not None:
+        return vector_type(*_floats_from_json(data))
+    string_type = _STRING_TYPES.get(tag)
+    if string_type is not None:
+        return string_type(data)
+    if tag == 'u32':
+        return U32(data)
+    if tag == 'f32':
+        return float(_float_from_json(data))
+    if tag == 'curve':
+        return Curve(_floats_from_json(data))
+    if tag == 'buffer_u32':
+        return [U32(x) for x in data]
+    if tag == 'buffer_f32':
+        return [float(x) for x in _floats_from_json(data)]
+    if tag == 'binary':
+        return base64.b64decode(data)
+    raise ValueError(f'Unknown value type: {tag!r}')
+
+class JsonEncoder:
+    """Converts a ParameterIO to JSON data (dicts, lists and scalars).
+
+    reader and name_cache are used to resolve names, like for YAML.
+    """
+    def __init__(self, reader: typing.Optional[Reader] = None, name_cache: typing.Optional[NameCache] = None) -> None:
+        self._strings = reader._crc32_to_string_map if reader is not None else None
+        self._name_cache = name_cache
+        self._keys: typing.Dict[typing.Tuple[int, int, int], str] = dict()
+
+    def encode(self, pio: ParameterIO) -> typing.Dict[str, typing.Any]:
+        data: typing.Dict[str, typing.Any] = {'version': pio.version, 'type': pio.type}
+        hash_to_name_map = get_hash_to_name_map()
+        for crc32, plist in pio.lists.items():
+            data[_key_to_json(hash_to_name_map.get(crc32, crc32))] = self._encode_list(plist, crc32)
+        return data
+
+    def _named_keys(self, items: typing.Mapping[int, typing.Any], parent_crc32: int) -> typing.List[str]:
+        strings = self._strings
+        name_cache = self._name_cache
+        # Names only depend on the CRC32, the parent and the index, and the same structures are often repeated.
+        keys = self._keys
+        result = []
+        for idx, k in enumerate(items):
+            cache_key = (k, parent_crc32, idx)
+            key = keys.get(cache_key)
+            if key is None:
+                key = _key_to_json(yu.get_pstruct_name(strings, idx, k, parent_crc32, name_cache))
+                keys[cache_key] = key
+            result.append(key)
+        return result
+
+    def _encode_list(self, plist: ParameterList, crc32: int) -> typing.Dict[str, typing.Any]:
+        objects = plist.objects
+        lists = plist.lists
+        return {
+            'objects': {key: self._encode_obj(pobj, k) for key, (k, pobj) in zip(self._named_keys(objects, crc32), objects.items())},
+            'lists': {key: self._encode_list(child, k) for key, (k, child) in zip(self._named_keys(lists, crc32), lists.items())},
+        }
+
+    def _encode_obj(self, pobj: ParameterObject, crc32: int) -> typing.Dict[str, typing.Any]:
+        params = pobj.params
+        plain_types = _PLAIN_NON_FLOAT_TYPES
+        return {key: v if type(v) in plain_types else _value_to_json(v)
+                for key, v in zip(self._named_keys(params, crc32), params.values())}
+
+def _decode_list(data: typing.Any) -> ParameterList:
+    if type(data) is not dict or set(data) != {'objects', 'lists'}:
+        raise ValueError('A parameter list must be an object with "objects" and "lists"')
+    plist = ParameterList()
+    plist.objects = {_key_from_json(key): _decode_obj(obj) for key, obj in data['objects'].items()}
+    plist.lists = {_key_from_json(key): _decode_list(child) for key, child in data['lists'].items()}
+    return plist
+
+def _decode_obj(data: typing.Any) -> ParameterObject:
+    if type(data) is not dict:
+        raise ValueError('A parameter object must be a JSON object')
+    pobj = ParameterObject()
+    plain_types = _PLAIN_TYPES
+    pobj.params = {_key_from_json(key): v if type(v) in plain_types or type(v) is list else _value_from_json(v)
+                   for key, v in data.items()}
+    return pobj
+
+def from_json_data(data: typing.Any) -> ParameterIO:
+    """Builds a ParameterIO from JSON data (as returned by json.loads)."""
+    if type(data) is not dict or 'version' not in data or 'type' not in data:
+        raise ValueError('Expected a parameter IO object with "version" and "type"')
+    pio = ParameterIO(type_=data['type'], version=data['version'])
+    for key, plist in data.items():
+        if key != 'version' and key != 'type':
+            pio.lists[_key_from_json(key)] = _decode_list(plist)
+    return pio
+
+def _dumps_str(pio: ParameterIO, reader: typing.Optional[Reader], name_cache: typing.Optional[NameCache]) -> str:
+    data = JsonEncoder(reader, name_cache).encode(pio)
+    with timer('json.dump'):
+        return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+def dump(pio: ParameterIO, stream: typing.TextIO, reader: typing.Optional[Reader] = None, name_cache: typing.Optional[NameCache] = None) -> None:
+    """Writes pio as JSON to a text stream.
+
+    This does not stream: the document is built in memory and written at once, because the C encoder
+    that json.dumps uses is several times faster than the pure Python encoder that streaming requires.
+    """
+    stream.write(_dumps_str(pio, reader, name_cache))
+
+def dumps(pio: ParameterIO, reader: typing.Optional[Reader] = None, name_cache: typing.Optional[NameCache] = None) -> bytes:
+    """Returns pio as JSON (UTF-8)."""
+    return _dumps_str(pio, reader, name_cache).encode('utf-8')
+
+def load(data: typing.Union[bytes, str]) -> ParameterIO:
+    """Loads a ParameterIO from a JSON document."""
+    with timer('json.load'):
+        return from_json_data(json.loads(data))
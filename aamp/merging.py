@@ -0,0 +1,177 @@
+# Three-way and N-way merging of parameter archives.
+import array
+import enum
+import typing
+
+from aamp.aamp import Reader, _Buffer
+from aamp.diffing import ChangePath, TreeDigests
+from aamp.parameters import *
+
+class MergePolicy(enum.Enum):
+    """How conflicting changes are resolved."""
+    Raise = 0 # raise a MergeConflictError that lists every conflict
+    PreferFirst = 1 # use the change from the first modified archive (ours in a three-way merge)
+    PreferLast = 2 # use the change from the last modified archive (theirs in a three-way merge)
+    KeepBase = 3 # keep the base value
+
+class Conflict(typing.NamedTuple):
+    """Incompatible changes to a parameter, object or list.
+
+    path contains the CRC32s that lead to the conflicting node, like Change.path. base is the base value
+    and values contains the value in each modified archive. None means that the node does not exist.
+    """
+    path: ChangePath
+    base: typing.Any
+    values: typing.Tuple[typing.Any, ...]
+
+class MergeConflictError(ValueError):
+    def __init__(self, conflicts: typing.List[Conflict]) -> None:
+        super().__init__(f'{len(conflicts)} merge conflict(s)')
+        self.conflicts = conflicts
+
+class MergeResult(typing.NamedTuple):
+    pio: ParameterIO
+    conflicts: typing.List[Conflict]
+
+_Node = typing.Union[ParameterList, ParameterObject]
+# (parameter type, encoded value, object the value comes from)
+_EncodedParam = typing.Tuple[int, bytes, ParameterObject]
+
+class _Merger:
+    def __init__(self, policy: MergePolicy) -> None:
+        self.policy = policy
+        self.conflicts: typing.List[Conflict] = []
+        self.digests = TreeDigests()
+
+    def _resolve(self, path: ChangePath, base: typing.Any, values: typing.Sequence[typing.Any], changed: typing.List[typing.Any],
+                 report: typing.Callable[[typing.Any], typing.Any] = lambda v: v) -> typing.Any:
+        self.conflicts.append(Conflict(path, report(base), tuple(report(v) for v in values)))
+        if self.policy == MergePolicy.PreferFirst:
+            return changed[0]
+        if self.policy == MergePolicy.PreferLast:
+            return changed[-1]
+        return base
+
+    def merge_node(self, base: typing.Optional[_Node], nodes: typing.Sequence[typing.Optional[_Node]], path: ChangePath) -> typing.Optional[_Node]:
+        digest = self.digests.digest
+        base_digest = digest(base) if base is not None else None
+        changed = [(node, node_digest) for node, node_digest in ((n, digest(n) if n is not None else None) for n in nodes)
+                   if node_digest != base_digest]
+        if not changed:
+            return base
+        # Only one version of the node differs from the base: no need to look inside it.
+        if all(node_digest == changed[0][1] for _, node_digest in changed):
+            return changed[0][0]
+
+        present = [node for node, _ in changed if node is not None]
+        kind = ParameterList if isinstance(present[0], ParameterList) else ParameterObject
+        if len(present) != len(changed) or not all(isinstance(node, kind) for node in present):
+            # Removed in one archive and modified in another, or replaced with a different kind of node.
+            return self._resolve(path, base, nodes, [node for node, _ in changed])
+        if base is None or not isinstance(base, kind):
+            base = kind()
+        if kind is ParameterList:
+            return self.merge_lists(base, nodes, path) # type: ignore
+        return self.merge_objects(base, nodes, path) # type: ignore
+
+    def _merge_children(self, base: typing.Mapping[int, _Node], children: typing.List[typing.Optional[typing.Mapping[int, _Node]]],
+                        path: ChangePath) -> typing.Dict[int, _Node]:
+        keys = dict.fromkeys(base)
+        for child_map in children:
+            if child_map is not None:
+                keys.update(dict.fromkeys(child_map))
+        result: typing.Dict[int, _Node] = dict()
+        for crc32 in keys:
+            merged = self.merge_node(base.get(crc32), [c.get(crc32) if c is not None else None for c in children], path + (crc32,))
+            if merged is not None:
+                result[crc32] = merged
+        return result
+
+    def merge_lists(self, base: ParameterList, plists: typing.Sequence[typing.Optional[ParameterList]], path: ChangePath) -> ParameterList:
+        result = ParameterList()
+        result.lists = self._merge_children(base.lists, [p.lists if p is not None else None for p in plists], path) # type: ignore
+        result.objects = self._merge_children(base.objects, [p.objects if p is not None else None for p in plists], path) # type: ignore
+        return result
+
+    def _encoded_params(self, pobj: ParameterObject) -> typing.Dict[int, _EncodedParam]:
+        return {crc32: (param_type, data, pobj) for crc32, (param_type, data) in self.digests.encoded_params(pobj).items()}
+
+    def merge_objects(self, base: ParameterObject, pobjs: typing.Sequence[typing.Optional[ParameterObject]], path: ChangePath) -> ParameterObject:
+        base_params = self._encoded_params(base)
+        params = [self._encoded_params(p) if p is not None else dict() for p in pobjs]
+        keys = dict.fromkeys(base_params)
+        for p in params:
+            keys.update(dict.fromkeys(p))
+
+        def same(a: typing.Optional[_EncodedParam], b: typing.Optional[_EncodedParam]) -> bool:
+            return a is b or (a is not None and b is not None and a[0] == b[0] and a[1] == b[1])
+
+        def decode(param: typing.Optional[_EncodedParam]) -> typing.Any:
+            return param[2].params[crc32] if param is not None else None
+
+        merged: typing.List[typing.Tuple[int, _EncodedParam]] = []
+        for crc32 in keys:
+            base_param = base_params.get(crc32)
+            values = [p.get(crc32) for p in params]
+            changed = [v for v in values if not same(v, base_param)]
+            if not changed:
+                value = base_param
+            elif all(same(v, changed[0]) for v in changed):
+                value = changed[0]
+            else:
+                value = self._resolve(path + (crc32,), base_param, values, changed, decode)
+            if value is not None:
+                merged.append((crc32, value))
+
+        if type(base) is CompactParameterObject:
+            return CompactParameterObject.from_encoded(array.array('I', (crc32 for crc32, _ in merged)),
+                                                       bytes(param_type for _, (param_type, _, _) in merged),
+                                                       [data for _, (_, data, _) in merged])
+        result = ParameterObject()
+        result.params = {crc32: source.params[crc32] for crc32, (_, _, source) in merged}
+        return result
+
+def _to_pio(data: typing.Union[ParameterIO, _Buffer]) -> ParameterIO:
+    return data if isinstance(data, ParameterIO) else Reader(data).parse(compact=True)
+
+def merge_all(base: typing.Union[ParameterIO, _Buffer], modified: typing.Sequence[typing.Union[ParameterIO, _Buffer]],
+              policy: MergePolicy = MergePolicy.Raise) -> MergeResult:
+    """Merges the changes that several archives made to a base archive.
+
+    Trees are merged by CRC32 keys and parameters are compared by typed value. Changes to different
+    parameters, objects or lists are combined, and identical changes are not conflicts. Subtrees that
+    only one archive changed (or that none changed) are taken as is, using structural digests.
+    Other conflicts are resolved according to the policy and listed in the result.
+
+    The merged ParameterIO shares unmodified lists and objects with the inputs, which must not be modified
+    while it is in use. Binary archives are parsed in compact form, unless they are identical to the base.
+    """
+    if not isinstance(base, ParameterIO):
+        # Binary archives that are identical to the base did not change anything and are not parsed.
+        base_view = memoryview(base)
+        modified = [m for m in modified if isinstance(m, ParameterIO) or memoryview(m) != base_view]
+    base = _to_pio(base)
+    pios = [_to_pio(pio) for pio in modified]
+    merger = _Merger(policy)
+    attrs = []
+    for attr in ('type', 'version'):
+        base_value = getattr(base, attr)
+        values = [getattr(pio, attr) for pio in pios]
+        changed = [v for v in values if v != base_value]
+        if not changed or all(v == changed[0] for v in changed):
+            attrs.append(changed[0] if changed else base_value)
+        else:
+            attrs.append(merger._resolve((attr,), base_value, values, changed))
+
+    merged = merger.merge_lists(base, pios, ())
+    result = ParameterIO(type_=attrs[0], version=attrs[1])
+    result.lists = merged.lists
+    result.objects = merged.objects
+    if merger.conflicts and policy == MergePolicy.Raise:
+        raise MergeConflictError(merger.conflicts)
+    return MergeResult(result, merger.conflicts)
+
+def merge(base: typing.Union[ParameterIO, _Buffer], ours: typing.Union[ParameterIO, _Buffer], theirs: typing.Union[ParameterIO, _Buffer],
+          policy: MergePolicy = MergePolicy.Raise) -> MergeResult:
+    """Three-way merge of two archives that were derived from base. See merge_all."""
+    return merge_all(base, [ours, theirs], policy)
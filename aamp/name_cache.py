@@ -0,0 +1,86 @@
+import os
+import threading
+import typing
+import zlib
+
+from aamp.util import get_cache_dir
+
+class NameCache:
+    """Persistent CRC32 -> name cache for names that could not be looked up in the name tables
+    (guessed names and strings found in previously converted archives).
+
+    Names are stored in an append-only text file with one name per line.
+    New names are only written to disk when flush() is called.
+    A NameCache can be shared between threads.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._names: typing.Optional[typing.Dict[int, str]] = None
+        self._pending_names: typing.List[str] = []
+        self._lock = threading.Lock()
+
+    def _get_names(self) -> typing.Dict[int, str]:
+        names = self._names
+        if names is not None:
+            return names
+        with self._lock:
+            if self._names is None:
+                names = dict()
+                try:
+                    with open(self._path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            name = line.rstrip('\n')
+                            names[zlib.crc32(name.encode())] = name
+                except OSError:
+                    pass
+                self._names = names
+            return self._names
+
+    def get(self, crc32: int, default=None):
+        return self._get_names().get(crc32, default)
+
+    def add(self, name: str) -> None:
+        if '\n' in name:
+            return
+        names = self._get_names()
+        crc32 = zlib.crc32(name.encode())
+        if names.get(crc32) == name:
+            return
+        with self._lock:
+            if names.get(crc32) != name:
+                names[crc32] = name
+                self._pending_names.append(name)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending_names:
+                return
+            data = ''.join(f'{name}\n' for name in self._pending_names)
+            self._pending_names.clear()
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                with open(self._path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+            except OSError:
+                pass
+
+_DEFAULT = object()
+_name_cache: typing.Any = _DEFAULT
+_name_cache_lock = threading.Lock()
+
+def get_name_cache() -> typing.Optional[NameCache]:
+    """Returns the name cache that is used for name resolution, or None if caching is disabled.
+
+    By default, names are cached in resolved_names.txt in the user cache directory.
+    """
+    global _name_cache
+    if _name_cache is _DEFAULT:
+        with _name_cache_lock:
+            if _name_cache is _DEFAULT:
+                _name_cache = NameCache(os.path.join(get_cache_dir(), 'resolved_names.txt'))
+    return _name_cache
+
+def set_name_cache(cache: typing.Optional[NameCache]) -> None:
+    """Replaces the name cache. Pass None to disable caching."""
+    global _name_cache
+    _name_cache = cache
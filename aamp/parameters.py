@@ -1,5 +1,9 @@
 import abc
-from dataclasses import dataclass, field
+import array
+import collections.abc
+import operator
+import struct
+from dataclasses import dataclass, field, fields
 from enum import IntEnum
 import typing
 import zlib
@@ -78,25 +82,41 @@ class ParameterIO(ParameterList):
     def __repr__(self) -> str:
         return f'ParameterIO(type_={self.type}, version={self.version}, lists={repr(self.lists)})'
 
-@dataclass
+def _slotted_dataclass(cls):
+    """Same as @dataclass(slots=True), which requires Python 3.10.
+
+    Instances have no __dict__, which makes them smaller and faster to create.
+    """
+    cls = dataclass(cls)
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(f.name for f in fields(cls))
+    for name in field_names:
+        # Defaults are stored by the generated __init__ and must not clash with the slots.
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    cls_dict['__slots__'] = field_names
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+@_slotted_dataclass
 class Vec2:
     x: float = 0.0
     y: float = 0.0
 
-@dataclass
+@_slotted_dataclass
 class Vec3:
     x: float = 0.0
     y: float = 0.0
     z: float = 0.0
 
-@dataclass
+@_slotted_dataclass
 class Vec4:
     x: float = 0.0
     y: float = 0.0
     z: float = 0.0
     w: float = 0.0
 
-@dataclass
+@_slotted_dataclass
 class Color:
     r: float = 0.0
     g: float = 0.0
@@ -118,66 +138,323 @@ class String256(str):
 class U32(int):
     pass
 
-@dataclass
+@_slotted_dataclass
 class Quat:
     a: float = 0.0
     b: float = 0.0
     c: float = 0.0
     d: float = 0.0
 
-@dataclass
+@_slotted_dataclass
 class Curve:
     v: list = field(default_factory=list)
 
-def value_to_bytes(v: typing.Any) -> typing.Tuple[ParameterType, bytes]:
-    if isinstance(v, bool):
-        return (ParameterType.Bool, u32(v))
-    if isinstance(v, float):
-        return (ParameterType.F32, f32(v))
-    if isinstance(v, U32):
-        return (ParameterType.U32, u32(v))
-    if isinstance(v, int):
-        return (ParameterType.Int, s32(v))
-    if isinstance(v, Vec2):
-        return (ParameterType.Vec2, f32(v.x) + f32(v.y))
-    if isinstance(v, Vec3):
-        return (ParameterType.Vec3, f32(v.x) + f32(v.y) + f32(v.z))
-    if isinstance(v, Vec4):
-        return (ParameterType.Vec4, f32(v.x) + f32(v.y) + f32(v.z) + f32(v.w))
-    if isinstance(v, Color):
-        return (ParameterType.Color, f32(v.r) + f32(v.g) + f32(v.b) + f32(v.a))
-    if isinstance(v, Quat):
-        return (ParameterType.Quat, f32(v.a) + f32(v.b) + f32(v.c) + f32(v.d))
-    if isinstance(v, Curve):
-        buf = b''
-        for item in v.v:
-            if isinstance(item, int):
-                buf += u32(item)
-            elif isinstance(item, float):
-                buf += f32(item)
-            else:
-                raise ValueError('Invalid item in curve parameter')
-        return (ParameterType(ParameterType.Curve1 + (len(buf) // 0x80) - 1), buf)
-    if isinstance(v, String32):
-        return (ParameterType.String32, string(v))
-    if isinstance(v, String64):
-        return (ParameterType.String64, string(v))
-    if isinstance(v, String256):
-        return (ParameterType.String256, string(v))
-    if isinstance(v, str):
-        return (ParameterType.StringRef, string(v))
-    if isinstance(v, bytes):
-        return (ParameterType.BufferBinary, v)
-    # if isinstance(v, list):
-    #     for i in range(len(v) - 1):
-    #         if not isinstance(v[i], type(v[i + 1])):
-    #             raise ValueError('Arrays/buffers must have homogeneous types')
-    #     if not v:
-    #         raise ValueError('Arrays/buffers must not be empty')
-    #     if isinstance(v[0], U32):
-    #         return (ParameterType.BufferU32, b''.join(u32(x) for x in v))
-    #     if isinstance(v[0], int):
-    #         return (ParameterType.BufferInt, b''.join(s32(x) for x in v))
-    #     if isinstance(v[0], float):
-    #         return (ParameterType.BufferF32, b''.join(f32(x) for x in v))
+# Each curve is made of 2 u32s followed by 30 f32s (0x80 bytes).
+# A Curve parameter may hold up to 4 curves (Curve1 to Curve4).
+_CURVE_STRUCTS = tuple(struct.Struct('<' + '2I30f'*n) for n in range(1, 5))
+
+_STRING_PARAMETER_TYPES = frozenset((ParameterType.String32, ParameterType.String64, ParameterType.String256, ParameterType.StringRef))
+# Buffer values start with a u32 item count (or size in bytes for binary buffers).
+# Parameters point to the first item, after the count.
+_BUFFER_PARAMETER_TYPES = frozenset((ParameterType.BufferInt, ParameterType.BufferF32, ParameterType.BufferU32, ParameterType.BufferBinary))
+
+_STRUCT_U32 = struct.Struct('<I')
+_STRUCT_S32 = struct.Struct('<i')
+_STRUCT_F32 = struct.Struct('<f')
+_STRUCT_VEC2 = struct.Struct('<2f')
+_STRUCT_VEC3 = struct.Struct('<3f')
+_STRUCT_VEC4 = struct.Struct('<4f')
+
+# Value encoders take a value and return its parameter type and encoded bytes.
+_ValueEncoder = typing.Callable[[typing.Any], typing.Tuple[ParameterType, bytes]]
+
+def _make_scalar_encoder(param_type: ParameterType, pack: typing.Callable[[typing.Any], bytes]) -> _ValueEncoder:
+    def encode(v: typing.Any) -> typing.Tuple[ParameterType, bytes]:
+        return (param_type, pack(v))
+    return encode
+
+def _make_vector_encoder(param_type: ParameterType, pack: typing.Callable[..., bytes], *field_names: str) -> _ValueEncoder:
+    get_fields = operator.attrgetter(*field_names)
+    def encode(v: typing.Any) -> typing.Tuple[ParameterType, bytes]:
+        return (param_type, pack(*get_fields(v)))
+    return encode
+
+def _make_string_encoder(param_type: ParameterType) -> _ValueEncoder:
+    def encode(v: str) -> typing.Tuple[ParameterType, bytes]:
+        return (param_type, v.encode() + b'\0')
+    return encode
+
+def _encode_bool(v: bool) -> typing.Tuple[ParameterType, bytes]:
+    return (ParameterType.Bool, _TRUE_BYTES if v else _FALSE_BYTES)
+_TRUE_BYTES = _STRUCT_U32.pack(1)
+_FALSE_BYTES = _STRUCT_U32.pack(0)
+
+def _encode_curve(v: Curve) -> typing.Tuple[ParameterType, bytes]:
+    num_curves, remainder = divmod(len(v.v), 32)
+    if remainder != 0 or not 1 <= num_curves <= 4:
+        raise ValueError('Invalid number of items in curve parameter')
+    try:
+        buf = _CURVE_STRUCTS[num_curves - 1].pack(*v.v)
+    except struct.error:
+        raise ValueError('Invalid item in curve parameter')
+    return (ParameterType(ParameterType.Curve1 + num_curves - 1), buf)
+
+def _encode_binary_buffer(v: bytes) -> typing.Tuple[ParameterType, bytes]:
+    return (ParameterType.BufferBinary, _STRUCT_U32.pack(len(v)) + v)
+
+# Item type -> (buffer parameter type, struct format character).
+_BUFFER_FORMATS = {
+    U32: (ParameterType.BufferU32, 'I'),
+    int: (ParameterType.BufferInt, 'i'),
+    float: (ParameterType.BufferF32, 'f'),
+}
+
+def _encode_buffer(v: list) -> typing.Tuple[ParameterType, bytes]:
+    if not v:
+        raise ValueError('Arrays/buffers must not be empty')
+    item_type = type(v[0])
+    buffer_format = _BUFFER_FORMATS.get(item_type)
+    if buffer_format is None:
+        raise ValueError('Unsupported buffer item type: %s' % item_type.__name__)
+    if not all(type(x) is item_type for x in v):
+        raise ValueError('Arrays/buffers must have homogeneous types')
+    param_type, item_format = buffer_format
+    try:
+        return (param_type, struct.pack('<I%d%s' % (len(v), item_format), len(v), *v))
+    except struct.error:
+        raise ValueError('Invalid item in buffer parameter')
+
+_VALUE_ENCODERS: typing.Dict[type, _ValueEncoder] = {
+    bool: _encode_bool,
+    float: _make_scalar_encoder(ParameterType.F32, _STRUCT_F32.pack),
+    U32: _make_scalar_encoder(ParameterType.U32, _STRUCT_U32.pack),
+    int: _make_scalar_encoder(ParameterType.Int, _STRUCT_S32.pack),
+    Vec2: _make_vector_encoder(ParameterType.Vec2, _STRUCT_VEC2.pack, 'x', 'y'),
+    Vec3: _make_vector_encoder(ParameterType.Vec3, _STRUCT_VEC3.pack, 'x', 'y', 'z'),
+    Vec4: _make_vector_encoder(ParameterType.Vec4, _STRUCT_VEC4.pack, 'x', 'y', 'z', 'w'),
+    Color: _make_vector_encoder(ParameterType.Color, _STRUCT_VEC4.pack, 'r', 'g', 'b', 'a'),
+    Quat: _make_vector_encoder(ParameterType.Quat, _STRUCT_VEC4.pack, 'a', 'b', 'c', 'd'),
+    Curve: _encode_curve,
+    String32: _make_string_encoder(ParameterType.String32),
+    String64: _make_string_encoder(ParameterType.String64),
+    String256: _make_string_encoder(ParameterType.String256),
+    str: _make_string_encoder(ParameterType.StringRef),
+    bytes: _encode_binary_buffer,
+    list: _encode_buffer,
+}
+
+def _get_value_encoder(t: type) -> _ValueEncoder:
+    """Returns the encoder for values of type t (which may be a subclass of a supported type)."""
+    encoder = _VALUE_ENCODERS.get(t)
+    if encoder is not None:
+        return encoder
+    for base in t.__mro__[1:]:
+        encoder = _VALUE_ENCODERS.get(base)
+        if encoder is not None:
+            return encoder
     raise ValueError('Unsupported or invalid data type')
+
+def value_to_bytes(v: typing.Any) -> typing.Tuple[ParameterType, bytes]:
+    return _get_value_encoder(type(v))(v)
+
+def encode_params(params: typing.Mapping[int, typing.Any]) -> typing.List[typing.Tuple[int, ParameterType, bytes]]:
+    """Encodes all parameters of an object. Returns (CRC32, parameter type, encoded value) for every parameter."""
+    encoders = _VALUE_ENCODERS
+    encoded = []
+    for crc32, v in params.items():
+        encoder = encoders.get(type(v))
+        if encoder is None:
+            encoder = _get_value_encoder(type(v))
+        param_type, data = encoder(v)
+        encoded.append((crc32, param_type, data))
+    return encoded
+
+
+def _decode_buffer(data: bytes, fmt: str) -> list:
+    count = _STRUCT_U32.unpack_from(data)[0]
+    return list(struct.unpack_from('<%d%s' % (count, fmt), data, 4))
+
+_VALUE_DECODERS: typing.Dict[int, typing.Callable[[bytes], typing.Any]] = {
+    ParameterType.Bool: lambda b: _STRUCT_U32.unpack(b)[0] != 0,
+    ParameterType.F32: lambda b: _STRUCT_F32.unpack(b)[0],
+    ParameterType.Int: lambda b: _STRUCT_S32.unpack(b)[0],
+    ParameterType.U32: lambda b: U32(_STRUCT_U32.unpack(b)[0]),
+    ParameterType.Vec2: lambda b: Vec2(*_STRUCT_VEC2.unpack(b)),
+    ParameterType.Vec3: lambda b: Vec3(*_STRUCT_VEC3.unpack(b)),
+    ParameterType.Vec4: lambda b: Vec4(*_STRUCT_VEC4.unpack(b)),
+    ParameterType.Color: lambda b: Color(*_STRUCT_VEC4.unpack(b)),
+    ParameterType.Quat: lambda b: Quat(*_STRUCT_VEC4.unpack(b)),
+    ParameterType.Curve1: lambda b: Curve(list(_CURVE_STRUCTS[0].unpack(b))),
+    ParameterType.Curve2: lambda b: Curve(list(_CURVE_STRUCTS[1].unpack(b))),
+    ParameterType.Curve3: lambda b: Curve(list(_CURVE_STRUCTS[2].unpack(b))),
+    ParameterType.Curve4: lambda b: Curve(list(_CURVE_STRUCTS[3].unpack(b))),
+    # Strings are stored with their null terminator.
+    ParameterType.String32: lambda b: String32(b[:-1].decode()),
+    ParameterType.String64: lambda b: String64(b[:-1].decode()),
+    ParameterType.String256: lambda b: String256(b[:-1].decode()),
+    ParameterType.StringRef: lambda b: b[:-1].decode(),
+    # Buffers are stored with their u32 item count (or size in bytes for binary buffers).
+    ParameterType.BufferInt: lambda b: _decode_buffer(b, 'i'),
+    ParameterType.BufferF32: lambda b: _decode_buffer(b, 'f'),
+    ParameterType.BufferU32: lambda b: list(map(U32, _decode_buffer(b, 'I'))),
+    ParameterType.BufferBinary: lambda b: bytes(b[4:4 + _STRUCT_U32.unpack_from(b)[0]]),
+}
+
+def value_from_bytes(param_type: int, data: bytes) -> typing.Any:
+    """Decodes a parameter value that is stored in the same form as in a binary archive."""
+    decoder = _VALUE_DECODERS.get(param_type)
+    if decoder is None:
+        raise ValueError('Unknown parameter type: %u' % param_type)
+    return decoder(data)
+
+class _CompactParamsItemsView(collections.abc.ItemsView):
+    def __iter__(self):
+        return self._mapping._pobj._iter_items()
+
+class _CompactParamsValuesView(collections.abc.ValuesView):
+    def __iter__(self):
+        return (value for _, value in self._mapping._pobj._iter_items())
+
+class _CompactParams(collections.abc.MutableMapping):
+    """Mapping view (CRC32 -> value) of the parameters of a CompactParameterObject."""
+    __slots__ = ('_pobj',)
+    def __init__(self, pobj: 'CompactParameterObject') -> None:
+        self._pobj = pobj
+
+    def __getitem__(self, crc32: int) -> typing.Any:
+        return self._pobj._get(self._pobj._index(crc32))
+
+    def __setitem__(self, crc32: int, value: typing.Any) -> None:
+        self._pobj._set(crc32, value)
+
+    def __delitem__(self, crc32: int) -> None:
+        self._pobj._delete(self._pobj._index(crc32))
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._pobj._keys)
+
+    def __len__(self) -> int:
+        return len(self._pobj._keys)
+
+    def __contains__(self, crc32: object) -> bool:
+        return crc32 in self._pobj._keys
+
+    def items(self):
+        return _CompactParamsItemsView(self)
+
+    def values(self):
+        return _CompactParamsValuesView(self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+class CompactParameterObject(ParameterObject):
+    """A ParameterObject that keeps its parameters encoded like in a binary archive.
+
+    CRC32s are stored in an array, parameter types in a byte string and the values in a single
+    buffer, and values are only decoded when they are accessed. This uses much less memory than
+    a dict of Python objects, and the Writer can copy the encoded values as is.
+
+    params is a mutable mapping view with the same interface as a dict.
+    """
+    __slots__ = ('_keys', '_types', '_offsets', '_data')
+    def __init__(self, params: typing.Optional[typing.Mapping[int, typing.Any]] = None) -> None:
+        self._crc32 = -1
+        self._keys = array.array('I')
+        self._types = b''
+        # Offset of the value of each parameter in _data, followed by the size of _data.
+        self._offsets = array.array('I', (0,))
+        self._data = b''
+        if params is not None:
+            self.params = params
+
+    @classmethod
+    def from_encoded(cls, keys: array.array, types: bytes, values: typing.List[bytes]) -> 'CompactParameterObject':
+        """Builds an object from parameter CRC32s, types and encoded values."""
+        pobj = cls()
+        pobj._keys = keys
+        pobj._types = types
+        offsets = pobj._offsets
+        offset = 0
+        for value in values:
+            offset += len(value)
+            offsets.append(offset)
+        pobj._data = b''.join(values)
+        return pobj
+
+    @property
+    def params(self) -> _CompactParams: # type: ignore
+        return _CompactParams(self)
+
+    @params.setter
+    def params(self, params: typing.Mapping[int, typing.Any]) -> None:
+        keys = array.array('I')
+        types = bytearray()
+        values: typing.List[bytes] = []
+        for crc32, param_type, data in encode_params(params):
+            keys.append(crc32)
+            types.append(param_type)
+            values.append(data)
+        encoded = CompactParameterObject.from_encoded(keys, bytes(types), values)
+        self._keys = encoded._keys
+        self._types = encoded._types
+        self._offsets = encoded._offsets
+        self._data = encoded._data
+
+    def param(self, name: str):
+        return self._get(self._index(zlib.crc32(name.encode())))
+
+    def iter_encoded(self) -> typing.Iterator[typing.Tuple[int, int, bytes]]:
+        """Yields (CRC32, parameter type, encoded value) for every parameter."""
+        data = self._data
+        offsets = self._offsets
+        for i, (crc32, param_type) in enumerate(zip(self._keys, self._types)):
+            yield (crc32, param_type, data[offsets[i]:offsets[i + 1]])
+
+    def _index(self, crc32: int) -> int:
+        try:
+            return self._keys.index(crc32)
+        except (ValueError, TypeError, OverflowError):
+            raise KeyError(crc32) from None
+
+    def _get(self, i: int) -> typing.Any:
+        return value_from_bytes(self._types[i], self._data[self._offsets[i]:self._offsets[i + 1]])
+
+    def _iter_items(self) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+        for crc32, param_type, data in self.iter_encoded():
+            yield (crc32, value_from_bytes(param_type, data))
+
+    def _set(self, crc32: int, value: typing.Any) -> None:
+        param_type, data = value_to_bytes(value)
+        try:
+            i = self._keys.index(crc32)
+        except ValueError:
+            self._keys.append(crc32)
+            self._types += bytes((param_type,))
+            self._data += data
+            self._offsets.append(len(self._data))
+            return
+        self._replace(i, param_type, data)
+
+    def _delete(self, i: int) -> None:
+        del self._keys[i]
+        self._types = self._types[:i] + self._types[i + 1:]
+        self._replace(i, None, b'')
+
+    def _replace(self, i: int, param_type: typing.Optional[int], data: bytes) -> None:
+        """Replaces the value of parameter i (or removes it if param_type is None)."""
+        start, end = self._offsets[i], self._offsets[i + 1]
+        self._data = self._data[:start] + data + self._data[end:]
+        delta = len(data) - (end - start)
+        offsets = self._offsets
+        if param_type is None:
+            del offsets[i + 1]
+            for j in range(i + 1, len(offsets)):
+                offsets[j] += delta
+            return
+        self._types = self._types[:i] + bytes((param_type,)) + self._types[i + 1:]
+        for j in range(i + 1, len(offsets)):
+            offsets[j] += delta
+
+    def __repr__(self) -> str:
+        return f'CompactParameterObject(params={repr(self.params)})'
@@ -0,0 +1,225 @@
+# In-place editing of binary parameter archives.
+import bisect
+import typing
+import zlib
+
+from aamp.aamp import _CHILD_REF, _FILE_HEADER, _LIST_HEADER, _OBJ_HEADER, _PARAM_HEADER, _BUFFER_ITEM_SIZES, _VALUE_SIZES
+from aamp.parameters import *
+from aamp.util import *
+
+ParameterPath = typing.Union[str, typing.Sequence[typing.Union[str, int]]]
+
+def _parse_path(path: ParameterPath) -> typing.List[int]:
+    """Returns the CRC32s of the components of a parameter path.
+
+    A path is either a string ('param_root/List/Object/Param') or a sequence of names and CRC32s.
+    """
+    components = path.split('/') if isinstance(path, str) else path
+    crc32s = [c if isinstance(c, int) else zlib.crc32(c.encode()) for c in components]
+    if len(crc32s) < 3:
+        raise ValueError('A parameter path must contain at least a root list, an object and a parameter')
+    return crc32s
+
+def _find_child(buf, offset: int, field_offset: int, entry_size: int, crc32: int, path: ParameterPath) -> int:
+    rel_offset, count = _CHILD_REF.unpack_from(buf, offset + field_offset)
+    start = offset + 4*rel_offset
+    for child_offset in range(start, start + entry_size*count, entry_size):
+        if get_u32(buf, child_offset) == crc32:
+            return child_offset
+    raise KeyError(path)
+
+def find_param(buf, path: ParameterPath, offset: int = 0) -> typing.Tuple[int, ParameterType, int]:
+    """Locates a parameter in a binary archive by walking the list, object and parameter headers.
+
+    Only the headers on the path to the parameter are read.
+    Returns the offsets of the parameter header and of its data, and the parameter type.
+    KeyError is raised if the parameter doesn't exist.
+    """
+    crc32s = _parse_path(path)
+    if bytes(buf[offset:offset + 4]) != b'AAMP':
+        raise ValueError('Invalid magic (expected AAMP)')
+    list_offset = offset + 0x30 + get_u32(buf, offset + 0x14)
+    if get_u32(buf, list_offset) != crc32s[0]:
+        raise KeyError(path)
+    for crc32 in crc32s[1:-2]:
+        list_offset = _find_child(buf, list_offset, 4, _LIST_HEADER.size, crc32, path)
+    obj_offset = _find_child(buf, list_offset, 8, _OBJ_HEADER.size, crc32s[-2], path)
+    param_offset = _find_child(buf, obj_offset, 4, _PARAM_HEADER.size, crc32s[-1], path)
+    field_4 = get_u32(buf, param_offset + 4)
+    return (param_offset, ParameterType(field_4 >> 24), param_offset + 4*(field_4 & 0xffffff))
+
+def _coerce_value(param_type: ParameterType, value: typing.Any) -> typing.Any:
+    """Converts integers to the numeric type of the parameter."""
+    if type(value) is bool:
+        return value
+    if param_type == ParameterType.F32 and isinstance(value, int):
+        return float(value)
+    if param_type == ParameterType.U32 and isinstance(value, int):
+        return U32(value)
+    if param_type == ParameterType.Int and isinstance(value, U32):
+        return int(value)
+    return value
+
+def _iter_param_data(buf, offset: int) -> typing.Iterator[typing.Tuple[int, int, int, int]]:
+    """Yields (header offset, type, data start, data end) for every non-string parameter in the archive.
+    For buffers, the data includes the item count that precedes the items."""
+    header = _FILE_HEADER.unpack_from(buf, offset)
+    format_len, num_lists, num_objs, num_params = header[5], header[6], header[7], header[8]
+    params_start = offset + 0x30 + format_len + _LIST_HEADER.size*num_lists + _OBJ_HEADER.size*num_objs
+    for i, (_, field_4) in enumerate(_PARAM_HEADER.iter_unpack(bytes(buf[params_start:params_start + _PARAM_HEADER.size*num_params]))):
+        header_offset = params_start + _PARAM_HEADER.size*i
+        param_type = field_4 >> 24
+        data_offset = header_offset + 4*(field_4 & 0xffffff)
+        size = _VALUE_SIZES.get(param_type)
+        if size is not None:
+            yield (header_offset, param_type, data_offset, data_offset + size)
+            continue
+        item_size = _BUFFER_ITEM_SIZES.get(param_type)
+        if item_size is not None:
+            yield (header_offset, param_type, data_offset - 4, data_offset + item_size*get_u32(buf, data_offset - 4))
+
+def _is_shared(buf, offset: int, param_offset: int, start: int, end: int) -> bool:
+    """Checks whether the data of another parameter overlaps [start, end)
+    (the Writer deduplicates values, so several parameters may point to the same bytes)."""
+    for header_offset, _, other_start, other_end in _iter_param_data(buf, offset):
+        if header_offset != param_offset and other_start < end and start < other_end:
+            return True
+    return False
+
+def _get_string_section_start(buf) -> int:
+    header = _FILE_HEADER.unpack_from(buf, 0)
+    return 0x30 + header[5] + _LIST_HEADER.size*header[6] + _OBJ_HEADER.size*header[7] + _PARAM_HEADER.size*header[8] + header[9]
+
+def _get_string_params(buf) -> typing.List[int]:
+    """Returns the header offsets of the parameters whose data is in the string section."""
+    header = _FILE_HEADER.unpack_from(buf, 0)
+    params_start = 0x30 + header[5] + _LIST_HEADER.size*header[6] + _OBJ_HEADER.size*header[7]
+    string_section_start = _get_string_section_start(buf)
+    return [header_offset for header_offset in range(params_start, params_start + _PARAM_HEADER.size*header[8], _PARAM_HEADER.size)
+            if header_offset + 4*(get_u32(buf, header_offset + 4) & 0xffffff) >= string_section_start]
+
+def _relocate(buf: bytearray, param_offset: int, data: bytes, string_params: typing.Optional[typing.List[int]] = None) -> int:
+    """Appends data to the end of the data section and points the parameter at param_offset to it.
+
+    The string section is moved and the offsets of string parameters (string_params, which are
+    looked up if not given) are updated accordingly. Returns the new offset of the data.
+    """
+    header = list(_FILE_HEADER.unpack_from(buf, 0))
+    string_section_start = _get_string_section_start(buf)
+    shift = len(data)
+
+    for header_offset in (string_params if string_params is not None else _get_string_params(buf)):
+        field_4 = get_u32(buf, header_offset + 4) + (shift >> 2)
+        if (field_4 & 0xffffff) < (shift >> 2):
+            raise ValueError('Cannot represent offset; it must fit in 24 bits')
+        buf[header_offset + 4:header_offset + 8] = u32(field_4)
+
+    rel_offset = (string_section_start - param_offset) >> 2
+    if rel_offset > 0xffffff:
+        raise ValueError('Cannot represent offset; it must fit in 24 bits')
+    field_4 = get_u32(buf, param_offset + 4)
+    buf[param_offset + 4:param_offset + 8] = u32((field_4 & 0xff000000) | rel_offset)
+
+    buf[string_section_start:string_section_start] = data
+    header[3] += shift # file size
+    header[9] += shift # data section size
+    _FILE_HEADER.pack_into(buf, 0, *header)
+    return string_section_start
+
+def _encode_patch(buf, path: ParameterPath, value: typing.Any, offset: int) -> typing.Optional[typing.Tuple[int, int, bytes]]:
+    """Returns the offsets of the parameter header and data and the encoded value, or None if the value is unchanged."""
+    param_offset, param_type, data_offset = find_param(buf, path, offset)
+    size = _VALUE_SIZES.get(param_type)
+    if size is None:
+        raise ValueError(f'Only fixed-size parameters can be patched in place (parameter type: {param_type.name})')
+    value_type, data = value_to_bytes(_coerce_value(param_type, value))
+    if value_type != param_type:
+        raise ValueError(f'Cannot store a {value_type.name} value in a {param_type.name} parameter')
+    if bytes(buf[data_offset:data_offset + size]) == data:
+        return None
+    return (param_offset, data_offset, data)
+
+def _write_patch(buf, offset: int, param_offset: int, data_offset: int, data: bytes, shared: bool,
+                 string_params: typing.Optional[typing.List[int]] = None) -> int:
+    """Writes a patched value, or a copy of it if it is shared. Returns the offset of the data."""
+    if shared:
+        if not isinstance(buf, bytearray) or offset != 0 or get_u32(buf, 0xc) != len(buf):
+            raise ValueError('The value is shared with other parameters and can only be copied '
+                'if the archive is in a bytearray of its own')
+        return _relocate(buf, param_offset, data, string_params)
+    buf[data_offset:data_offset + len(data)] = data
+    return data_offset
+
+def patch(buf, path: ParameterPath, value: typing.Any, offset: int = 0) -> None:
+    """Overwrites the value of a fixed-size parameter (Bool, F32, Int, U32, vectors, Color, Quat or curves)
+    in a binary archive in place, without parsing or rebuilding the archive.
+
+    buf must be writable (e.g. a bytearray or a writable mmap); the archive starts at offset.
+    path is a parameter path such as 'param_root/Basic/Edge/Damage'.
+    Integers are converted to the parameter's numeric type; other values must have the parameter's type.
+
+    If the value is shared with other parameters, the parameter is given its own copy of the value
+    at the end of the data section, which requires buf to be a bytearray that only holds the archive.
+
+    Finding the parameter only reads the headers on its path, but checking whether its value is shared
+    reads every parameter header, so a patch costs O(number of parameters). Use a Patcher to apply
+    several patches to the same archive.
+    """
+    patch_data = _encode_patch(buf, path, value, offset)
+    if patch_data is None:
+        return
+    param_offset, data_offset, data = patch_data
+    shared = _is_shared(buf, offset, param_offset, data_offset, data_offset + len(data))
+    _write_patch(buf, offset, param_offset, data_offset, data, shared)
+
+class Patcher:
+    """Patches several parameters of a binary archive in place (see patch()).
+
+    The data ranges of all parameters are indexed once when the Patcher is created (O(number of parameters)),
+    so each patch then only reads the headers on the path to the parameter and looks up the index
+    (O(log(number of parameters) + number of buffer parameters)). Copying a shared value also moves
+    the string section and updates the offsets of the string parameters.
+    The archive must only be modified through the Patcher while it is in use.
+    """
+    def __init__(self, buf, offset: int = 0) -> None:
+        self.buf = buf
+        self._offset = offset
+        # (start, end, header offset) of fixed-size values, sorted by start.
+        self._values: typing.List[typing.Tuple[int, int, int]] = []
+        # (start, end) of buffers, which may be arbitrarily long.
+        self._buffers: typing.List[typing.Tuple[int, int]] = []
+        for header_offset, param_type, start, end in _iter_param_data(buf, offset):
+            if param_type in _VALUE_SIZES:
+                self._values.append((start, end, header_offset))
+            else:
+                self._buffers.append((start, end))
+        self._values.sort()
+        # The longest fixed-size value bounds the search for overlapping values.
+        self._max_value_size = max((end - start for start, end, _ in self._values), default=0)
+        # Header offsets of string parameters, which are updated when the string section is moved
+        # (values can only be copied if the archive starts at offset 0).
+        self._string_params = _get_string_params(buf) if offset == 0 else None
+
+    def _is_shared(self, param_offset: int, start: int, end: int) -> bool:
+        values = self._values
+        i = bisect.bisect_left(values, (start - self._max_value_size + 1,))
+        while i < len(values) and values[i][0] < end:
+            _, other_end, header_offset = values[i]
+            if header_offset != param_offset and start < other_end:
+                return True
+            i += 1
+        return any(other_start < end and start < other_end for other_start, other_end in self._buffers)
+
+    def patch(self, path: ParameterPath, value: typing.Any) -> None:
+        """Same as patch(), but uses the index to check whether the value is shared."""
+        patch_data = _encode_patch(self.buf, path, value, self._offset)
+        if patch_data is None:
+            return
+        param_offset, data_offset, data = patch_data
+        end = data_offset + len(data)
+        shared = self._is_shared(param_offset, data_offset, end)
+        new_data_offset = _write_patch(self.buf, self._offset, param_offset, data_offset, data, shared, self._string_params)
+        if new_data_offset != data_offset:
+            # Only the copied value moves: the string section, which is moved too, is not indexed.
+            del self._values[bisect.bisect_left(self._values, (data_offset, end, param_offset))]
+            bisect.insort(self._values, (new_data_offset, new_data_offset + len(data), param_offset))
@@ -0,0 +1,93 @@
+# Opt-in counters and phase timers for the Reader, the Writer and the converters.
+#
+# Statistics are disabled by default. Instrumented code only checks get_stats() once per
+# operation (parse, write, conversion), never per parameter, so disabled statistics cost nothing.
+import contextlib
+import json
+import threading
+import time
+import typing
+
+class Stats:
+    """Counters and cumulative phase timers. Methods can be called from several threads."""
+    def __init__(self) -> None:
+        self.counters: typing.Dict[str, int] = dict()
+        # Phase name -> [total seconds, number of times the phase ran]
+        self.timers: typing.Dict[str, typing.List[float]] = dict()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_counts(self, counts: typing.Mapping[str, int]) -> None:
+        with self._lock:
+            for name, n in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            timer = self.timers.setdefault(phase, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += count
+
+    @contextlib.contextmanager
+    def timer(self, phase: str) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def merge(self, data: typing.Mapping[str, typing.Any]) -> None:
+        """Adds statistics that were returned by to_dict() (e.g. in another process)."""
+        self.add_counts(data['counters'])
+        for phase, timer in data['timers'].items():
+            self.add_time(phase, timer['seconds'], timer['count'])
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            counters = dict(sorted(self.counters.items()))
+            timers = {phase: {'seconds': seconds, 'count': int(count)} for phase, (seconds, count) in sorted(self.timers.items())}
+        rates: typing.Dict[str, float] = dict()
+        for kind in ('values', 'strings'):
+            total = counters.get(f'writer.{kind}', 0)
+            if total:
+                rates[f'writer.{kind}_dedup_hit_rate'] = 1 - counters.get(f'writer.unique_{kind}', 0) / total
+        names_total = sum(n for name, n in counters.items() if name.startswith('names.'))
+        if names_total:
+            rates['names.resolved_rate'] = 1 - counters.get('names.unresolved', 0) / names_total
+        return {'counters': counters, 'timers': timers, 'rates': rates}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+class _NullTimer:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *args) -> None:
+        return None
+
+_NULL_TIMER = _NullTimer()
+
+_stats: typing.Optional[Stats] = None
+
+def get_stats() -> typing.Optional[Stats]:
+    """Returns the statistics that are being collected, or None if statistics are disabled."""
+    return _stats
+
+def enable_stats(stats: typing.Optional[Stats] = None) -> Stats:
+    """Starts collecting statistics (into a new Stats object by default) and returns the Stats object."""
+    global _stats
+    _stats = stats if stats is not None else Stats()
+    return _stats
+
+def disable_stats() -> None:
+    global _stats
+    _stats = None
+
+def timer(phase: str) -> typing.ContextManager[None]:
+    """Returns a context manager that times a phase if statistics are enabled."""
+    stats = _stats
+    return stats.timer(phase) if stats is not None else _NULL_TIMER
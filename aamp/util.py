@@ -1,5 +1,5 @@
+import os as _os # Not exported by "from aamp.util import *".
 import struct
-import typing
 
 _NUL_CHAR = b'\x00'
 
@@ -19,54 +19,27 @@ def f32(value: float) -> bytes:
 def string(value: str) -> bytes:
     return value.encode() + _NUL_CHAR
 
+_U8 = struct.Struct('B')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_S32 = struct.Struct('<i')
+_F32 = struct.Struct('<f')
+
 def get_u8(data, offset: int) -> int:
-    return struct.unpack_from('B', data, offset)[0]
+    return _U8.unpack_from(data, offset)[0]
 def get_u16(data, offset: int) -> int:
-    return struct.unpack_from('<H', data, offset)[0]
+    return _U16.unpack_from(data, offset)[0]
 def get_u32(data, offset: int) -> int:
-    return struct.unpack_from('<I', data, offset)[0]
+    return _U32.unpack_from(data, offset)[0]
 def get_s32(data, offset: int) -> int:
-    return struct.unpack_from('<i', data, offset)[0]
-def get_f32(data, offset: int) -> int:
-    return struct.unpack_from('<f', data, offset)[0]
+    return _S32.unpack_from(data, offset)[0]
+def get_f32(data, offset: int) -> float:
+    return _F32.unpack_from(data, offset)[0]
 def get_string(data, offset: int) -> str:
     end = data.find(_NUL_CHAR, offset)
     return data[offset:end].decode('utf-8')
 
-class PlaceholderOffsetWriter:
-    """Writes a placeholder offset value that will be filled later."""
-    def __init__(self, stream: typing.BinaryIO, base: int = 0) -> None:
-        self._stream = stream
-        self._offset = stream.tell()
-        self._base = base
-
-    def write_placeholder_32(self) -> None:
-        self._stream.write(u32(0xffffffff))
-    def write_placeholder_24(self) -> None:
-        self._stream.write(u8(0xff) + u8(0xff) + u8(0xff))
-    def write_placeholder_16(self) -> None:
-        self._stream.write(u16(0xffff))
-
-    def write_offset_32(self, offset: int) -> None:
-        current_offset = self._stream.tell()
-        self._stream.seek(self._offset)
-        self._stream.write(u32(offset - self._base))
-        self._stream.seek(current_offset)
-
-    def write_offset_24(self, offset: int) -> None:
-        current_offset = self._stream.tell()
-        self._stream.seek(self._offset)
-        x = struct.unpack('<I', self._stream.read(4))[0] >> 24
-        self._stream.seek(self._offset)
-        if (offset - self._base) % 4 != 0:
-            raise ValueError("Cannot represent offset; it must be divisible by 4")
-        self._stream.write(u32((x << 24) | ((offset - self._base) >> 2)))
-        self._stream.seek(current_offset)
-
-    def write_offset_16(self, offset: int) -> None:
-        current_offset = self._stream.tell()
-        self._stream.seek(self._offset)
-        if (offset - self._base) % 4 != 0:
-            raise ValueError("Cannot represent offset; it must be divisible by 4")
-        self._stream.write(u16((offset - self._base) >> 2))
-        self._stream.seek(current_offset)
+def get_cache_dir() -> str:
+    """Returns the directory used for caching generated data (which may not exist yet)."""
+    base = _os.environ.get('XDG_CACHE_HOME') or _os.path.join(_os.path.expanduser('~'), '.cache')
+    return _os.path.join(base, 'aamp')
@@ -0,0 +1,584 @@
+# Fast YAML emitter for parameter archives.
+#
+# This walks a ParameterIO directly and produces exactly the same output as yaml.dump() with
+# the representers from aamp.yaml_util and the options used by converters.aamp_to_yml,
+# without building a representation graph. The formatting logic (scalar analysis, style
+# selection, indentation and line folding) follows libyaml's emitter.
+import base64
+import re
+import time
+import typing
+import yaml
+
+from aamp.aamp import LazyParameterList, LazyParameterObject
+from aamp.parameters import *
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.name_cache import NameCache
+from aamp.stats import get_stats
+import aamp.yaml_util as yu
+
+_STR_TAG = 'tag:yaml.org,2002:str'
+_BEST_INDENT = 2
+_BEST_WIDTH = 80
+# Keys that are longer than this cannot be emitted as simple keys.
+_MAX_SIMPLE_KEY_LENGTH = 128
+
+_PLAIN = 0
+_SINGLE_QUOTED = 1
+_DOUBLE_QUOTED = 2
+_LITERAL = 3
+
+_BREAKS = '\r\n\x85\u2028\u2029'
+_DOUBLE_QUOTED_ESCAPES = {
+    '\0': '0', '\x07': 'a', '\x08': 'b', '\t': 't', '\n': 'n', '\x0b': 'v', '\x0c': 'f',
+    '\r': 'r', '\x1b': 'e', '"': '"', '\\': '\\', '\x85': 'N', '\xa0': '_',
+    '\u2028': 'L', '\u2029': 'P',
+}
+
+def _is_printable(ch: str) -> bool:
+    c = ord(ch)
+    return c == 0xa or 0x20 <= c <= 0x7e or 0xa0 <= c <= 0xd7ff or (0xe000 <= c <= 0xfffd and c != 0xfeff)
+
+class _ScalarAnalysis(typing.NamedTuple):
+    multiline: bool
+    flow_plain_allowed: bool
+    block_plain_allowed: bool
+    single_quoted_allowed: bool
+    block_allowed: bool
+
+# Scalars that match this never need quoting or escaping.
+_SIMPLE_SCALAR_RE = re.compile(r'-?[A-Za-z0-9_][A-Za-z0-9_./-]*\Z')
+_SIMPLE_SCALAR_ANALYSIS = _ScalarAnalysis(False, True, True, True, True)
+
+def _analyze_scalar(value: str) -> _ScalarAnalysis:
+    if _SIMPLE_SCALAR_RE.match(value):
+        return _SIMPLE_SCALAR_ANALYSIS
+    if not value:
+        return _ScalarAnalysis(False, False, True, True, False)
+
+    block_indicators = flow_indicators = False
+    if value.startswith('---') or value.startswith('...'):
+        block_indicators = flow_indicators = True
+
+    line_breaks = special_characters = False
+    leading_space = leading_break = trailing_space = trailing_break = False
+    break_space = space_break = previous_space = previous_break = False
+
+    preceded_by_whitespace = True
+    last = len(value) - 1
+    for i, ch in enumerate(value):
+        followed_by_whitespace = i == last or value[i + 1] in ' \t\0' or value[i + 1] in _BREAKS
+        if i == 0:
+            if ch in '#,[]{}&*!|>\'"%@`':
+                flow_indicators = block_indicators = True
+            if ch in '?:':
+                flow_indicators = True
+                if followed_by_whitespace:
+                    block_indicators = True
+            if ch == '-' and followed_by_whitespace:
+                flow_indicators = block_indicators = True
+        else:
+            if ch in ',?[]{}':
+                flow_indicators = True
+            if ch == ':':
+                flow_indicators = True
+                if followed_by_whitespace:
+                    block_indicators = True
+            if ch == '#' and preceded_by_whitespace:
+                flow_indicators = block_indicators = True
+
+        if not _is_printable(ch):
+            special_characters = True
+        if ch in _BREAKS:
+            line_breaks = True
+
+        if ch == ' ':
+            if i == 0:
+                leading_space = True
+            if i == last:
+                trailing_space = True
+            if previous_break:
+                break_space = True
+            previous_space = True
+            previous_break = False
+        elif ch in _BREAKS:
+            if i == 0:
+                leading_break = True
+            if i == last:
+                trailing_break = True
+            if previous_space:
+                space_break = True
+            previous_break = True
+            previous_space = False
+        else:
+            previous_space = previous_break = False
+
+        preceded_by_whitespace = ch in ' \t\0' or ch in _BREAKS
+
+    flow_plain_allowed = block_plain_allowed = single_quoted_allowed = block_allowed = True
+    if leading_space or leading_break or trailing_space or trailing_break:
+        flow_plain_allowed = block_plain_allowed = False
+    if trailing_space:
+        block_allowed = False
+    if break_space:
+        flow_plain_allowed = block_plain_allowed = single_quoted_allowed = False
+    if space_break or special_characters:
+        flow_plain_allowed = block_plain_allowed = single_quoted_allowed = block_allowed = False
+    if line_breaks:
+        flow_plain_allowed = block_plain_allowed = False
+    if flow_indicators:
+        flow_plain_allowed = False
+    if block_indicators:
+        block_plain_allowed = False
+    return _ScalarAnalysis(line_breaks, flow_plain_allowed, block_plain_allowed, single_quoted_allowed, block_allowed)
+
+def _resolve_plain(value: str) -> str:
+    """Returns the tag that a plain scalar with the given value would be resolved to."""
+    resolvers = yaml.resolver.Resolver.yaml_implicit_resolvers
+    for tag, regexp in resolvers.get(value[0] if value else '', []) + resolvers.get(None, []):
+        if regexp.match(value):
+            return tag
+    return _STR_TAG
+
+class _Scalar(typing.NamedTuple):
+    tag: typing.Optional[str] # Tag shorthand (e.g. !!float); None if the tag is implicit.
+    value: str
+    plain_implicit: bool
+    analysis: _ScalarAnalysis
+    literal: bool
+    # Whether the scalar is always written as is (untagged plain scalar without spaces).
+    simple: bool
+    # Whether the scalar can be used as a simple key.
+    simple_key_allowed: bool
+
+def _make_scalar(tag: typing.Optional[str], value: str, plain_implicit: bool, literal: bool = False) -> _Scalar:
+    analysis = _analyze_scalar(value)
+    simple = tag is None and plain_implicit and not literal and analysis.flow_plain_allowed \
+        and analysis.block_plain_allowed and value.isprintable() and ' ' not in value and value != ''
+    length = len(value.encode()) + (len(tag) if tag is not None else 0)
+    simple_key_allowed = not analysis.multiline and length <= _MAX_SIMPLE_KEY_LENGTH
+    return _Scalar(tag, value, plain_implicit, analysis, literal, simple, simple_key_allowed)
+
+class YamlEmitter:
+    """Emits a ParameterIO in the aamp YAML dialect.
+
+    reader and name_cache are used to resolve names. An emitter must not be shared between threads.
+    """
+    def __init__(self, reader=None, name_cache: typing.Optional[NameCache] = None) -> None:
+        self._strings = reader._crc32_to_string_map if reader is not None else None
+        self._name_cache = name_cache
+        self._out: typing.List[str] = []
+        self._column = 0
+        self._whitespace = True
+        self._indention = True
+        self._indent = -1
+        self._indents: typing.List[int] = []
+        self._flow_level = 0
+        self._str_scalars: typing.Dict[str, _Scalar] = dict()
+        self._float_scalars: typing.Dict[float, _Scalar] = dict()
+        self._stats = get_stats()
+        # Name resolution outcomes and time, added to the statistics at the end of emit().
+        self._name_counts: typing.Dict[str, int] = dict()
+        self._name_time = 0.0
+
+    def emit(self, pio: ParameterIO) -> str:
+        stats = self._stats
+        if stats is None:
+            self._emit_node(pio)
+        else:
+            with stats.timer('yaml.emit'):
+                self._emit_node(pio)
+            stats.add_counts(self._name_counts)
+            stats.add_time('names.resolve', self._name_time, sum(self._name_counts.values()))
+            self._name_counts = dict()
+            self._name_time = 0.0
+        # Document end.
+        self._write_indent()
+        output = ''.join(self._out)
+        self._out.clear()
+        return output
+
+    # Low-level output
+
+    def _put(self, s: str) -> None:
+        self._out.append(s)
+        self._column += len(s)
+
+    def _put_break(self) -> None:
+        self._out.append('\n')
+        self._column = 0
+
+    def _write_indicator(self, indicator: str, need_whitespace: bool, is_whitespace: bool, is_indention: bool) -> None:
+        if need_whitespace and not self._whitespace:
+            self._put(' ')
+        self._put(indicator)
+        self._whitespace = is_whitespace
+        self._indention = self._indention and is_indention
+
+    def _write_indent(self) -> None:
+        indent = self._indent if self._indent >= 0 else 0
+        if not self._indention or self._column > indent or (self._column == indent and not self._whitespace):
+            self._put_break()
+        if self._column < indent:
+            self._put(' ' * (indent - self._column))
+        self._whitespace = True
+        self._indention = True
+
+    def _write_tag(self, tag: str) -> None:
+        if not self._whitespace:
+            self._put(' ')
+        self._put(tag)
+        self._whitespace = False
+        self._indention = False
+
+    def _increase_indent(self, flow: bool, indentless: bool) -> None:
+        self._indents.append(self._indent)
+        if self._indent < 0:
+            self._indent = _BEST_INDENT if flow else 0
+        elif not indentless:
+            self._indent += _BEST_INDENT
+
+    # Nodes
+
+    def _emit_node(self, data: typing.Any, simple_key: bool = False) -> None:
+        t = type(data)
+        if t in _SCALAR_TYPES:
+            self._emit_scalar(self._get_scalar(data), simple_key)
+        elif t is ParameterIO:
+            root_list_crc32 = next(iter(data.lists.keys()))
+            self._emit_mapping('!io', [
+                ('version', data.version),
+                ('type', data.type),
+                (get_hash_to_name_map().get(root_list_crc32, root_list_crc32), next(iter(data.lists.values()))),
+            ], False)
+        elif t is ParameterList or t is LazyParameterList:
+            self._emit_mapping('!list', [
+                ('objects', self._get_named_items(data.objects, data._crc32)),
+                ('lists', self._get_named_items(data.lists, data._crc32)),
+            ], False)
+        elif t is ParameterObject or t is LazyParameterObject or t is CompactParameterObject:
+            self._emit_mapping('!obj', self._get_named_items(data.params, data._crc32), len(data.params) <= 4)
+        elif t is _NamedItems:
+            self._emit_mapping(None, data, all(_has_default_style(k) and _has_default_style(v) for k, v in data))
+        elif t is Vec2 or t is Vec3 or t is Vec4 or t is Color or t is Quat:
+            self._emit_sequence(_VECTOR_TAGS[t], yu._fields(data), True)
+        elif t is Curve:
+            self._emit_sequence('!curve', data.v, True)
+        elif t is list:
+            self._emit_sequence(None, data, all(_has_default_style(v) for v in data))
+        else:
+            raise yaml.representer.RepresenterError('cannot represent an object', data)
+
+    def _get_named_items(self, items: typing.Dict[int, typing.Any], parent_crc32: int) -> '_NamedItems':
+        if self._stats is not None:
+            return self._get_named_items_with_stats(items, parent_crc32)
+        strings = self._strings
+        name_cache = self._name_cache
+        return _NamedItems((yu.get_pstruct_name(strings, idx, k, parent_crc32, name_cache), v) for idx, (k, v) in enumerate(items.items()))
+
+    def _get_named_items_with_stats(self, items: typing.Dict[int, typing.Any], parent_crc32: int) -> '_NamedItems':
+        named_items = _NamedItems()
+        counts = self._name_counts
+        start = time.perf_counter()
+        for idx, (k, v) in enumerate(items.items()):
+            name, source = yu._get_pstruct_name_and_source(self._strings, idx, k, parent_crc32, self._name_cache)
+            counts['names.' + source] = counts.get('names.' + source, 0) + 1
+            named_items.append((name, v))
+        self._name_time += time.perf_counter() - start
+        return named_items
+
+    def _emit_mapping(self, tag: typing.Optional[str], items: typing.Sequence[typing.Tuple[typing.Any, typing.Any]], flow: bool) -> None:
+        if tag is not None:
+            self._write_tag(tag)
+        if self._flow_level or flow or not items:
+            self._write_indicator('{', True, True, False)
+            self._increase_indent(True, False)
+            self._flow_level += 1
+            first = True
+            for key, value in items:
+                if not first:
+                    self._write_indicator(',', False, False, False)
+                if self._column > _BEST_WIDTH:
+                    self._write_indent()
+                key_scalar = self._get_scalar(key) if type(key) in _SCALAR_TYPES else None
+                if key_scalar is not None and key_scalar.simple_key_allowed:
+                    self._emit_scalar(key_scalar, True)
+                    self._write_indicator(':', False, False, False)
+                else:
+                    self._write_indicator('?', True, False, False)
+                    self._emit_node(key)
+                    if self._column > _BEST_WIDTH:
+                        self._write_indent()
+                    self._write_indicator(':', True, False, False)
+                self._emit_node(value)
+                first = False
+            self._flow_level -= 1
+            self._indent = self._indents.pop()
+            self._write_indicator('}', False, False, False)
+        else:
+            self._increase_indent(False, False)
+            for key, value in items:
+                self._write_indent()
+                key_scalar = self._get_scalar(key) if type(key) in _SCALAR_TYPES else None
+                if key_scalar is not None and key_scalar.simple_key_allowed:
+                    self._emit_scalar(key_scalar, True)
+                    self._write_indicator(':', False, False, False)
+                else:
+                    self._write_indicator('?', True, False, True)
+                    self._emit_node(key)
+                    self._write_indent()
+                    self._write_indicator(':', True, False, True)
+                self._emit_node(value)
+            self._indent = self._indents.pop()
+
+    def _emit_sequence(self, tag: typing.Optional[str], items: typing.Sequence[typing.Any], flow: bool) -> None:
+        if tag is not None:
+            self._write_tag(tag)
+        if self._flow_level or flow or not items:
+            self._write_indicator('[', True, True, False)
+            self._increase_indent(True, False)
+            self._flow_level += 1
+            first = True
+            for item in items:
+                if not first:
+                    self._write_indicator(',', False, False, False)
+                if self._column > _BEST_WIDTH:
+                    self._write_indent()
+                self._emit_node(item)
+                first = False
+            self._flow_level -= 1
+            self._indent = self._indents.pop()
+            self._write_indicator(']', False, False, False)
+        else:
+            # Block sequences are only emitted as mapping values.
+            self._increase_indent(False, not self._indention)
+            for item in items:
+                self._write_indent()
+                self._write_indicator('-', True, False, True)
+                self._emit_node(item)
+            self._indent = self._indents.pop()
+
+
+    # Scalars
+
+    def _get_scalar(self, data: typing.Any) -> _Scalar:
+        t = type(data)
+        if t is str:
+            scalar = self._str_scalars.get(data)
+            if scalar is None:
+                scalar = _make_scalar(None, data, _resolve_plain(data) == _STR_TAG)
+                self._str_scalars[data] = scalar
+            return scalar
+        if t is float:
+            # 0.0 and -0.0 compare equal, so they cannot share the cache.
+            if data == 0.0:
+                return _get_float_scalar(data)
+            scalar = self._float_scalars.get(data)
+            if scalar is None:
+                scalar = _get_float_scalar(data)
+                self._float_scalars[data] = scalar
+            return scalar
+        if t is bool:
+            return _TRUE_SCALAR if data else _FALSE_SCALAR
+        if t is int:
+            return _make_scalar(None, str(data), True)
+        if t is U32:
+            return _make_scalar('!u', str(data), False)
+        if t is String32 or t is String64 or t is String256:
+            return _make_scalar(_STRING_TAGS[t], str(data), False)
+        if t is bytes:
+            return _make_scalar('!!binary', base64.encodebytes(data).decode('ascii'), False, literal=True)
+        raise yaml.representer.RepresenterError('cannot represent an object', data)
+
+    def _emit_scalar(self, scalar: _Scalar, simple_key: bool) -> None:
+        if scalar.simple:
+            if self._whitespace:
+                self._out.append(scalar.value)
+                self._column += len(scalar.value)
+            else:
+                self._out.append(' ' + scalar.value)
+                self._column += len(scalar.value) + 1
+            self._whitespace = False
+            self._indention = False
+            return
+
+        analysis = scalar.analysis
+        no_tag = scalar.tag is None
+        style = _LITERAL if scalar.literal else _PLAIN
+        if simple_key and analysis.multiline:
+            style = _DOUBLE_QUOTED
+        if style == _PLAIN:
+            if (self._flow_level and not analysis.flow_plain_allowed) \
+            or (not self._flow_level and not analysis.block_plain_allowed):
+                style = _SINGLE_QUOTED
+            if not scalar.value and (self._flow_level or simple_key):
+                style = _SINGLE_QUOTED
+            if no_tag and not scalar.plain_implicit:
+                style = _SINGLE_QUOTED
+        if style == _SINGLE_QUOTED and not analysis.single_quoted_allowed:
+            style = _DOUBLE_QUOTED
+        if style == _LITERAL and (not analysis.block_allowed or self._flow_level or simple_key):
+            style = _DOUBLE_QUOTED
+
+        if not no_tag:
+            self._write_tag(scalar.tag)
+        self._increase_indent(True, False)
+        if style == _PLAIN:
+            self._write_plain(scalar.value, not simple_key)
+        elif style == _SINGLE_QUOTED:
+            self._write_single_quoted(scalar.value, not simple_key)
+        elif style == _DOUBLE_QUOTED:
+            self._write_double_quoted(scalar.value, not simple_key)
+        else:
+            self._write_literal(scalar.value)
+        self._indent = self._indents.pop()
+
+    def _write_plain(self, value: str, allow_breaks: bool) -> None:
+        if not self._whitespace and (value or self._flow_level):
+            self._put(' ')
+        if value.isprintable() and (not allow_breaks or ' ' not in value or self._column + len(value) <= _BEST_WIDTH):
+            # Fast path: no line breaks and no folding.
+            self._put(value)
+        else:
+            spaces = breaks = False
+            for i, ch in enumerate(value):
+                if ch == ' ':
+                    if allow_breaks and not spaces and self._column > _BEST_WIDTH and value[i + 1:i + 2] != ' ':
+                        self._write_indent()
+                    else:
+                        self._put(ch)
+                    spaces = True
+                elif ch in _BREAKS:
+                    if not breaks and ch == '\n':
+                        self._put_break()
+                    self._write_break(ch)
+                    self._indention = True
+                    breaks = True
+                else:
+                    if breaks:
+                        self._write_indent()
+                    self._put(ch)
+                    self._indention = False
+                    spaces = breaks = False
+        self._whitespace = False
+        self._indention = False
+
+    def _write_single_quoted(self, value: str, allow_breaks: bool) -> None:
+        self._write_indicator("'", True, False, False)
+        spaces = breaks = False
+        last = len(value) - 1
+        for i, ch in enumerate(value):
+            if ch == ' ':
+                if allow_breaks and not spaces and self._column > _BEST_WIDTH and i != 0 and i != last \
+                and value[i + 1] != ' ':
+                    self._write_indent()
+                else:
+                    self._put(ch)
+                spaces = True
+            elif ch in _BREAKS:
+                if not breaks and ch == '\n':
+                    self._put_break()
+                self._write_break(ch)
+                self._indention = True
+                breaks = True
+            else:
+                if breaks:
+                    self._write_indent()
+                if ch == "'":
+                    self._put("'")
+                self._put(ch)
+                self._indention = False
+                spaces = breaks = False
+        if breaks:
+            self._write_indent()
+        self._write_indicator("'", False, False, False)
+
+    def _write_double_quoted(self, value: str, allow_breaks: bool) -> None:
+        self._write_indicator('"', True, False, False)
+        spaces = False
+        last = len(value) - 1
+        for i, ch in enumerate(value):
+            if not _is_printable(ch) or ch == '\ufeff' or ch in _BREAKS or ch == '"' or ch == '\\':
+                escape = _DOUBLE_QUOTED_ESCAPES.get(ch)
+                if escape is None:
+                    c = ord(ch)
+                    if c <= 0xff:
+                        escape = f'x{c:02X}'
+                    elif c <= 0xffff:
+                        escape = f'u{c:04X}'
+                    else:
+                        escape = f'U{c:08X}'
+                self._put('\\' + escape)
+                spaces = False
+            elif ch == ' ':
+                if allow_breaks and not spaces and self._column > _BEST_WIDTH and i != 0 and i != last:
+                    self._write_indent()
+                    if value[i + 1] == ' ':
+                        self._put('\\')
+                else:
+                    self._put(ch)
+                spaces = True
+            else:
+                self._put(ch)
+                spaces = False
+        self._write_indicator('"', False, False, False)
+
+    def _write_literal(self, value: str) -> None:
+        self._write_indicator('|', True, False, False)
+        # Block scalar hints.
+        if value[0] == ' ' or value[0] in _BREAKS:
+            self._put(str(_BEST_INDENT))
+        if value[-1] not in _BREAKS:
+            self._put('-')
+        elif len(value) == 1 or value[-2] in _BREAKS:
+            self._put('+')
+        self._put_break()
+        self._indention = True
+        self._whitespace = True
+        breaks = True
+        for ch in value:
+            if ch in _BREAKS:
+                self._write_break(ch)
+                self._indention = True
+                breaks = True
+            else:
+                if breaks:
+                    self._write_indent()
+                self._put(ch)
+                self._indention = False
+                breaks = False
+
+    def _write_break(self, ch: str) -> None:
+        if ch == '\n':
+            self._put_break()
+        else:
+            self._out.append(ch)
+            self._column = 0
+
+def _get_float_scalar(data: float) -> _Scalar:
+    value = yu.format_float(data)
+    implicit = _resolve_plain(value) == 'tag:yaml.org,2002:float'
+    return _make_scalar(None if implicit else '!!float', value, implicit)
+
+class _NamedItems(list):
+    """(name, value) pairs of a ParameterList or ParameterObject, emitted as a plain mapping."""
+    pass
+
+def _has_default_style(data: typing.Any) -> bool:
+    """Whether data is represented as a scalar without an explicit style
+    (collections containing only such items use the flow style)."""
+    return type(data) in _SCALAR_TYPES and type(data) is not bytes
+
+_SCALAR_TYPES = {str, float, bool, int, U32, String32, String64, String256, bytes}
+_VECTOR_TAGS = {Vec2: '!vec2', Vec3: '!vec3', Vec4: '!vec4', Color: '!color', Quat: '!quat'}
+_STRING_TAGS = {String32: '!str32', String64: '!str64', String256: '!str256'}
+_TRUE_SCALAR = _make_scalar(None, 'true', True)
+_FALSE_SCALAR = _make_scalar(None, 'false', True)
+
+def dump(pio: ParameterIO, stream: typing.BinaryIO, reader=None, name_cache: typing.Optional[NameCache] = None) -> None:
+    """Writes pio as YAML (UTF-8) to stream. reader and name_cache are used to resolve names."""
+    stream.write(dumps(pio, reader, name_cache))
+
+def dumps(pio: ParameterIO, reader=None, name_cache: typing.Optional[NameCache] = None) -> bytes:
+    """Returns pio as YAML (UTF-8). reader and name_cache are used to resolve names."""
+    return YamlEmitter(reader, name_cache).emit(pio).encode('utf-8')
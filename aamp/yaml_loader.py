@@ -0,0 +1,367 @@
+# Fast YAML loader for parameter archives.
+#
+# This builds a ParameterIO directly from the YAML event stream instead of composing a node
+# graph, constructing generic dicts and then rebuilding every mapping with hashed keys.
+# It accepts the same documents as yaml.load() with the constructors from aamp.yaml_util,
+# including merge keys (<<: *anchor), which are flattened the same way as by SafeConstructor.
+import re
+import typing
+import yaml
+from yaml.events import *
+from yaml.nodes import ScalarNode
+import zlib
+
+from aamp.parameters import *
+from aamp.stats import timer
+from aamp.yaml_emitter import _resolve_plain
+
+try:
+    from yaml.cyaml import CParser as _EventParser
+except ImportError:
+    _EventParser = yaml.BaseLoader # type: ignore
+
+_STR_TAG = 'tag:yaml.org,2002:str'
+_MERGE_TAG = 'tag:yaml.org,2002:merge'
+_INT_TAG = 'tag:yaml.org,2002:int'
+_FLOAT_TAG = 'tag:yaml.org,2002:float'
+
+_SIMPLE_INT_RE = re.compile(r'-?(?:0|[1-9][0-9]*)\Z')
+_SIMPLE_FLOAT_RE = re.compile(r'-?[0-9]+\.[0-9]*(?:[eE][-+][0-9]+)?\Z')
+
+_STRING_TYPES = {'!str32': String32, '!str64': String64, '!str256': String256}
+_VECTOR_TYPES = {'!vec2': Vec2, '!vec3': Vec3, '!vec4': Vec4, '!color': Color, '!quat': Quat}
+
+# CRC32 of "<<", to check for merge keys after keys have been hashed.
+_MERGE_KEY = zlib.crc32(b'<<')
+
+# Name -> CRC32 cache shared by all documents.
+_name_hashes: typing.Dict[str, int] = dict()
+
+def hash_name(name: str) -> int:
+    """Returns the CRC32 of a parameter structure name."""
+    h = _name_hashes.get(name)
+    if h is None:
+        h = zlib.crc32(name.encode())
+        _name_hashes[name] = h
+    return h
+
+def _is_merge_key(event) -> bool:
+    return type(event) is ScalarEvent and event.value == '<<' and \
+        (event.tag == _MERGE_TAG or (event.tag is None and event.implicit[0]))
+
+def _named_items(source: typing.Any) -> typing.Optional[typing.Dict[int, typing.Any]]:
+    """Returns the entries of a mapping that is merged into a mapping with hashed keys."""
+    if isinstance(source, ParameterObject):
+        return source.params
+    if isinstance(source, dict) and all(isinstance(k, (int, str)) for k in source):
+        return {k if isinstance(k, int) else hash_name(k): v for k, v in source.items()}
+    return None
+
+def _list_items(source: typing.Any) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    if isinstance(source, ParameterList):
+        return {'objects': source.objects, 'lists': source.lists}
+    if isinstance(source, dict) and set(source) <= {'objects', 'lists'}:
+        items = {k: _named_items(v) for k, v in source.items()}
+        return items if all(v is not None for v in items.values()) else None
+    return None
+
+def _io_items(source: typing.Any) -> typing.Optional[typing.Dict[typing.Any, typing.Any]]:
+    if isinstance(source, ParameterIO):
+        return {'type': source.type, 'version': source.version, **source.lists}
+    if isinstance(source, dict):
+        lists = _named_items({k: v for k, v in source.items() if k != 'type' and k != 'version'})
+        if lists is None:
+            return None
+        return {**{k: v for k, v in source.items() if k == 'type' or k == 'version'}, **lists}
+    return None
+
+def _dict_items(source: typing.Any) -> typing.Optional[dict]:
+    if isinstance(source, ParameterObject):
+        return source.params
+    return source if isinstance(source, dict) else None
+
+class YamlLoader:
+    """Loads a ParameterIO from a YAML document."""
+    def __init__(self, stream: typing.Union[bytes, str, typing.IO]) -> None:
+        self._parser = _EventParser(stream)
+        self._constructor = yaml.constructor.SafeConstructor()
+        self._anchors: typing.Dict[str, typing.Any] = dict()
+        self._plain_values: typing.Dict[str, typing.Any] = dict()
+        self._plain_keys: typing.Dict[str, int] = dict()
+
+    def load(self) -> ParameterIO:
+        get_event = self._parser.get_event
+        get_event() # StreamStartEvent
+        event = get_event()
+        if type(event) is StreamEndEvent:
+            raise yaml.constructor.ConstructorError(None, None, 'expected a parameter IO document, but found an empty stream', event.start_mark)
+        root_event = get_event()
+        root = self._construct(root_event)
+        if not isinstance(root, ParameterIO):
+            raise yaml.constructor.ConstructorError(None, None, 'expected a parameter IO (!io) at the document root', root_event.start_mark)
+        get_event() # DocumentEndEvent
+        event = get_event()
+        if type(event) is not StreamEndEvent:
+            raise yaml.composer.ComposerError('expected a single document in the stream', None,
+                'but found another document', event.start_mark)
+        return root
+
+    def _construct(self, event) -> typing.Any:
+        t = type(event)
+        if t is ScalarEvent:
+            value = self._construct_scalar(event)
+        elif t is MappingStartEvent:
+            tag = event.tag
+            if tag == '!obj':
+                value = self._construct_obj(event)
+            elif tag == '!list':
+                value = self._construct_list(event)
+            elif tag == '!io':
+                value = self._construct_io(event)
+            elif tag is None or tag == '!' or tag == 'tag:yaml.org,2002:map':
+                value = self._construct_dict(event)
+            else:
+                raise yaml.constructor.ConstructorError(None, None, f'could not determine a constructor for the tag {tag!r}', event.start_mark)
+        elif t is SequenceStartEvent:
+            value = self._construct_sequence(event)
+        elif t is AliasEvent:
+            try:
+                return self._anchors[event.anchor]
+            except KeyError:
+                raise yaml.composer.ComposerError(None, None, f'found undefined alias {event.anchor!r}', event.start_mark)
+        else:
+            raise yaml.constructor.ConstructorError(None, None, f'unexpected {t.__name__}', event.start_mark)
+
+        if event.anchor is not None:
+            self._anchors[event.anchor] = value
+        return value
+
+    def _construct_scalar(self, event) -> typing.Any:
+        tag = event.tag
+        value = event.value
+        if tag is None:
+            if not event.implicit[0]:
+                return value
+            try:
+                return self._plain_values[value]
+            except KeyError:
+                pass
+            tag = _resolve_plain(value)
+            if tag == _STR_TAG:
+                result = value
+            elif tag == _INT_TAG and _SIMPLE_INT_RE.match(value):
+                result = int(value)
+            elif tag == _FLOAT_TAG and _SIMPLE_FLOAT_RE.match(value):
+                result = float(value)
+            else:
+                result = self._construct_tagged_scalar(tag, event)
+            self._plain_values[value] = result
+            return result
+
+        string_type = _STRING_TYPES.get(tag)
+        if string_type is not None:
+            return string_type(value)
+        if tag == '!u':
+            return U32(int(value) if _SIMPLE_INT_RE.match(value) else self._construct_tagged_scalar(_INT_TAG, event))
+        if tag == '!':
+            return value
+        return self._construct_tagged_scalar(tag, event)
+
+    def _construct_tagged_scalar(self, tag: str, event) -> typing.Any:
+        constructor = self._constructor.yaml_constructors.get(tag)
+        if constructor is None:
+            raise yaml.constructor.ConstructorError(None, None, f'could not determine a constructor for the tag {tag!r}', event.start_mark)
+        return constructor(self._constructor, ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style))
+
+    def _construct_merge(self, event, merged: dict, get_items: typing.Callable[[typing.Any], typing.Optional[dict]]) -> None:
+        """Adds the entries of the mapping or the list of mappings that a merge key refers to.
+        Like SafeConstructor.flatten_mapping, earlier mappings in a list take precedence."""
+        value = self._construct(event)
+        for source in reversed(value if type(value) is list else [value]):
+            items = get_items(source)
+            if items is None:
+                raise yaml.constructor.ConstructorError('while constructing a mapping', None,
+                    f'expected a mapping or list of mappings for merging, but found {type(source).__name__}', event.start_mark)
+            merged.update(items)
+
+    def _construct_key(self, event) -> int:
+        """Returns the CRC32 for a parameter structure key. Integer keys are used as is."""
+        if type(event) is ScalarEvent and event.tag is None:
+            if not event.implicit[0]:
+                return hash_name(event.value)
+            try:
+                return self._plain_keys[event.value]
+            except KeyError:
+                pass
+            if event.value == '<<':
+                return _MERGE_KEY
+            key = self._construct_scalar(event)
+            result = key if isinstance(key, int) else hash_name(key) if isinstance(key, str) else None
+            if result is not None:
+                self._plain_keys[event.value] = result
+                return result
+        else:
+            if event.tag == _MERGE_TAG:
+                return _MERGE_KEY
+            key = self._construct(event)
+            if isinstance(key, int):
+                return key
+            if isinstance(key, str):
+                return hash_name(key)
+        raise yaml.constructor.ConstructorError(None, None, f'expected a name or a CRC32 as a key, but found {type(key).__name__}', event.start_mark)
+
+    def _construct_named_mapping(self, start_event) -> typing.Dict[int, typing.Any]:
+        if type(start_event) is AliasEvent:
+            # e.g. objects: *other_objects
+            value = self._construct(start_event)
+            items = _named_items(value) if isinstance(value, dict) else None
+            if items is None:
+                raise yaml.constructor.ConstructorError(None, None, 'expected a mapping', start_event.start_mark)
+            return items
+        if type(start_event) is not MappingStartEvent:
+            raise yaml.constructor.ConstructorError(None, None, 'expected a mapping', start_event.start_mark)
+        get_event = self._parser.get_event
+        construct = self._construct
+        construct_key = self._construct_key
+        d: typing.Dict[int, typing.Any] = dict()
+        merged: typing.Dict[int, typing.Any] = dict()
+        event = get_event()
+        while type(event) is not MappingEndEvent:
+            key = construct_key(event)
+            if key == _MERGE_KEY and _is_merge_key(event):
+                self._construct_merge(get_event(), merged, _named_items)
+            else:
+                d[key] = construct(get_event())
+            event = get_event()
+        if merged:
+            d = {**merged, **d}
+        if start_event.anchor is not None:
+            self._anchors[start_event.anchor] = d
+        return d
+
+    def _construct_obj(self, start_event) -> ParameterObject:
+        pobj = ParameterObject()
+        get_event = self._parser.get_event
+        construct = self._construct
+        construct_key = self._construct_key
+        params = pobj.params
+        merged: typing.Dict[int, typing.Any] = dict()
+        event = get_event()
+        while type(event) is not MappingEndEvent:
+            key = construct_key(event)
+            if key == _MERGE_KEY and _is_merge_key(event):
+                self._construct_merge(get_event(), merged, _named_items)
+            else:
+                params[key] = construct(get_event())
+            event = get_event()
+        if merged:
+            pobj.params = {**merged, **params}
+        return pobj
+
+    def _construct_list(self, start_event) -> ParameterList:
+        plist = ParameterList()
+        found_lists = found_objects = False
+        merged: typing.Dict[str, typing.Any] = dict()
+        get_event = self._parser.get_event
+        event = get_event()
+        while type(event) is not MappingEndEvent:
+            if _is_merge_key(event):
+                self._construct_merge(get_event(), merged, _list_items)
+                event = get_event()
+                continue
+            key = self._construct(event)
+            if key == 'objects':
+                plist.objects = self._construct_named_mapping(get_event())
+                found_objects = True
+            elif key == 'lists':
+                plist.lists = self._construct_named_mapping(get_event())
+                found_lists = True
+            else:
+                raise yaml.constructor.ConstructorError('while constructing a parameter list', start_event.start_mark,
+                    f'found unexpected key {key!r}', event.start_mark)
+            event = get_event()
+        if 'objects' in merged and not found_objects:
+            plist.objects = merged['objects']
+            found_objects = True
+        if 'lists' in merged and not found_lists:
+            plist.lists = merged['lists']
+            found_lists = True
+        if not found_objects or not found_lists:
+            raise yaml.constructor.ConstructorError(None, None,
+                f'parameter list is missing {"objects" if not found_objects else "lists"}', start_event.start_mark)
+        return plist
+
+    def _construct_io(self, start_event) -> ParameterIO:
+        type_: typing.Any = None
+        version: typing.Any = None
+        lists: typing.Dict[int, typing.Any] = dict()
+        merged: typing.Dict[typing.Any, typing.Any] = dict()
+        get_event = self._parser.get_event
+        event = get_event()
+        while type(event) is not MappingEndEvent:
+            if _is_merge_key(event):
+                self._construct_merge(get_event(), merged, _io_items)
+            elif type(event) is ScalarEvent and event.tag is None and event.value == 'type':
+                type_ = self._construct(get_event())
+            elif type(event) is ScalarEvent and event.tag is None and event.value == 'version':
+                version = self._construct(get_event())
+            else:
+                key = self._construct_key(event)
+                lists[key] = self._construct(get_event())
+            event = get_event()
+        if merged:
+            if type_ is None:
+                type_ = merged.pop('type', None)
+            if version is None:
+                version = merged.pop('version', None)
+            lists = {**{k: v for k, v in merged.items() if k != 'type' and k != 'version'}, **lists}
+        if type_ is None or version is None:
+            raise yaml.constructor.ConstructorError(None, None,
+                f'parameter IO is missing {"type" if type_ is None else "version"}', start_event.start_mark)
+        pio = ParameterIO(type_=type_, version=version)
+        pio.lists = lists
+        return pio
+
+    def _construct_dict(self, start_event) -> dict:
+        get_event = self._parser.get_event
+        d: dict = dict()
+        merged: dict = dict()
+        event = get_event()
+        while type(event) is not MappingEndEvent:
+            if _is_merge_key(event):
+                self._construct_merge(get_event(), merged, _dict_items)
+            else:
+                key = self._construct(event)
+                d[key] = self._construct(get_event())
+            event = get_event()
+        if merged:
+            d = {**merged, **d}
+        return d
+
+    def _construct_sequence(self, start_event) -> typing.Any:
+        get_event = self._parser.get_event
+        construct = self._construct
+        items = []
+        event = get_event()
+        while type(event) is not SequenceEndEvent:
+            items.append(construct(event))
+            event = get_event()
+
+        tag = start_event.tag
+        if tag is None or tag == '!' or tag == 'tag:yaml.org,2002:seq':
+            return items
+        if tag == '!curve':
+            return Curve(items)
+        vector_type = _VECTOR_TYPES.get(tag)
+        if vector_type is None:
+            raise yaml.constructor.ConstructorError(None, None, f'could not determine a constructor for the tag {tag!r}', start_event.start_mark)
+        try:
+            return vector_type(*items)
+        except TypeError:
+            raise yaml.constructor.ConstructorError(None, None,
+                f'too many items for {tag} ({len(items)})', start_event.start_mark) from None
+
+def load(stream: typing.Union[bytes, str, typing.IO]) -> ParameterIO:
+    """Loads a ParameterIO from a YAML document."""
+    with timer('yaml.load'):
+        return YamlLoader(stream).load()
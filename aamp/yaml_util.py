@@ -1,15 +1,21 @@
+from aamp.aamp import LazyParameterList, LazyParameterObject
 from aamp.parameters import *
-from aamp.botw_hashed_names import hash_to_name_map
-from aamp.botw_numbered_names import numbered_name_list
-import functools
+from aamp.botw_hashed_names import get_hash_to_name_map
+from aamp.botw_numbered_names import get_numbered_name_list
+from aamp.name_cache import NameCache
+import threading
+import typing
 import yaml
 import zlib
 
-def represent_float(dumper, value):
+def format_float(value: float) -> str:
     s = f'{value:g}'
     if 'e' not in s and '.' not in s:
         s += '.0'
-    return dumper.represent_scalar(u'tag:yaml.org,2002:float', s)
+    return s
+
+def represent_float(dumper, value):
+    return dumper.represent_scalar(u'tag:yaml.org,2002:float', format_float(value))
 
 # From PyYAML: https://github.com/yaml/pyyaml/blob/a9c28e0b52/lib3/yaml/representer.py
 # with the sorting code removed.
@@ -38,29 +44,121 @@ def represent_dict(dumper, mapping, flow_style=None):
     return represent_mapping(dumper, 'tag:yaml.org,2002:map', mapping, flow_style)
 
 def _fields(data) -> list:
-    return list(data.__dict__.values())
+    return [getattr(data, name) for name in data.__slots__]
+
+class NumberedNameIndex:
+    """Reverse index (CRC32 -> name) of the numbered names generated from the templates
+    in botw_numbered_names for every index in [0, size).
+
+    The index grows on demand when a larger index is looked up, up to max_size indices
+    (each index adds one name per template). Larger indices are searched for directly.
+    Lookups are thread-safe.
+    """
+    _MIN_SIZE = 64
+    DEFAULT_MAX_SIZE = 512
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.max_size = max_size
+        # CRC32 -> name and CRC32 -> index. Two dicts rather than one dict of tuples
+        # so that the garbage collector does not need to track them.
+        self._names: typing.Dict[int, str] = dict()
+        self._indices: typing.Dict[int, int] = dict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> None:
+        """Make sure that names are indexed for all indices up to size (excluded) or max_size."""
+        size = min(size, self.max_size)
+        if size <= self._size:
+            return
+        templates = get_numbered_name_list()
+        with self._lock:
+            for i in range(self._size, size):
+                for template in templates:
+                    name = template % i
+                    crc32 = zlib.crc32(name.encode())
+                    if crc32 not in self._names:
+                        self._names[crc32] = name
+                        self._indices[crc32] = i
+            # Only publish the new size once all names have been indexed.
+            self._size = max(self._size, size)
+
+    def lookup(self, max_idx: int, wanted_hash: int) -> str:
+        """Returns the numbered name with an index <= max_idx that has the wanted hash, or ''."""
+        if max_idx >= self._size:
+            self.reserve(max(max_idx + 1, 2*self._size, self._MIN_SIZE))
+        size = self._size
+        if self._indices.get(wanted_hash, max_idx + 1) <= max_idx:
+            return self._names[wanted_hash]
+        if max_idx < size:
+            return ''
+        # Indices past max_size are not indexed.
+        for template in get_numbered_name_list():
+            for i in range(size, max_idx + 1):
+                name = template % i
+                if zlib.crc32(name.encode()) == wanted_hash:
+                    return name
+        return ''
+
+numbered_name_index = NumberedNameIndex()
 
-@functools.lru_cache(maxsize=None)
 def _test_possible_numbered_names(idx: int, wanted_hash: int) -> str:
-    for nname in numbered_name_list:
-        for i in range(idx + 2):
-            possible_name = nname % i
-            if zlib.crc32(possible_name.encode()) == wanted_hash:
-                return possible_name
-    return ''
+    return numbered_name_index.lookup(idx + 1, wanted_hash)
+
+def get_pstruct_name(strings: typing.Optional[typing.Mapping[int, str]], idx: int, k: int, parent_crc32: int,
+                     name_cache: typing.Optional[NameCache]) -> typing.Union[int, str]:
+    """Returns the name of the parameter structure k (the idx-th child of parent_crc32), or k if it cannot be resolved.
 
-def _get_pstruct_name(reader, idx: int, k: int, parent_crc32: int) -> typing.Union[int, str]:
-    if reader is not None:
-        name = reader._crc32_to_string_map.get(k, None)
+    strings maps CRC32s to the strings that are known to be used (for example the strings of an archive).
+    """
+    if strings is not None:
+        name = strings.get(k, None)
         if name is not None:
             return name
 
+    hash_to_name_map = get_hash_to_name_map()
     name = hash_to_name_map.get(k, None)
     if name is not None:
         return name
 
-    # Try to guess the name from the parent parameter list name if possible.
+    if name_cache is None:
+        return _guess_pstruct_name(hash_to_name_map.get(parent_crc32, None), idx, k)
+
+    name = name_cache.get(k, None)
+    if name is not None:
+        return name
     parent_name = hash_to_name_map.get(parent_crc32, None)
+    if parent_name is None:
+        parent_name = name_cache.get(parent_crc32, None)
+    guessed_name = _guess_pstruct_name(parent_name, idx, k)
+    if isinstance(guessed_name, str):
+        name_cache.add(guessed_name)
+    return guessed_name
+
+def _get_pstruct_name_and_source(strings: typing.Optional[typing.Mapping[int, str]], idx: int, k: int, parent_crc32: int,
+                                 name_cache: typing.Optional[NameCache]) -> typing.Tuple[typing.Union[int, str], str]:
+    """Same as get_pstruct_name, but also returns how the name was resolved: 'reader_strings',
+    'exact_map', 'name_cache', 'parent_heuristic', 'numbered' or 'unresolved'. Only used for statistics."""
+    if strings is not None and k in strings:
+        source = 'reader_strings'
+    elif get_hash_to_name_map().get(k, None) is not None:
+        source = 'exact_map'
+    elif name_cache is not None and name_cache.get(k, None) is not None:
+        source = 'name_cache'
+    else:
+        source = ''
+    name = get_pstruct_name(strings, idx, k, parent_crc32, name_cache)
+    if not source:
+        if isinstance(name, int):
+            source = 'unresolved'
+        elif _test_possible_numbered_names(idx, k) == name:
+            source = 'numbered'
+        else:
+            source = 'parent_heuristic'
+    return (name, source)
+
+def _guess_pstruct_name(parent_name: typing.Optional[str], idx: int, k: int) -> typing.Union[int, str]:
+    # Try to guess the name from the parent parameter list name if possible.
     if parent_name is None:
         nname = _test_possible_numbered_names(idx, k)
         if nname:
@@ -97,15 +195,22 @@ def _get_pstruct_name(reader, idx: int, k: int, parent_crc32: int) -> typing.Uni
     # No luck. Use the CRC32 as key.
     return k
 
+# Like the converters by default, the PyYAML representers do not use the persistent name cache.
+def _get_reader_strings(dumper) -> typing.Optional[typing.Dict[int, str]]:
+    reader = dumper.__aamp_reader
+    return reader._crc32_to_string_map if reader is not None else None
+
 def represent_param_object(dumper, pobject: ParameterObject):
+    strings = _get_reader_strings(dumper)
     return represent_mapping(dumper, '!obj',
-        {_get_pstruct_name(dumper.__aamp_reader, idx, k, pobject._crc32): v for idx, (k, v) in enumerate(pobject.params.items())},
+        {get_pstruct_name(strings, idx, k, pobject._crc32, None): v for idx, (k, v) in enumerate(pobject.params.items())},
         flow_style=len(pobject.params) <= 4)
 
 def represent_param_list(dumper, plist: ParameterList):
+    strings = _get_reader_strings(dumper)
     return represent_mapping(dumper, '!list', {
-        'objects': {_get_pstruct_name(dumper.__aamp_reader, idx, k, plist._crc32): v for idx, (k, v) in enumerate(plist.objects.items())},
-        'lists': {_get_pstruct_name(dumper.__aamp_reader, idx, k, plist._crc32): v for idx, (k, v) in enumerate(plist.lists.items())},
+        'objects': {get_pstruct_name(strings, idx, k, plist._crc32, None): v for idx, (k, v) in enumerate(plist.objects.items())},
+        'lists': {get_pstruct_name(strings, idx, k, plist._crc32, None): v for idx, (k, v) in enumerate(plist.lists.items())},
     }, flow_style=False)
 
 def represent_param_io(dumper, pio: ParameterIO):
@@ -113,7 +218,7 @@ def represent_param_io(dumper, pio: ParameterIO):
     return represent_mapping(dumper, '!io', {
         'version': pio.version,
         'type': pio.type,
-        hash_to_name_map.get(root_list_crc32, root_list_crc32): next(iter(pio.lists.values())),
+        get_hash_to_name_map().get(root_list_crc32, root_list_crc32): next(iter(pio.lists.values())),
     }, flow_style=False)
 
 def _parse_yaml_dict_key(k: typing.Union[int, str]) -> int:
@@ -145,6 +250,9 @@ def register_representers(dumper, no_param_names: bool = False) -> None:
     yaml.add_representer(ParameterIO, represent_param_io, Dumper=dumper)
     yaml.add_representer(ParameterList, represent_param_list, Dumper=dumper)
     yaml.add_representer(ParameterObject, represent_param_object, Dumper=dumper)
+    yaml.add_representer(LazyParameterList, represent_param_list, Dumper=dumper)
+    yaml.add_representer(LazyParameterObject, represent_param_object, Dumper=dumper)
+    yaml.add_representer(CompactParameterObject, represent_param_object, Dumper=dumper)
     yaml.add_representer(Vec2, lambda d, data: d.represent_sequence('!vec2', _fields(data), flow_style=True), Dumper=dumper)
     yaml.add_representer(Vec3, lambda d, data: d.represent_sequence('!vec3', _fields(data), flow_style=True), Dumper=dumper)
     yaml.add_representer(Vec4, lambda d, data: d.represent_sequence('!vec4', _fields(data), flow_style=True), Dumper=dumper)
@@ -0,0 +1,233 @@
+# Yaz0 compression, which is used for most parameter archives that are shipped as standalone files
+# (the extension of compressed files starts with "s", e.g. .sbaiprog).
+#
+# A Yaz0 file is a 16-byte header (magic, big endian decompressed size, alignment, padding)
+# followed by groups of a code byte and up to 8 chunks. Each bit of the code byte (MSB first)
+# tells whether the next chunk is a literal byte (1) or a back-reference (0) to up to 0x111 bytes
+# that start at most 0x1000 bytes before the current position.
+import struct
+import typing
+
+from aamp.stats import timer
+
+_HEADER = struct.Struct('>4sII4x') # magic, decompressed size, alignment
+_MAX_DISTANCE = 0x1000
+_MAX_LENGTH = 0xff + 0x12
+_MIN_LENGTH = 3
+
+# Compression levels: (maximum number of candidates that are checked for each match, lazy matching).
+# Level 0 only stores literals.
+_LEVELS = {
+    0: (0, False),
+    1: (1, False),
+    2: (2, False),
+    3: (4, False),
+    4: (8, False),
+    5: (16, False),
+    6: (16, True),
+    7: (32, True),
+    8: (64, True),
+    9: (256, True),
+}
+DEFAULT_LEVEL = 6
+# Lazy matching is not attempted after matches that are at least this long.
+_LAZY_MAX_LENGTH = 0x20
+
+def _make_ops_table() -> typing.List[typing.Tuple[int, ...]]:
+    """Returns the chunks of each code byte: runs of literals (as their length) and back-references (0)."""
+    table = []
+    for code in range(256):
+        ops: typing.List[int] = []
+        for bit in range(7, -1, -1):
+            if code >> bit & 1:
+                if ops and ops[-1]:
+                    ops[-1] += 1
+                else:
+                    ops.append(1)
+            else:
+                ops.append(0)
+        table.append(tuple(ops))
+    return table
+
+_OPS_TABLE = _make_ops_table()
+
+def is_yaz0(data: typing.Any) -> bool:
+    return len(data) >= _HEADER.size and data[0:4] == b'Yaz0'
+
+def get_decompressed_size(data: typing.Any) -> int:
+    if not is_yaz0(data):
+        raise ValueError('Not Yaz0-compressed data')
+    return _HEADER.unpack_from(data, 0)[1]
+
+def decompress(data: typing.Any) -> bytearray:
+    """Decompresses Yaz0 data (any object that supports the buffer protocol) into a new buffer."""
+    size = get_decompressed_size(data)
+    with timer('yaz0.decompress'):
+        # Indexing and slicing bytes is faster than doing so with other buffers, and the compressed data is small.
+        return _decompress(data if type(data) is bytes else bytes(data), size)
+
+def _decompress(src: bytes, size: int) -> bytearray:
+    out = bytearray(size)
+    ops_table = _OPS_TABLE
+    s = _HEADER.size
+    o = 0
+    try:
+        while o < size:
+            code = src[s]
+            s += 1
+            for op in ops_table[code]:
+                if op:
+                    # Runs of literals are copied at once. Like other decoders, stop once the output
+                    # is full even if the code byte has more chunks (the rest is padding).
+                    if op > size - o:
+                        op = size - o
+                    out[o:o + op] = src[s:s + op]
+                    s += op
+                    o += op
+                else:
+                    b1 = src[s]
+                    start = o - ((b1 & 0xf) << 8 | src[s + 1]) - 1
+                    n = b1 >> 4
+                    if n:
+                        n += 2
+                        s += 2
+                    else:
+                        n = src[s + 2] + 0x12
+                        s += 3
+                    if start < 0:
+                        raise ValueError(f'Invalid back-reference at offset {o:#x}')
+                    if n > size - o:
+                        n = size - o
+                    distance = o - start
+                    if distance >= n:
+                        out[o:o + n] = out[start:start + n]
+                    else:
+                        # The reference overlaps the output: repeat the last distance bytes.
+                        out[o:o + n] = (out[start:o] * (n // distance + 1))[:n]
+                    o += n
+                if o >= size:
+                    break
+    except IndexError:
+        raise ValueError('Truncated Yaz0 data') from None
+    # Literal runs that are cut short by the end of the data shrink the buffer.
+    if len(out) != size:
+        raise ValueError('Truncated Yaz0 data')
+    return out
+
+def _build_chains(data: bytes) -> typing.List[int]:
+    """Returns the hash chains: for every position, the previous position that starts with the same 3 bytes, or -1."""
+    n = len(data)
+    prev = [-1] * n
+    head: typing.Dict[typing.Tuple[int, int, int], int] = dict()
+    get = head.get
+    for i, key in enumerate(zip(data, data[1:], data[2:])):
+        prev[i] = get(key, -1)
+        head[key] = i
+    return prev
+
+def compress(data: typing.Any, level: int = DEFAULT_LEVEL, alignment: int = 0) -> bytes:
+    """Compresses data with Yaz0.
+
+    level is the compression effort from 0 (store only) to 9. Higher levels check more earlier
+    occurrences (with hash chains) and use lazy matching; they compress better but are slower.
+    """
+    if level not in _LEVELS:
+        raise ValueError(f'Invalid compression level: {level} (expected 0-9)')
+    data = bytes(data)
+    max_chain, lazy = _LEVELS[level]
+    with timer('yaz0.compress'):
+        out = bytearray(_HEADER.pack(b'Yaz0', len(data), alignment))
+        if max_chain == 0:
+            _store(data, out)
+        else:
+            _compress(data, out, max_chain, lazy)
+        return bytes(out)
+
+def _store(data: bytes, out: bytearray) -> None:
+    for i in range(0, len(data), 8):
+        chunk = data[i:i + 8]
+        out.append((0xff00 >> len(chunk)) & 0xff)
+        out += chunk
+
+def _compress(data: bytes, out: bytearray, max_chain: int, lazy: bool) -> None:
+    n = len(data)
+    prev = _build_chains(data)
+    from_bytes = int.from_bytes
+
+    def match_length(candidate: int, i: int, max_length: int) -> int:
+        # Most matches are short, so a short prefix is compared first.
+        length = 16 if max_length > 16 else max_length
+        while True:
+            a = data[candidate:candidate + length]
+            b = data[i:i + length]
+            if a != b:
+                # The first differing byte is the most significant non-zero byte of a ^ b.
+                return length - ((from_bytes(a, 'big') ^ from_bytes(b, 'big')).bit_length() + 7) // 8
+            if length == max_length:
+                return length
+            length = max_length
+
+    def find_match(i: int, candidate: int, limit: int) -> typing.Tuple[int, int]:
+        """Returns the length and the position of the longest match for position i."""
+        max_length = n - i if n - i < _MAX_LENGTH else _MAX_LENGTH
+        best_length = 0
+        best_pos = 0
+        remaining = max_chain
+        while True:
+            # A candidate can only be better if it matches the byte after the current best match.
+            if data[candidate + best_length] == data[i + best_length]:
+                length = match_length(candidate, i, max_length)
+                if length > best_length:
+                    if length == max_length:
+                        return (length, candidate)
+                    best_length = length
+                    best_pos = candidate
+            remaining -= 1
+            candidate = prev[candidate]
+            if candidate < limit or not remaining:
+                return (best_length, best_pos)
+
+    i = 0
+    code_pos = len(out)
+    out.append(0)
+    code = 0
+    bit = 0x80
+    next_match: typing.Optional[typing.Tuple[int, int]] = None
+    while i < n:
+        if not bit:
+            out[code_pos] = code
+            code_pos = len(out)
+            out.append(0)
+            code = 0
+            bit = 0x80
+
+        if next_match is not None:
+            length, pos = next_match
+            next_match = None
+        else:
+            limit = i - _MAX_DISTANCE if i > _MAX_DISTANCE else 0
+            candidate = prev[i]
+            length, pos = find_match(i, candidate, limit) if candidate >= limit else (0, 0)
+        if lazy and _MIN_LENGTH <= length < _LAZY_MAX_LENGTH:
+            # Emit a literal instead if the match that starts at the next byte is longer.
+            limit = i + 1 - _MAX_DISTANCE if i + 1 > _MAX_DISTANCE else 0
+            candidate = prev[i + 1]
+            if candidate >= limit:
+                following = find_match(i + 1, candidate, limit)
+                if following[0] > length:
+                    length = 0
+                    next_match = following
+
+        if length >= _MIN_LENGTH:
+            distance = i - pos - 1
+            if length >= 0x12:
+                out += bytes((distance >> 8, distance & 0xff, length - 0x12))
+            else:
+                out += bytes(((length - 2) << 4 | distance >> 8, distance & 0xff))
+            i += length
+        else:
+            code |= bit
+            out.append(data[i])
+            i += 1
+        bit >>= 1
+    out[code_pos] = code
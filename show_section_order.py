@@ -1,9 +1,10 @@
 # Debug tool to show section order in a binary parameter archive (AAMP).
-from aamp.botw_hashed_names import hash_to_name_map
+from aamp.botw_hashed_names import get_hash_to_name_map
 import struct
 import sys
 import zlib
 
+hash_to_name_map = get_hash_to_name_map()
 for i in range(1000):
     s = f'AI_{i}'
     hash_to_name_map[zlib.crc32(s.encode())] = s
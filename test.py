@@ -1,14 +1,85 @@
 #!/usr/bin/env python3
 import os
 from pathlib import Path
+import concurrent.futures
+import json
+import struct
 import subprocess
 import sys
+import tempfile
+import time
+import yaml
+import zlib
+
+import aamp
+import aamp.__main__
+import aamp.converters
+import aamp.generator
+import aamp.stats
+import aamp.yaml_emitter
+import aamp.yaml_loader
+import aamp.yaml_util as yu
+import aamp.yaz0
+from aamp.botw_numbered_names import get_numbered_name_list
 
 def run_aamp(data: bytes) -> bytes:
-    return subprocess.run(['aamp', '-'], input=data,
+    return subprocess.run(['aamp', '--no-name-cache', '-'], input=data,
         stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
 
-for path in Path(os.path.dirname(os.path.realpath(__file__))).glob('test_data/*.b*'):
+def pyyaml_dump(data: bytes) -> bytes:
+    dumper = yaml.CDumper
+    yu.register_representers(dumper)
+    reader = aamp.Reader(data, track_strings=True)
+    dumper.__aamp_reader = reader
+    return yaml.dump(reader.parse(), Dumper=dumper, allow_unicode=True, encoding='utf-8', default_flow_style=None)
+
+def pyyaml_load(data: bytes) -> aamp.ParameterIO:
+    loader = yaml.CSafeLoader
+    yu.register_constructors(loader)
+    return yaml.load(data, Loader=loader)
+
+def stress_test_converters(paths: list, num_threads: int = 8, num_rounds: int = 4) -> None:
+    """Converts every file from several threads at once using shared converter objects
+    and checks that the results match single-threaded conversions.
+
+    This only checks correctness, not scaling: conversions are pure Python, so with the GIL
+    threads cannot run them in parallel and no speedup is expected. The throughput is only
+    printed for reference (it is meaningful on free-threaded builds).
+    """
+    to_yaml = aamp.converters.AampToYaml(use_name_cache=False)
+    to_aamp = aamp.converters.YamlToAamp()
+    inputs = [path.read_bytes() for path in paths]
+    expected = [(to_yaml.convert(data), to_aamp.convert(to_yaml.convert(data))) for data in inputs]
+
+    def convert(i: int) -> tuple:
+        yml_data = to_yaml.convert(inputs[i])
+        return (yml_data, to_aamp.convert(yml_data))
+
+    jobs = list(range(len(inputs))) * num_rounds
+    # Start from an empty numbered name index so that it is grown concurrently.
+    yu.numbered_name_index = yu.NumberedNameIndex()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = list(executor.map(convert, jobs))
+    threaded_time = time.perf_counter() - start
+    for i, result in zip(jobs, results):
+        if result != expected[i]:
+            sys.stderr.write(f'  FAIL: concurrent conversion of {paths[i].name} does not match\n')
+            sys.exit(1)
+
+    start = time.perf_counter()
+    for i in jobs:
+        convert(i)
+    serial_time = time.perf_counter() - start
+    if getattr(sys, '_is_gil_enabled', lambda: True)():
+        note = 'GIL enabled: threads cannot scale, only correctness is checked'
+    else:
+        note = 'GIL disabled'
+    print(f'concurrent conversions: {len(jobs)} conversions on {num_threads} threads, '
+          f'{serial_time / threaded_time:.2f}x the single-threaded throughput ({note})')
+
+test_paths = sorted(Path(os.path.dirname(os.path.realpath(__file__))).glob('test_data/*.b*'))
+for path in test_paths:
     print(path.name)
 
     aamp_data = path.open('rb').read()
@@ -19,3 +90,190 @@ for path in Path(os.path.dirname(os.path.realpath(__file__))).glob('test_data/*.
     if run_aamp(reconverted_aamp_data) != yml_data:
         sys.stderr.write(f'  FAIL: roundtrip conversion test failed for {path.name}\n')
         sys.exit(1)
+
+    if aamp.Writer(aamp.Reader(aamp_data).parse(lazy=True)).get_bytes() != aamp.Writer(aamp.Reader(aamp_data).parse()).get_bytes():
+        sys.stderr.write(f'  FAIL: lazy parse does not match eager parse for {path.name}\n')
+        sys.exit(1)
+    if aamp.Writer(aamp.Reader(memoryview(b'padding' + aamp_data), offset=7).parse()).get_bytes() != aamp.Writer(aamp.Reader(aamp_data).parse()).get_bytes():
+        sys.stderr.write(f'  FAIL: parsing from a memoryview at an offset does not match for {path.name}\n')
+        sys.exit(1)
+    if aamp.Writer(aamp.Reader(aamp_data).parse(compact=True)).get_bytes() != aamp.Writer(aamp.Reader(aamp_data).parse()).get_bytes():
+        sys.stderr.write(f'  FAIL: compact parse does not match eager parse for {path.name}\n')
+        sys.exit(1)
+
+    reader = aamp.Reader(aamp_data, track_strings=True)
+    if aamp.yaml_emitter.dumps(reader.parse(), reader) != pyyaml_dump(aamp_data):
+        sys.stderr.write(f'  FAIL: YAML emitter output does not match PyYAML for {path.name}\n')
+        sys.exit(1)
+
+    if aamp.Writer(aamp.yaml_loader.load(yml_data)).get_bytes() != aamp.Writer(pyyaml_load(yml_data)).get_bytes():
+        sys.stderr.write(f'  FAIL: YAML loader output does not match PyYAML for {path.name}\n')
+        sys.exit(1)
+
+# Indices past the maximum size of the numbered name index are searched for directly.
+capped_index = yu.NumberedNameIndex(max_size=8)
+numbered_name = get_numbered_name_list()[0] % 20
+if capped_index.lookup(20, zlib.crc32(numbered_name.encode())) != numbered_name or \
+        capped_index.lookup(19, zlib.crc32(numbered_name.encode())) != '' or capped_index._size != 8:
+    sys.stderr.write('  FAIL: numbered names past the maximum index size are not resolved\n')
+    sys.exit(1)
+
+# Converting a file onto itself must not truncate the (memory-mapped) source before it is read.
+with tempfile.TemporaryDirectory() as tmp_dir:
+    in_place_path = os.path.join(tmp_dir, test_paths[0].name)
+    with open(in_place_path, 'wb') as f:
+        f.write(test_paths[0].read_bytes())
+    subprocess.run(['aamp', '--no-name-cache', in_place_path, in_place_path], stderr=subprocess.PIPE, check=True)
+    with open(in_place_path, 'rb') as f:
+        if f.read() != run_aamp(test_paths[0].read_bytes()):
+            sys.stderr.write('  FAIL: in-place conversion does not match\n')
+            sys.exit(1)
+
+merge_yml = b'''!io
+version: 0
+type: xml
+param_root: !list
+  objects:
+    Base: &base !obj {A: 1, B: 2.0, C: !str32 x}
+    Derived: !obj
+      <<: *base
+      B: 3.0
+    Multi: !obj
+      <<: [*base, {A: 10, D: !u 4}]
+  lists: {}
+'''
+if aamp.Writer(aamp.yaml_loader.load(merge_yml)).get_bytes() != aamp.Writer(pyyaml_load(merge_yml)).get_bytes():
+    sys.stderr.write('  FAIL: YAML loader does not handle merge keys like PyYAML\n')
+    sys.exit(1)
+
+alias_yml = b'''!io
+version: 0
+type: xml
+param_root: !list
+  objects: &objects
+    A: !obj {X: 1}
+  lists:
+    Child: !list
+      objects: *objects
+      lists: &no_lists {}
+    Other: !list {objects: {}, lists: *no_lists}
+'''
+if aamp.Writer(aamp.yaml_loader.load(alias_yml)).get_bytes() != aamp.Writer(pyyaml_load(alias_yml)).get_bytes():
+    sys.stderr.write('  FAIL: YAML loader does not handle aliases to objects or lists like PyYAML\n')
+    sys.exit(1)
+
+patched_data = bytearray((Path(os.path.dirname(os.path.realpath(__file__))) / 'test_data/DamageReactionTable.bxml').read_bytes())
+expected_pio = aamp.Reader(bytes(patched_data)).parse()
+aamp.patch(patched_data, 'param_root/Basic/Edge/Damage', False)
+expected_pio.list('param_root').list('Basic').object('Edge').set_param('Damage', False)
+if aamp.Writer(aamp.Reader(bytes(patched_data)).parse()).get_bytes() != aamp.Writer(expected_pio).get_bytes():
+    sys.stderr.write('  FAIL: patched archive does not match\n')
+    sys.exit(1)
+
+patcher_data = bytearray((Path(os.path.dirname(os.path.realpath(__file__))) / 'test_data/DamageReactionTable.bxml').read_bytes())
+sequential_data = bytearray(patcher_data)
+patcher = aamp.Patcher(patcher_data)
+for patch_path, patch_value in (('param_root/Basic/Edge/Damage', False), ('param_root/Basic/Edge/EquipDamage', False),
+                                ('param_root/Golem/Arrow/Damage', False), ('param_root/Basic/Edge/Damage', True)):
+    patcher.patch(patch_path, patch_value)
+    aamp.patch(sequential_data, patch_path, patch_value)
+if patcher_data != sequential_data:
+    sys.stderr.write('  FAIL: Patcher does not match patch()\n')
+    sys.exit(1)
+
+damage_crc32s = tuple(zlib.crc32(name.encode()) for name in ('param_root', 'Basic', 'Edge', 'Damage'))
+original_pio = aamp.Reader((Path(os.path.dirname(os.path.realpath(__file__))) / 'test_data/DamageReactionTable.bxml').read_bytes()).parse()
+if aamp.diff(bytes(patched_data), expected_pio) != [] or aamp.diff(original_pio, patched_data) != [aamp.Change(damage_crc32s, True, False)]:
+    sys.stderr.write('  FAIL: diff of the patched archive does not match\n')
+    sys.exit(1)
+
+theirs_pio = aamp.Reader(bytes(patched_data)).parse()
+theirs_pio.list('param_root').list('Basic').object('Edge').set_param('Damage', 2)
+theirs_pio.list('param_root').list('Basic').set_object('Merged', aamp.ParameterObject())
+expected_pio.list('param_root').list('Basic').set_object('Merged', aamp.ParameterObject())
+merge_result = aamp.merge(original_pio, patched_data, theirs_pio, aamp.MergePolicy.PreferFirst)
+if aamp.diff(merge_result.pio, expected_pio) != [] or [c.path for c in merge_result.conflicts] != [damage_crc32s]:
+    sys.stderr.write('  FAIL: merged archive does not match\n')
+    sys.exit(1)
+
+buffer_pio = aamp.ParameterIO()
+buffer_pio.set_list('param_root', aamp.ParameterList())
+buffer_pio.list('param_root').set_object('Buffers', aamp.ParameterObject())
+buffers = {'Int': [1, -2, 3], 'F32': [1.5, 2.5], 'U32': [aamp.U32(7), aamp.U32(0xffffffff)], 'Binary': b'abcde'}
+for name, value in buffers.items():
+    buffer_pio.list('param_root').object('Buffers').set_param(name, value)
+buffer_data = aamp.Writer(buffer_pio).get_bytes()
+for compact in (False, True):
+    buffer_obj = aamp.Reader(buffer_data).parse(compact=compact).list('param_root').object('Buffers')
+    if any(buffer_obj.param(name) != value for name, value in buffers.items()):
+        sys.stderr.write(f'  FAIL: buffer parameters do not roundtrip (compact={compact})\n')
+        sys.exit(1)
+
+large_value = bytes(range(256)) * 32
+large_pio = aamp.ParameterIO()
+large_pio.set_list('param_root', aamp.ParameterList())
+large_pio.list('param_root').set_object('Buffers', aamp.ParameterObject())
+large_pio.list('param_root').object('Buffers').set_param('Large', large_value)
+large_size = len(aamp.Writer(large_pio).get_bytes())
+# Values that are contained in a large value must be deduplicated.
+large_pio.list('param_root').object('Buffers').set_param('Contained', aamp.Vec4(*struct.unpack_from('<4f', large_value, 0x104)))
+large_data = aamp.Writer(large_pio).get_bytes()
+if len(large_data) - large_size > 8 or aamp.Writer(aamp.Reader(large_data).parse()).get_bytes() != large_data:
+    sys.stderr.write('  FAIL: slices of large values are not deduplicated\n')
+    sys.exit(1)
+
+synthetic_data = aamp.Writer(aamp.generator.generate(seed=1)).get_bytes()
+if synthetic_data != aamp.Writer(aamp.generator.generate(seed=1)).get_bytes() or \
+        aamp.converters.yml_to_aamp(aamp.converters.aamp_to_yml(synthetic_data)) != synthetic_data:
+    sys.stderr.write('  FAIL: synthetic archive is not deterministic or does not roundtrip\n')
+    sys.exit(1)
+
+json_data = aamp.converters.aamp_to_json(synthetic_data)
+if aamp.converters.json_to_aamp(json_data) != synthetic_data:
+    sys.stderr.write('  FAIL: synthetic archive does not roundtrip through JSON\n')
+    sys.exit(1)
+
+non_finite_pio = aamp.ParameterIO()
+non_finite_pio.set_list('param_root', aamp.ParameterList())
+non_finite_pio.list('param_root').set_object('Floats', aamp.ParameterObject())
+for name, value in {'NaN': float('nan'), 'Inf': float('inf'), 'Vec': aamp.Vec3(0.0, float('-inf'), 1.0),
+                    'Buffer': [1.0, float('nan')], 'Curve': aamp.Curve([1, 2, float('inf')] + [0.0] * 29)}.items():
+    non_finite_pio.list('param_root').object('Floats').set_param(name, value)
+non_finite_data = aamp.Writer(non_finite_pio).get_bytes()
+non_finite_json = aamp.converters.aamp_to_json(non_finite_data)
+def reject_constant(name: str) -> None:
+    raise ValueError(f'{name} is not valid JSON')
+try:
+    json.loads(non_finite_json, parse_constant=reject_constant)
+    non_finite_roundtrip = aamp.converters.json_to_aamp(non_finite_json)
+except ValueError as e:
+    non_finite_roundtrip = repr(e)
+if non_finite_roundtrip != non_finite_data:
+    sys.stderr.write('  FAIL: non-finite floats do not roundtrip through JSON\n')
+    sys.exit(1)
+
+for level in (0, 1, aamp.yaz0.DEFAULT_LEVEL, 9):
+    compressed_data = aamp.yaz0.compress(synthetic_data, level)
+    if aamp.yaz0.decompress(compressed_data) != synthetic_data or \
+            aamp.Writer(aamp.Reader(compressed_data).parse()).get_bytes() != synthetic_data:
+        sys.stderr.write(f'  FAIL: Yaz0 roundtrip failed (level {level})\n')
+        sys.exit(1)
+# Decoders stop once the output is full, so chunks after the end (padding) must be ignored.
+padded_yaz0 = struct.pack('>4sII4x', b'Yaz0', 3, 0) + b'\xffABC' + bytes(12)
+if aamp.yaz0.decompress(padded_yaz0) != b'ABC':
+    sys.stderr.write('  FAIL: Yaz0 data with padding after the last chunk is rejected\n')
+    sys.exit(1)
+if aamp.__main__.is_aamp(aamp.yaz0.compress(b'', 0)) or not aamp.__main__.is_aamp(aamp.yaz0.compress(synthetic_data)):
+    sys.stderr.write('  FAIL: Yaz0-compressed archives are not detected correctly\n')
+    sys.exit(1)
+
+stats = aamp.stats.enable_stats()
+aamp.converters.yml_to_aamp(aamp.converters.aamp_to_yml(synthetic_data))
+aamp.stats.disable_stats()
+stats_dict = stats.to_dict()
+if stats_dict['counters']['reader.params'] != stats_dict['counters']['writer.params'] or \
+        sum(n for name, n in stats_dict['counters'].items() if name.startswith('names.')) == 0:
+    sys.stderr.write('  FAIL: statistics are inconsistent\n')
+    sys.exit(1)
+
+stress_test_converters(test_paths)